@@ -0,0 +1,872 @@
+import sys
+import os
+import json
+import time
+import shutil
+import platform
+import datetime
+import subprocess
+import tempfile
+import argparse
+
+# usage:
+#  python benchmark.py                                    run all the benchmarks
+#  python benchmark.py latency batch --json after.json    run some of them, save the results
+#  python benchmark.py --json after.json --compare before.json
+# the benchmarks which need a fresh interpreter run their measurement in a subprocess. every benchmark
+# returns a dict of results, --json writes them to a file along with the commit, so that runs can be compared.
+
+def current_rss_kb():
+    # resident set size of the current process, in kilobytes
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def peak_rss_kb():
+    # peak resident set size of the current process, in kilobytes, None where it's not available
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def private_dirty_kb():
+    # memory of the current process which isn't shared with any other, linux only
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+    return None
+
+def run_child(code, *args, cwd=None, env=None):
+    output = subprocess.check_output([sys.executable, '-c', code] + list(args), cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+                                     stderr=subprocess.DEVNULL, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def percentiles(values):
+    values = sorted(values)
+    result = {}
+    for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+        result[name] = values[int(fraction * (len(values) - 1))]
+    result['max'] = values[-1]
+    result['mean'] = sum(values) / len(values)
+    return result
+
+IMPORT_CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+import pinyin_jyutping_sentence
+import_time = time.perf_counter() - start
+# only the maps which are used get built, and no data artifact gets written
+pinyin_jyutping_sentence.RomanizationConversion.AUTO_BUILD_DATA = False
+start = time.perf_counter()
+pinyin_jyutping_sentence.pinyin('我很好')
+first_pinyin_time = time.perf_counter() - start
+start = time.perf_counter()
+pinyin_jyutping_sentence.jyutping('我很好')
+first_jyutping_time = time.perf_counter() - start
+try:
+    import resource
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    peak_rss_kb = None
+print(json.dumps({'import_time': import_time, 'first_pinyin_time': first_pinyin_time, 'first_jyutping_time': first_jyutping_time,
+                  'peak_rss_kb': peak_rss_kb}))
+'''
+
+def benchmark_import():
+    # fresh interpreter: import time, first pinyin() and first jyutping() calls (which load the data) and peak rss,
+    # with the binary cache, with the json cache only, and without any cache (the maps get built).
+    # runs against a copy of the package, with an empty cache directory for each state, so that the cache files
+    # of the working tree and the data artifact of the cache directory are neither used nor touched
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_files()
+    package_dir = os.path.dirname(os.path.abspath(pinyin_jyutping_sentence.__file__))
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copy_dir = os.path.join(temp_dir, 'pinyin_jyutping_sentence')
+        shutil.copytree(package_dir, copy_dir, ignore=shutil.ignore_patterns('build_cache', '__pycache__', 'mandarin_cantonese_data.*'))
+        json_filename = os.path.join(copy_dir, pinyin_jyutping_sentence.ConversionData.DATA_CACHE_FILENAME)
+        binary_filename = os.path.join(copy_dir, pinyin_jyutping_sentence.ConversionData.BINARY_DATA_CACHE_FILENAME)
+        for state in ['no_cache', 'json_cache', 'binary_cache']:
+            if state == 'json_cache':
+                rc.conversion_data.serialize(json_filename)
+            elif state == 'binary_cache':
+                os.remove(json_filename)
+                rc.write_data_artifact(rc.conversion_data, binary_filename)
+            cache_dir = os.path.join(temp_dir, f'{state}_cache')
+            environment = dict(os.environ, **{pinyin_jyutping_sentence.ConversionData.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE: cache_dir})
+            result = run_child(IMPORT_CHILD, cwd=temp_dir, env=environment)
+            results[state] = result
+            print(f"{state:12} import: {result['import_time'] * 1000:8.1f}ms first pinyin: {result['first_pinyin_time'] * 1000:8.1f}ms "
+                  f"first jyutping: {result['first_jyutping_time'] * 1000:8.1f}ms peak rss: {result['peak_rss_kb']}kB")
+    return results
+
+def get_latency_corpora():
+    # fixed corpora of short, medium and long inputs
+    return {
+        'short': get_corpus(3000, 1, 2, seed=1),
+        'medium': get_corpus(2000, 3, 8, seed=2),
+        'long': get_corpus(300, 20, 60, seed=3),
+    }
+
+def benchmark_latency():
+    # per-sentence latency percentiles of pinyin() and jyutping(), in microseconds
+    import pinyin_jyutping_sentence
+    pinyin_jyutping_sentence.warm_up(pinyin=True, jyutping=True)
+    corpora = get_latency_corpora()
+    results = {}
+    for name, function in [('pinyin', pinyin_jyutping_sentence.pinyin), ('jyutping', pinyin_jyutping_sentence.jyutping)]:
+        results[name] = {}
+        for length, sentences in corpora.items():
+            latencies = []
+            for sentence in sentences:
+                start = time.perf_counter()
+                function(sentence)
+                latencies.append((time.perf_counter() - start) * 1000000)
+            result = percentiles(latencies)
+            results[name][length] = result
+            print(f"{name:8} {length:6}: p50 {result['p50']:8.1f}us p90 {result['p90']:8.1f}us p99 {result['p99']:8.1f}us max {result['max']:8.1f}us")
+    return results
+
+def benchmark_cost_split():
+    # where the time goes, per sentence: segmentation (jieba.cut with the default segmenter), word / character
+    # lookups in get_romanization, and syllable decoding (memoized, and the underlying decode functions)
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.warm_up(pinyin=True, jyutping=True)
+    data = rc.conversion_data
+    sentences = get_corpus(5000, seed=4)
+    results = {}
+    for name, word_map, char_map, best_reading_map, decode, decode_cached in [
+            ('pinyin', data.pinyin_word_map, data.pinyin_char_map, data.pinyin_best_reading_map, rc.decode_pinyin, rc.decode_pinyin_cached),
+            ('jyutping', data.jyutping_word_map, data.jyutping_char_map, data.jyutping_best_reading_map, rc.decode_jyutping, rc.decode_jyutping_cached)]:
+        start = time.perf_counter()
+        word_lists = [rc.segmenter.segment(sentence) for sentence in sentences]
+        segment_time = time.perf_counter() - start
+
+        # the decoding is replaced with a function which returns the syllable as is
+        words = [word for word_list in word_lists for word in word_list]
+        keep_syllable = lambda syllable, tone_numbers, remove_tones: syllable
+        start = time.perf_counter()
+        for word in words:
+            rc.get_romanization(word, word_map, char_map, keep_syllable, False, False, False, best_reading_map)
+        lookup_time = time.perf_counter() - start
+
+        syllables = []
+        record_syllable = lambda syllable, tone_numbers, remove_tones: syllables.append(syllable) or syllable
+        for word in words:
+            rc.get_romanization(word, word_map, char_map, record_syllable, False, False, False, best_reading_map)
+        decode_times = {}
+        for decode_name, function in [('decode_memoized', decode_cached), ('decode_uncached', decode)]:
+            start = time.perf_counter()
+            for syllable in syllables:
+                function(syllable, False, False)
+            decode_times[decode_name] = time.perf_counter() - start
+
+        total = segment_time + lookup_time + decode_times['decode_memoized']
+        result = {
+            'segment_us': segment_time / len(sentences) * 1000000,
+            'lookup_us': lookup_time / len(sentences) * 1000000,
+            'decode_memoized_us': decode_times['decode_memoized'] / len(sentences) * 1000000,
+            'decode_uncached_us': decode_times['decode_uncached'] / len(sentences) * 1000000,
+            'segment_share': segment_time / total,
+            'lookup_share': lookup_time / total,
+            'decode_share': decode_times['decode_memoized'] / total,
+        }
+        results[name] = result
+        print(f"{name:8} per sentence: segment {result['segment_us']:7.1f}us ({result['segment_share'] * 100:4.1f}%) "
+              f"lookups {result['lookup_us']:7.1f}us ({result['lookup_share'] * 100:4.1f}%) "
+              f"decode {result['decode_memoized_us']:7.1f}us ({result['decode_share'] * 100:4.1f}%), {result['decode_uncached_us']:7.1f}us without memoization")
+    return results
+
+DATA_CACHE_CHILD = '''
+import sys, time, json
+import benchmark
+rss_start = benchmark.current_rss_kb()
+import pinyin_jyutping_sentence
+data = pinyin_jyutping_sentence.ConversionData()
+start = time.perf_counter()
+if sys.argv[1] == 'json':
+    data.deserialize(sys.argv[2])
+else:
+    data.deserialize_binary(sys.argv[2], verify=sys.argv[1] == 'verified')
+load_time = time.perf_counter() - start
+rss_loaded = benchmark.current_rss_kb()
+words = sys.argv[3:]
+start = time.perf_counter()
+for word in words:
+    if word in data.pinyin_word_map:
+        data.pinyin_word_map[word]
+    for char in word:
+        if char in data.pinyin_char_map:
+            data.pinyin_char_map[char]
+lookup_time = time.perf_counter() - start
+print(json.dumps({'load_time': load_time, 'lookup_time': lookup_time, 'rss_loaded_kb': rss_loaded - rss_start,
+                  'rss_after_lookups_kb': benchmark.current_rss_kb() - rss_start, 'peak_rss_kb': benchmark.peak_rss_kb()}))
+'''
+
+def benchmark_data_cache():
+    # compare the json cache with the memory-mapped binary cache: deserialize time, rss, lookup time
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_files()
+    words = list(rc.conversion_data.pinyin_word_map.keys())[::50]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_filename = os.path.join(temp_dir, 'data.json')
+        binary_filename = os.path.join(temp_dir, 'data.bin')
+        rc.conversion_data.serialize(json_filename)
+        rc.conversion_data.serialize_binary(binary_filename)
+        results = {'word_lookups': len(words)}
+        print(f'cache file size: json {os.path.getsize(json_filename)} bytes, binary {os.path.getsize(binary_filename)} bytes')
+        print(f'{len(words)} word lookups')
+        # verified: the checksum of the artifact is checked when loading it, like load_files does
+        for kind, filename in [('json', json_filename), ('binary', binary_filename), ('verified', binary_filename)]:
+            result = run_child(DATA_CACHE_CHILD, kind, filename, *words)
+            result['file_size'] = os.path.getsize(filename)
+            results[kind] = result
+            print(f"{kind:8} load: {result['load_time'] * 1000:8.1f}ms lookups: {result['lookup_time'] * 1000:8.1f}ms "
+                  f"rss after load: {result['rss_loaded_kb']:7}kB rss after lookups: {result['rss_after_lookups_kb']:7}kB")
+    return results
+
+def get_corpus(count, min_words=1, max_words=8, seed=0):
+    # fixed corpus of sentences, made of dictionary words, punctuation and latin text
+    import random
+    import pinyin_jyutping_sentence
+    random_generator = random.Random(seed)
+    dictionary_filename = os.path.join(os.path.dirname(pinyin_jyutping_sentence.__file__), 'cccanto-webdist-160115.txt')
+    words = []
+    with open(dictionary_filename, encoding='utf8') as filehandle:
+        for line in filehandle:
+            fields = line.split(' ')
+            if line[:1] != '#' and len(fields) > 2:
+                words.extend(fields[:2])
+    extra = ['，', '。', '？', '！', ' ', 'OK', '2020年', '的', '了', '我', '你']
+    sentences = []
+    for i in range(count):
+        word_count = random_generator.randint(min_words, max_words)
+        sentences.append(''.join(random_generator.choice(words) if random_generator.random() < 0.8 else random_generator.choice(extra) for j in range(word_count)))
+    return sentences
+
+def time_per_call(function, arguments_list, repeat=3):
+    # best of repeat runs, in microseconds per call
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for arguments in arguments_list:
+            function(*arguments)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(arguments_list) * 1000000
+
+def benchmark_char_fallback():
+    # character by character fallback of get_romanization: sorting the char map readings on every call
+    # versus the precomputed best reading map
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.warm_up(pinyin=True, jyutping=True)
+    data = rc.conversion_data
+    results = {}
+    for name, char_map, best_reading_map, function in [
+            ('pinyin', data.pinyin_char_map, data.pinyin_best_reading_map, rc.decode_pinyin),
+            ('jyutping', data.jyutping_char_map, data.jyutping_best_reading_map, rc.decode_jyutping)]:
+        chars = list(char_map.keys())[:2000]
+        # an empty word map forces the character by character path
+        sorting = time_per_call(rc.get_romanization, [(char, {}, char_map, function, True, False, False) for char in chars])
+        precomputed = time_per_call(rc.get_romanization, [(char, {}, char_map, function, True, False, False, best_reading_map) for char in chars])
+        results[name] = {'sort_readings_us': sorting, 'best_reading_map_us': precomputed}
+        print(f'{name:8} per character: sort readings {sorting:6.2f}us, best reading map {precomputed:6.2f}us')
+    return results
+
+def benchmark_decode():
+    # syllable decoding: regex and string surgery on every call versus the memoized decoders
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.warm_up(pinyin=True, jyutping=True)
+    data = rc.conversion_data
+    results = {}
+    for name, best_reading_map, function, cached_function in [
+            ('pinyin', data.pinyin_best_reading_map, rc.decode_pinyin, rc.decode_pinyin_cached),
+            ('jyutping', data.jyutping_best_reading_map, rc.decode_jyutping, rc.decode_jyutping_cached)]:
+        arguments_list = [(syllable, False, False) for syllable in list(best_reading_map.values())[:5000]]
+        uncached = time_per_call(function, arguments_list)
+        cached = time_per_call(cached_function, arguments_list)
+        results[name] = {'decode_us': uncached, 'memoized_decode_us': cached}
+        print(f'{name:8} per syllable: decode {uncached:6.2f}us, memoized decode {cached:6.2f}us')
+    return results
+
+def benchmark_tones():
+    # rendering the syllables of whole sentences: one memoized decoder call per syllable versus one render table
+    # pass over all of them, for one style and for three styles at once
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.warm_up(pinyin=True, jyutping=True)
+    data = rc.conversion_data
+    results = {}
+    styles = ['diacritics', 'tone_numbers', 'no_tones']
+    for name, best_reading_map, cached_function in [
+            ('pinyin', data.pinyin_best_reading_map, rc.decode_pinyin_cached),
+            ('jyutping', data.jyutping_best_reading_map, rc.decode_jyutping_cached)]:
+        syllables = list(best_reading_map.values())[:5000]
+        sentences = [syllables[index:index + 10] for index in range(0, len(syllables), 10)]
+        decoded = time_per_call(lambda sentence: [cached_function(syllable, False, False) for syllable in sentence], [(sentence,) for sentence in sentences])
+        rendered = time_per_call(lambda sentence: rc.render_tones(sentence, mode=name), [(sentence,) for sentence in sentences])
+        decoded_styles = time_per_call(lambda sentence: {style: [cached_function(syllable, *pinyin_jyutping_sentence.tones.DECODE_ARGUMENTS[style]) for syllable in sentence] for style in styles}, [(sentence,) for sentence in sentences])
+        rendered_styles = time_per_call(lambda sentence: rc.render_tones(sentence, mode=name, style=styles), [(sentence,) for sentence in sentences])
+        results[name] = {'decode_us': decoded, 'render_us': rendered, 'decode_3_styles_us': decoded_styles, 'render_3_styles_us': rendered_styles}
+        print(f'{name:8} per 10 syllables: memoized decode {decoded:6.2f}us, render {rendered:6.2f}us, 3 styles: {decoded_styles:6.2f}us / {rendered_styles:6.2f}us')
+    return results
+
+def benchmark_batch():
+    # sentences per second, one pinyin() / jyutping() call per sentence versus pinyin_many() / jyutping_many()
+    import pinyin_jyutping_sentence
+    pinyin_jyutping_sentence.warm_up(pinyin=True, jyutping=True)
+    sentences = get_corpus(20000)
+    results = {}
+    for name, single, many in [('pinyin', pinyin_jyutping_sentence.pinyin, pinyin_jyutping_sentence.pinyin_many),
+                               ('jyutping', pinyin_jyutping_sentence.jyutping, pinyin_jyutping_sentence.jyutping_many)]:
+        start = time.perf_counter()
+        for sentence in sentences:
+            single(sentence)
+        single_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for result in many(sentences):
+            pass
+        batch_time = time.perf_counter() - start
+        results[name] = {'single_calls_per_second': len(sentences) / single_time, 'batch_sentences_per_second': len(sentences) / batch_time}
+        print(f'{name:8} {len(sentences)} sentences: single calls {len(sentences) / single_time:8.0f}/s, batch {len(sentences) / batch_time:8.0f}/s')
+    return results
+
+def benchmark_parallel():
+    # batch throughput for an increasing number of worker processes
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.warm_up(pinyin=True, jyutping=True)
+    sentences = get_corpus(50000)
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+        worker_counts.append(worker_counts[-1] * 2)
+    results = {}
+    for workers in worker_counts:
+        start = time.perf_counter()
+        if workers == 1:
+            for result in rc.process_sentences_pinyin(sentences):
+                pass
+        else:
+            with pinyin_jyutping_sentence.ParallelConverter(rc, workers=workers) as converter:
+                for result in converter.process_sentences_pinyin(sentences):
+                    pass
+        elapsed = time.perf_counter() - start
+        results[f'{workers}_workers_sentences_per_second'] = len(sentences) / elapsed
+        print(f'{workers:3} workers: {len(sentences) / elapsed:8.0f} sentences/s')
+    return results
+
+SEGMENTER_CHILD = '''
+import sys, time, json
+import pinyin_jyutping_sentence
+rc = pinyin_jyutping_sentence.RomanizationConversion(segmenter=sys.argv[1])
+rc.ensure_loaded(pinyin=True, jyutping=True)
+start = time.perf_counter()
+rc.segmenter.initialize()
+print(json.dumps({'initialize_time': time.perf_counter() - start}))
+'''
+
+def benchmark_segmenter():
+    # jieba versus the dictionary based trie segmenter: initialization (jieba dictionary / trie index
+    # loading, in a fresh interpreter), segmentation speed, and how often the conversions agree
+    import pinyin_jyutping_sentence
+    sentences = get_corpus(20000)
+    conversions = {}
+    results = {}
+    for name in ['jieba', 'trie']:
+        initialize_time = run_child(SEGMENTER_CHILD, name)['initialize_time']
+        rc = pinyin_jyutping_sentence.RomanizationConversion(segmenter=name)
+        rc.warm_up(pinyin=True, jyutping=True)
+        start = time.perf_counter()
+        for sentence in sentences:
+            rc.segmenter.segment(sentence)
+        segment_time = time.perf_counter() - start
+        conversions[name] = list(rc.process_sentences_pinyin(sentences))
+        results[name] = {'initialize_time': initialize_time, 'segment_us': segment_time / len(sentences) * 1000000}
+        print(f'{name:6} initialize: {initialize_time * 1000:8.1f}ms segmentation: {segment_time / len(sentences) * 1000000:6.1f}us/sentence')
+    identical = sum(1 for jieba_result, trie_result in zip(conversions['jieba'], conversions['trie']) if jieba_result == trie_result)
+    results['identical_conversions'] = identical / len(sentences)
+    print(f'identical conversions: {identical / len(sentences) * 100:.1f}%')
+    return results
+
+STREAM_CHILD = '''
+import sys, json, os
+import benchmark
+import pinyin_jyutping_sentence
+pinyin_jyutping_sentence.warm_up(pinyin=True)
+rss_start = benchmark.current_rss_kb()
+with open(sys.argv[1], 'rb') as in_fh, open(os.devnull, 'wb') as out_fh:
+    stats = pinyin_jyutping_sentence.convert_stream(in_fh, out_fh, mode='pinyin')
+result = stats.as_dict()
+result['rss_kb'] = benchmark.current_rss_kb() - rss_start
+print(json.dumps(result))
+'''
+
+def benchmark_stream():
+    # convert_stream on increasingly large files: throughput, and rss growth which should stay flat
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, 'input.txt')
+        for line_count in [10000, 100000]:
+            with open(filename, 'w', encoding='utf-8') as outfile:
+                for sentence in get_corpus(line_count):
+                    outfile.write(sentence + '\n')
+            result = run_child(STREAM_CHILD, filename)
+            results[f'{line_count}_lines'] = result
+            print(f"{result['bytes'] / 1000000:6.1f}MB {result['lines']:7} lines: {result['bytes_per_second'] / 1000000:6.2f}MB/s "
+                  f"{result['lines_per_second']:8.0f} lines/s, rss growth {result['rss_kb']:7}kB")
+    return results
+
+def benchmark_async():
+    # event loop responsiveness while converting a batch: calling pinyin() in a coroutine versus apinyin / apinyin_many.
+    # a ticker coroutine measures how late it wakes up
+    import asyncio
+    import pinyin_jyutping_sentence
+    pinyin_jyutping_sentence.warm_up(pinyin=True)
+    sentences = get_corpus(5000)
+
+    async def ticker(lags, done):
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def blocking():
+        for sentence in sentences:
+            pinyin_jyutping_sentence.pinyin(sentence)
+
+    async def single():
+        await asyncio.gather(*[pinyin_jyutping_sentence.apinyin(sentence) for sentence in sentences])
+
+    async def batch():
+        async for result in pinyin_jyutping_sentence.apinyin_many(sentences):
+            pass
+
+    async def measure(function):
+        lags = []
+        done = asyncio.Event()
+        ticker_task = asyncio.ensure_future(ticker(lags, done))
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        await function()
+        elapsed = time.perf_counter() - start
+        done.set()
+        await ticker_task
+        return elapsed, max(lags)
+
+    results = {}
+    for name, function in [('blocking', blocking), ('apinyin', single), ('apinyin_many', batch)]:
+        elapsed, max_lag = asyncio.run(measure(function))
+        results[name] = {'sentences_per_second': len(sentences) / elapsed, 'max_event_loop_lag': max_lag}
+        print(f'{name:12} {len(sentences) / elapsed:8.0f} sentences/s, max event loop lag {max_lag * 1000:8.1f}ms')
+    return results
+
+def benchmark_server():
+    # cold start of a script converting one sentence versus a request to a warm conversion server
+    from pinyin_jyutping_sentence import server
+    directory = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    subprocess.check_output([sys.executable, '-c', 'import pinyin_jyutping_sentence; pinyin_jyutping_sentence.pinyin("我很好")'], cwd=directory, stderr=subprocess.DEVNULL)
+    cold_start = time.perf_counter() - start
+    print(f'cold start:          {cold_start * 1000:8.1f}ms')
+    sentences = get_corpus(1000)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path = os.path.join(temp_dir, 'server.sock')
+        process = subprocess.Popen([sys.executable, '-m', 'pinyin_jyutping_sentence', '--log-level', 'WARNING', 'serve', '--socket', socket_path],
+                                   cwd=directory, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            with server.Client(socket_path=socket_path, fallback=False) as client:
+                client.pinyin('我很好')
+                single = time_per_call(client.pinyin, [(sentence,) for sentence in sentences])
+                start = time.perf_counter()
+                client.pinyin_many(sentences)
+                batch = (time.perf_counter() - start) / len(sentences) * 1000000
+                stats = client.stats()
+        finally:
+            process.terminate()
+            process.wait()
+    print(f'server, single:      {single / 1000:8.3f}ms per sentence (server side p50 {stats["latency_p50_ms"]:.3f}ms)')
+    print(f'server, batch:       {batch / 1000:8.3f}ms per sentence')
+    return {'cold_start': cold_start, 'single_request_us': single, 'batch_per_sentence_us': batch, 'server_latency_p50_ms': stats['latency_p50_ms']}
+
+def benchmark_instrumentation():
+    # batch throughput with instrumentation disabled (the default) and enabled, and the totals it collects
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.warm_up(pinyin=True)
+    sentences = get_corpus(10000, seed=5)
+    results = {}
+    for name in ['disabled', 'enabled']:
+        if name == 'enabled':
+            rc.enable_instrumentation()
+        start = time.perf_counter()
+        for result in rc.process_sentences_pinyin(sentences):
+            pass
+        results[f'{name}_sentences_per_second'] = len(sentences) / (time.perf_counter() - start)
+        print(f"instrumentation {name:8}: {results[f'{name}_sentences_per_second']:8.0f} sentences/s")
+    stats = rc.stats()
+    results['stats'] = {key: value for key, value in stats.items() if key in pinyin_jyutping_sentence.instrumentation.COUNTERS + pinyin_jyutping_sentence.instrumentation.TIMERS}
+    print(', '.join(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}' for key, value in results['stats'].items()))
+    return results
+
+SHARED_CHILD = '''
+import sys, time, json, random
+import benchmark
+import pinyin_jyutping_sentence
+rc = pinyin_jyutping_sentence.romanization_conversion
+private_start = benchmark.private_dirty_kb()
+start = time.perf_counter()
+if sys.argv[1] == 'shared':
+    rc.attach_shared_data(sys.argv[2])
+elif sys.argv[1] == 'binary':
+    rc.conversion_data.deserialize_binary(sys.argv[2])
+else:
+    rc.conversion_data.deserialize(sys.argv[2])
+rc.pinyin_loaded = rc.jyutping_loaded = True
+ready_time = time.perf_counter() - start
+data = rc.conversion_data
+# a worker which has been running for a while has looked up a good part of the words
+words = list(data.pinyin_word_map)
+words = random.Random(0).sample(words, min(len(words), 20000))
+for word in words:
+    data.pinyin_word_map.get(word)
+    data.jyutping_word_map.get(word)
+    for char in word:
+        data.pinyin_best_reading_map.get(char)
+print(json.dumps({'ready_time': ready_time, 'private_kb': benchmark.private_dirty_kb() - private_start}))
+'''
+
+def benchmark_shared():
+    # a new worker process: time until its data is ready and the memory it doesn't share with the other
+    # workers, for a private copy loaded from the json cache, the memory-mapped cache file, and a shared
+    # memory segment published by this process. linux only (private memory from /proc)
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_files()
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_filename = os.path.join(temp_dir, 'data.json')
+        binary_filename = os.path.join(temp_dir, 'data.bin')
+        rc.conversion_data.serialize(json_filename)
+        rc.conversion_data.serialize_binary(binary_filename)
+        name = rc.publish_shared_data()
+        try:
+            for storage, argument in [('json', json_filename), ('binary', binary_filename), ('shared', name)]:
+                result = run_child(SHARED_CHILD, storage, argument)
+                results[storage] = result
+                print(f"{storage:8} worker ready in {result['ready_time'] * 1000:8.2f}ms, private memory {result['private_kb']:7}kB")
+        finally:
+            rc.conversion_data.binary_cache.unlink()
+    return results
+
+def benchmark_short_input():
+    # per-call latency of single characters and short words, with and without the short input path
+    import random
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.warm_up(pinyin=True)
+    data = rc.conversion_data
+    random_generator = random.Random(7)
+    inputs = {
+        'char': random_generator.sample(sorted(data.pinyin_char_map.keys()), 2000),
+        'word': random_generator.sample(sorted(word for word in data.pinyin_word_map.keys() if 2 <= len(word) <= 3), 2000),
+    }
+    results = {}
+    for path, max_length in [('fast', rc.SHORT_INPUT_MAX_LENGTH), ('full', 0)]:
+        rc.SHORT_INPUT_MAX_LENGTH = max_length
+        for kind, sentences in inputs.items():
+            outputs = [rc.process_sentence_pinyin(sentence) for sentence in sentences]
+            if path == 'fast':
+                results[f'{kind}_outputs'] = outputs
+            elif outputs != results.pop(f'{kind}_outputs'):
+                raise AssertionError(f'short input path: different output for {kind} inputs')
+            start = time.perf_counter()
+            for i in range(5):
+                for sentence in sentences:
+                    rc.process_sentence_pinyin(sentence)
+            results[f'{kind}_{path}_us'] = (time.perf_counter() - start) / (5 * len(sentences)) * 1e6
+            print(f"{kind} {path}: {results[f'{kind}_{path}_us']:6.2f}us per call")
+    return results
+
+def benchmark_analyze():
+    # per-sentence cost of analyze, with all the readings of every character, compared with plain pinyin
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.warm_up(pinyin=True)
+    sentences = get_corpus(5000, seed=6)
+    results = {}
+    for name, function in [('pinyin', rc.process_sentence_pinyin), ('analyze', rc.analyze)]:
+        # first pass fills the decode cache and the ranked readings
+        for sentence in sentences:
+            function(sentence)
+        start = time.perf_counter()
+        for sentence in sentences:
+            function(sentence)
+        results[f'{name}_us'] = (time.perf_counter() - start) / len(sentences) * 1e6
+        print(f"{name:8}: {results[f'{name}_us']:8.1f}us per sentence")
+    results['ratio'] = results['analyze_us'] / results['pinyin_us']
+    print(f"analyze / pinyin: {results['ratio']:.2f}")
+    return results
+
+def benchmark_word_index():
+    # word lookups like get_romanization (in, then get the syllables) on pinyin_word_map: dict, CompactWordMap, the
+    # memory-mapped table with a binary search and with the hash index. half of the words aren't in the map
+    import random
+    import pinyin_jyutping_sentence
+    from pinyin_jyutping_sentence import binary_cache, compact
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_files()
+    data = rc.conversion_data
+    word_map = dict(data.pinyin_word_map)
+    words = list(word_map.keys())[::10]
+    words += [word[::-1] + '的' for word in words]
+    random.Random(10).shuffle(words)
+    def lookup(word_map):
+        for word in words:
+            if word in word_map:
+                word_map[word]
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        maps = [('dict', word_map), ('compact', compact.CompactWordMap(compact.SyllableTable(), word_map))]
+        for name, hash_index in [('binary_search', False), ('hash', True)]:
+            filename = os.path.join(temp_dir, f'{name}.bin')
+            start = time.perf_counter()
+            binary_cache.write_binary_cache(filename, [('pinyin_word_map', binary_cache.VALUE_LIST, word_map)], hash_index)
+            results[f'{name}_build_s'] = time.perf_counter() - start
+            results[f'{name}_file_bytes'] = os.path.getsize(filename)
+            maps.append((name, binary_cache.BinaryCache(filename)['pinyin_word_map']))
+        for name, mapping in maps:
+            lookup_us = time_per_call(lookup, [(mapping,)]) / len(words)
+            results[f'{name}_lookup_us'] = lookup_us
+            results[f'{name}_python_bytes'] = compact.get_map_size(mapping)
+            print(f"{name:14} lookup: {lookup_us:6.2f}us python objects: {results[f'{name}_python_bytes'] / 1e6:6.1f}MB"
+                  + (f" file: {results[f'{name}_file_bytes'] / 1e6:5.1f}MB build: {results[f'{name}_build_s']:5.2f}s" if f'{name}_file_bytes' in results else ''))
+    return results
+
+def benchmark_segmentation_cache():
+    # every sentence converted to pinyin then jyutping, a quarter of them repeated, with and without the
+    # segmentation cache
+    import random
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.warm_up(pinyin=True, jyutping=True)
+    sentences = get_corpus(4000, seed=8)
+    sentences += random.Random(8).sample(sentences, 1000)
+    results = {}
+    for name in ['uncached', 'cached']:
+        if name == 'cached':
+            rc.enable_segmentation_cache(max_entries=10000)
+        # both passes fill the decode caches, only the timed one uses the segmentation cache
+        for sentence in get_corpus(1000, seed=9):
+            rc.process_sentence_pinyin(sentence)
+            rc.process_sentence_jyutping(sentence)
+        start = time.perf_counter()
+        for sentence in sentences:
+            rc.process_sentence_pinyin(sentence)
+            rc.process_sentence_jyutping(sentence)
+        results[f'{name}_us'] = (time.perf_counter() - start) / len(sentences) * 1e6
+        print(f"{name:8}: {results[f'{name}_us']:8.1f}us per sentence pair")
+    results['hit_rate'] = rc.segmentation_cache_stats()['hit_rate']
+    print(f"hit rate: {results['hit_rate']:.2f}")
+    return results
+
+def benchmark_convert():
+    # pinyin with diacritics, pinyin with tone numbers and jyutping for every sentence: three separate calls
+    # versus a single convert call
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.warm_up(pinyin=True, jyutping=True)
+    sentences = get_corpus(5000, seed=7)
+    separate = lambda sentence: (rc.process_sentence_pinyin(sentence), rc.process_sentence_pinyin(sentence, tone_numbers=True), rc.process_sentence_jyutping(sentence))
+    convert = lambda sentence: rc.convert(sentence, outputs=['pinyin', 'pinyin_tone_numbers', 'jyutping'])
+    results = {}
+    for name, function in [('separate', separate), ('convert', convert)]:
+        # first pass fills the decode caches and render tables
+        for sentence in sentences:
+            function(sentence)
+        start = time.perf_counter()
+        for sentence in sentences:
+            function(sentence)
+        results[f'{name}_us'] = (time.perf_counter() - start) / len(sentences) * 1e6
+        print(f"{name:8}: {results[f'{name}_us']:8.1f}us per sentence")
+    results['speedup'] = results['separate_us'] / results['convert_us']
+    print(f"speedup: {results['speedup']:.2f}")
+    return results
+
+MEMORY_CHILD = '''
+import sys, os, time, json, gc
+import benchmark
+import pinyin_jyutping_sentence
+rss_start = benchmark.current_rss_kb()
+data = pinyin_jyutping_sentence.ConversionData()
+data.COMPACT_WORD_MAPS = sys.argv[1] == 'compact'
+if sys.argv[1] == 'mapped':
+    data.deserialize_binary(sys.argv[2])
+else:
+    data.deserialize(sys.argv[2])
+gc.collect()
+rss = benchmark.current_rss_kb() - rss_start
+words = list(data.pinyin_word_map.keys()) + list(data.jyutping_word_map.keys())
+report = data.memory_report()
+result = {'rss_kb': rss, 'total_bytes': report['total_bytes'],
+          'word_maps_bytes': report['jyutping_word_map']['bytes'] + report['pinyin_word_map']['bytes'] + report['syllable_table']['bytes']}
+# a forked worker looking up every word: memory it doesn't share with the parent anymore
+gc.freeze()
+read_fd, write_fd = os.pipe()
+if os.fork() == 0:
+    private_start = benchmark.private_dirty_kb()
+    start = time.perf_counter()
+    for word_map in [data.pinyin_word_map, data.jyutping_word_map]:
+        for word in words:
+            if word in word_map:
+                word_map[word]
+    lookup_us = (time.perf_counter() - start) / len(words) / 2 * 1000000
+    os.write(write_fd, json.dumps({'worker_private_kb': benchmark.private_dirty_kb() - private_start, 'word_lookup_us': lookup_us}).encode('utf-8'))
+    os._exit(0)
+os.close(write_fd)
+with os.fdopen(read_fd) as pipe:
+    result.update(json.loads(pipe.read()))
+os.wait()
+print(json.dumps(result))
+'''
+
+def benchmark_memory():
+    # memory used by the loaded data: word maps as dicts of lists, compact word maps (interned syllable ids),
+    # and the memory-mapped binary cache. the forked worker figure is what every additional worker costs
+    # once it has looked up every word: pages it wrote to (reference counts) stop being shared. needs fork
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_files()
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_filename = os.path.join(temp_dir, 'data.json')
+        binary_filename = os.path.join(temp_dir, 'data.bin')
+        rc.conversion_data.serialize(json_filename)
+        rc.conversion_data.serialize_binary(binary_filename)
+        for storage, filename in [('lists', json_filename), ('compact', json_filename), ('mapped', binary_filename)]:
+            result = run_child(MEMORY_CHILD, storage, filename)
+            results[storage] = result
+            print(f"{storage:8} rss growth: {result['rss_kb']:7}kB word maps: {result['word_maps_bytes'] / 1024:8.0f}kB "
+                  f"all maps: {result['total_bytes'] / 1024:8.0f}kB forked worker private: {result['worker_private_kb']:7}kB "
+                  f"word lookup: {result['word_lookup_us']:5.2f}us")
+    return results
+
+def benchmark_build():
+    # cold build of the maps, per dictionary file: parsing the lines, then building the maps of each romanization
+    import jieba
+    import pinyin_jyutping_sentence
+    rc = pinyin_jyutping_sentence.RomanizationConversion()
+    rc.load_jieba_dictionary()
+    jieba.initialize()
+    module_dir = os.path.dirname(pinyin_jyutping_sentence.__file__)
+    results = {}
+    for filename, kind in rc.DICTIONARY_FILES:
+        parser = pinyin_jyutping_sentence.dictionary.DictionaryParser(kind)
+        start = time.perf_counter()
+        entries = list(parser.parse_file(os.path.join(module_dir, filename)))
+        result = {'parse_time': time.perf_counter() - start}
+        result.update(parser.report())
+        del result['malformed_examples']
+        for mode in ['pinyin', 'jyutping']:
+            if kind == 'cedict' and mode == 'jyutping':
+                continue
+            start = time.perf_counter()
+            rc.build_maps(mode, entries)
+            result[f'{mode}_build_time'] = time.perf_counter() - start
+        results[filename] = result
+        print(f"{filename:40} {result['entries']:7} entries {result['malformed']:4} malformed, parse: {result['parse_time'] * 1000:7.1f}ms "
+              + ' '.join(f"{mode}: {result[f'{mode}_build_time'] * 1000:7.1f}ms" for mode in ['pinyin', 'jyutping'] if f'{mode}_build_time' in result))
+    return results
+
+BENCHMARKS = {
+    'import': benchmark_import,
+    'data_cache': benchmark_data_cache,
+    'memory': benchmark_memory,
+    'build': benchmark_build,
+    'latency': benchmark_latency,
+    'batch': benchmark_batch,
+    'cost_split': benchmark_cost_split,
+    'char_fallback': benchmark_char_fallback,
+    'decode': benchmark_decode,
+    'tones': benchmark_tones,
+    'parallel': benchmark_parallel,
+    'segmenter': benchmark_segmenter,
+    'stream': benchmark_stream,
+    'async': benchmark_async,
+    'server': benchmark_server,
+    'instrumentation': benchmark_instrumentation,
+    'analyze': benchmark_analyze,
+    'convert': benchmark_convert,
+    'segmentation_cache': benchmark_segmentation_cache,
+    'word_index': benchmark_word_index,
+    'short_input': benchmark_short_input,
+    'shared': benchmark_shared,
+}
+
+def get_git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+        return output.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results, prefix=''):
+    # {'latency': {'pinyin': {'p50': 1.0}}} -> {'latency.pinyin.p50': 1.0}, numbers only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(previous_report, report):
+    previous = flatten(previous_report['benchmarks'])
+    current = flatten(report['benchmarks'])
+    print(f"=== compared with {previous_report.get('commit')}")
+    for key, value in current.items():
+        if key in previous:
+            ratio = f'{value / previous[key]:7.2f}x' if previous[key] != 0 else '       -'
+            print(f'{key:60} {previous[key]:14.4f} {value:14.4f} {ratio}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run, all by default: {", ".join(BENCHMARKS.keys())}')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    arguments = parser.parse_args()
+    for name in arguments.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+    report = {
+        'commit': get_git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'benchmarks': {},
+    }
+    for name in arguments.benchmarks or BENCHMARKS.keys():
+        print(f'=== {name}')
+        report['benchmarks'][name] = BENCHMARKS[name]()
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, indent=2)
+    if arguments.compare:
+        with open(arguments.compare, encoding='utf-8') as infile:
+            compare(json.load(infile), report)
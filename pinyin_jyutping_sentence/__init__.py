@@ -3,17 +3,64 @@ import jieba
 import logging
 import os
 import json
+import time
+import threading
+import functools
+import hashlib
+from . import binary_cache
+from . import caching
+from . import compact
+from . import dictionary
+from . import instrumentation
+from . import segmenter as segmenters
+from . import parallel
+from . import streaming
+from . import asynchronous
+from . import user_dictionary
+from . import analysis
+from . import tones
+from .parallel import ParallelConverter
+from .streaming import StreamStats
+from .asynchronous import AsyncConverter
 
 logger = logging.getLogger(__name__)
 
 class ConversionData():
     DATA_CACHE_FILENAME = 'mandarin_cantonese_data.json'
+    BINARY_DATA_CACHE_FILENAME = 'mandarin_cantonese_data.bin'
+    BUILD_CACHE_DIRNAME = 'build_cache'
+    # persistent user dictionary entries, see RomanizationConversion.add_entries
+    USER_DICTIONARY_FILENAME = 'mandarin_cantonese_user_data.json'
+    # directory where the data built at runtime goes: the data artifact, the build cache and the user dictionary.
+    # the package directory is never written to, it only holds the dictionaries and the artifact shipped with them
+    CACHE_DIRECTORY_ENVIRONMENT_VARIABLE = 'PINYIN_JYUTPING_SENTENCE_CACHE_DIR'
+    CACHE_DIRNAME = 'pinyin_jyutping_sentence'
+    # name of the table holding the build metadata in the data artifact, see RomanizationConversion.build_data
+    METADATA_TABLE_NAME = 'metadata'
+
+    MAP_NAMES = ['jyutping_word_map', 'pinyin_word_map', 'jyutping_char_map', 'pinyin_char_map']
+    WORD_MAP_NAMES = ['jyutping_word_map', 'pinyin_word_map']
+    BEST_READING_MAP_NAMES = ['jyutping_best_reading_map', 'pinyin_best_reading_map']
+    # store the word maps loaded from json or built from the dictionaries as compact.CompactWordMap
+    COMPACT_WORD_MAPS = True
 
     def __init__(self):
         self.jyutping_word_map = {}
         self.pinyin_word_map = {}
         self.jyutping_char_map = {}
         self.pinyin_char_map = {}
+        # character -> most frequent reading, derived from the char maps by compute_best_readings
+        self.jyutping_best_reading_map = {}
+        self.pinyin_best_reading_map = {}
+        # syllable ids of the compact word maps, shared by pinyin and jyutping
+        self.syllable_table = compact.SyllableTable()
+        # set when the maps are read-only views over the memory-mapped binary cache
+        self.binary_cache = None
+        # incremented every time the maps are loaded or modified, lets caches detect stale entries
+        self.generation = 0
+
+    def mark_modified(self):
+        self.generation += 1
 
     def get_cache_file_path(self):
         module_dir = os.path.dirname(__file__)
@@ -23,23 +70,153 @@ class ConversionData():
     def cache_file_present(self):
         return os.path.isfile(self.get_cache_file_path())
 
-    def serialize(self):
-        data = {
-            'jyutping_word_map': self.jyutping_word_map,
-            'pinyin_word_map': self.pinyin_word_map,
-            'jyutping_char_map': self.jyutping_char_map,
-            'pinyin_char_map': self.pinyin_char_map
-        }
-        with open(self.get_cache_file_path(), 'w') as outfile:
+    def get_cache_dir(self):
+        # CACHE_DIRECTORY_ENVIRONMENT_VARIABLE, or the user cache directory ($XDG_CACHE_HOME, ~/.cache)
+        cache_dir = os.environ.get(self.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE)
+        if cache_dir:
+            return cache_dir
+        user_cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(user_cache_dir, self.CACHE_DIRNAME)
+
+    def get_build_cache_dir(self):
+        # contribution of each dictionary file, see RomanizationConversion.get_file_contribution
+        return os.path.join(self.get_cache_dir(), self.BUILD_CACHE_DIRNAME)
+
+    def get_binary_cache_file_path(self):
+        # the data artifact shipped in the package
+        module_dir = os.path.dirname(__file__)
+        return os.path.join(module_dir, self.BINARY_DATA_CACHE_FILENAME)
+
+    def binary_cache_file_present(self):
+        return os.path.isfile(self.get_binary_cache_file_path())
+
+    def get_data_artifact_path(self):
+        # the data artifact built on this machine, see RomanizationConversion.build_data
+        return os.path.join(self.get_cache_dir(), self.BINARY_DATA_CACHE_FILENAME)
+
+    def get_user_dictionary_file_path(self):
+        return os.path.join(self.get_cache_dir(), self.USER_DICTIONARY_FILENAME)
+
+    def get_base_map(self, name):
+        # the map without the user dictionary overlay, which is persisted separately
+        return user_dictionary.get_base_map(getattr(self, name))
+
+    def serialize(self, filename=None):
+        # dict() so that maps loaded from the binary cache can be written too
+        data = {name: dict(self.get_base_map(name)) for name in self.MAP_NAMES}
+        with open(filename or self.get_cache_file_path(), 'w') as outfile:
             json.dump(data, outfile)
 
-    def deserialize(self):
-        with open(self.get_cache_file_path(), 'r') as input_file:
+    def deserialize(self, filename=None):
+        with open(filename or self.get_cache_file_path(), 'r') as input_file:
             data = json.load(input_file)  
             self.jyutping_word_map = data['jyutping_word_map']
             self.pinyin_word_map = data['pinyin_word_map']
             self.jyutping_char_map = data['jyutping_char_map']
             self.pinyin_char_map = data['pinyin_char_map']
+        self.compact_word_maps()
+        self.compute_best_readings()
+        self.mark_modified()
+
+    def compact_word_maps(self):
+        # replaces the word maps which are dicts of lists with the compact storage
+        if not self.COMPACT_WORD_MAPS:
+            return
+        for name in self.WORD_MAP_NAMES:
+            word_map = getattr(self, name)
+            if isinstance(word_map, dict):
+                setattr(self, name, compact.CompactWordMap(self.syllable_table, word_map))
+
+    def memory_report(self):
+        # approximate bytes of python objects used by each map, memory-mapped tables count as 0
+        report = {}
+        total = 0
+        for name in self.MAP_NAMES + self.BEST_READING_MAP_NAMES:
+            word_map = getattr(self, name)
+            size = compact.get_map_size(word_map)
+            report[name] = {'type': type(word_map).__name__, 'entries': len(word_map), 'bytes': size}
+            if isinstance(word_map, compact.CompactWordMap):
+                report[name]['sequences'] = word_map.get_sequence_count()
+            total += size
+        size = compact.get_size(self.syllable_table.syllables, set()) + compact.get_size(self.syllable_table.ids, set())
+        report['syllable_table'] = {'type': 'SyllableTable', 'entries': len(self.syllable_table), 'bytes': size}
+        report['total_bytes'] = total + size
+        return report
+
+    def get_best_reading(self, readings):
+        # on a tie, the reading seen first wins
+        return max(readings.items(), key=lambda entry: entry[1])[0]
+
+    def compute_best_readings(self, pinyin=True, jyutping=True):
+        if jyutping:
+            self.jyutping_best_reading_map = {char: self.get_best_reading(readings) for char, readings in self.jyutping_char_map.items()}
+        if pinyin:
+            self.pinyin_best_reading_map = {char: self.get_best_reading(readings) for char, readings in self.pinyin_char_map.items()}
+
+    def get_binary_tables(self, metadata=None):
+        # metadata: {name: string}, stored as an extra table
+        tables = [
+            ('jyutping_word_map', binary_cache.VALUE_LIST, self.get_base_map('jyutping_word_map')),
+            ('pinyin_word_map', binary_cache.VALUE_LIST, self.get_base_map('pinyin_word_map')),
+            ('jyutping_char_map', binary_cache.VALUE_COUNTS, self.get_base_map('jyutping_char_map')),
+            ('pinyin_char_map', binary_cache.VALUE_COUNTS, self.get_base_map('pinyin_char_map')),
+            ('jyutping_best_reading_map', binary_cache.VALUE_STRING, self.get_base_map('jyutping_best_reading_map')),
+            ('pinyin_best_reading_map', binary_cache.VALUE_STRING, self.get_base_map('pinyin_best_reading_map')),
+        ]
+        if metadata is not None:
+            tables.append((self.METADATA_TABLE_NAME, binary_cache.VALUE_STRING, metadata))
+        return tables
+
+    def serialize_binary(self, filename=None, metadata=None):
+        binary_cache.write_binary_cache(filename or self.get_binary_cache_file_path(), self.get_binary_tables(metadata))
+
+    def deserialize_binary(self, filename=None, verify=False, check=None):
+        # raises binary_cache.BinaryCacheError if the file is not a valid cache for this version.
+        # verify: check the checksum of the whole file. check(cache): called before the maps are switched to
+        # the file, raises binary_cache.BinaryCacheError to reject it
+        cache = binary_cache.BinaryCache(filename or self.get_binary_cache_file_path(), verify=verify)
+        if check is not None:
+            try:
+                check(cache)
+            except binary_cache.BinaryCacheError:
+                cache.close()
+                raise
+        self.use_binary_cache(cache)
+
+    def get_metadata(self, cache=None):
+        # {name: string} stored with the maps of a binary cache, empty when there is none
+        cache = cache or self.binary_cache
+        if cache is None or self.METADATA_TABLE_NAME not in cache:
+            return {}
+        return dict(cache[self.METADATA_TABLE_NAME])
+
+    def publish_shared(self, name=None):
+        # copies the maps into a new shared memory segment, in the binary cache layout, and switches to it.
+        # returns the name of the segment, for attach_shared in other processes
+        cache = binary_cache.SharedBinaryCache.create(self.get_binary_tables(), name)
+        self.use_binary_cache(cache)
+        return cache.name
+
+    def attach_shared(self, name):
+        # uses the maps published by another process, FileNotFoundError if there is no such segment
+        self.use_binary_cache(binary_cache.SharedBinaryCache(name))
+
+    def use_binary_cache(self, cache):
+        # switches the maps to the read-only tables of a binary_cache.BinaryCache or SharedBinaryCache
+        for name in self.MAP_NAMES:
+            if name not in cache:
+                cache.close()
+                raise binary_cache.BinaryCacheError(f'{cache.filename}: missing table {name}')
+        self.binary_cache = cache
+        for name in self.MAP_NAMES:
+            setattr(self, name, cache[name])
+        if all(name in cache for name in self.BEST_READING_MAP_NAMES):
+            for name in self.BEST_READING_MAP_NAMES:
+                setattr(self, name, cache[name])
+        else:
+            # cache file written before the best readings were stored
+            self.compute_best_readings()
+        self.mark_modified()
 
 
 class RomanizationConversion():
@@ -85,8 +262,83 @@ class RomanizationConversion():
                   6: 'u'}
         }
     
-    def __init__(self):
+    DECODE_CACHE_SIZE = 16384
+
+    # dictionary files, in the order in which they get merged, with their format
+    DICTIONARY_FILES = [
+        ("cccanto-webdist-160115.txt", 'cccanto'),
+        ("cccedict-canto-readings-150923.txt", 'cccanto'),
+        ("cedict_1_0_ts_utf-8_mdbg.txt", 'cedict'), # pinyin only
+    ]
+    # number of lines processed by a build worker at a time
+    BUILD_CHUNK_SIZE = 2000
+    # jieba dictionary, the dictionary files and it are the sources of the data artifact
+    JIEBA_DICTIONARY_FILENAME = 'dict.txt.big'
+    # bump when the way the maps are built changes, to invalidate the build cache and the data artifacts
+    BUILD_CACHE_VERSION = 1
+    # when there is no valid data artifact, the maps are built from the dictionaries, only the requested ones. once
+    # both romanizations have been built, write a data artifact to the cache directory, so that the next processes
+    # load it instead. build_data (the build-data command) builds it ahead of time
+    AUTO_BUILD_DATA = True
+    # check the checksum of the data artifacts when loading them, a few milliseconds for the whole file
+    VERIFY_DATA = True
+    # name of a shared memory segment published by publish_shared_data, used instead of the cache files when set
+    SHARED_DATA_ENVIRONMENT_VARIABLE = 'PINYIN_JYUTPING_SENTENCE_SHARED_DATA'
+    # maximum number of distinct words remembered while converting a batch of sentences
+    BATCH_WORD_CACHE_SIZE = 100000
+    # sentences up to this length which are a single character or a known word are converted without segmenting
+    SHORT_INPUT_MAX_LENGTH = 4
+    # maximum number of short inputs remembered by the short input path
+    WHOLE_WORD_MEMO_SIZE = 100000
+    # outputs of convert: the romanization, followed by a tones.STYLES style other than diacritics
+    CONVERT_OUTPUTS = {mode if style == tones.DIACRITICS else f'{mode}_{style}': (mode, style) for mode in ['pinyin', 'jyutping'] for style in tones.STYLES}
+    # characters ignored when matching the characters of a dictionary entry with its syllables
+    CHINESE_REMOVED_CHARACTERS = dictionary.CHINESE_REMOVED_CHARACTERS
+    ROMANIZATION_REMOVED_CHARACTERS = dictionary.ROMANIZATION_REMOVED_CHARACTERS
+
+    def __init__(self, segmenter='jieba'):
         self.conversion_data = ConversionData()
+        # maps are loaded lazily, on first use, see ensure_loaded
+        self.pinyin_loaded = False
+        self.jyutping_loaded = False
+        self.jieba_dictionary_loaded = False
+        # jieba tokenizer which splits the dictionary entries into words, see get_build_tokenizer
+        self.build_tokenizer = jieba.dt
+        self.load_lock = threading.RLock()
+        # the set of distinct syllables is small, decoding each (syllable, tone_numbers, remove_tones) is done only once
+        self.decode_pinyin_cached = functools.lru_cache(maxsize=self.DECODE_CACHE_SIZE)(self.decode_pinyin)
+        self.decode_jyutping_cached = functools.lru_cache(maxsize=self.DECODE_CACHE_SIZE)(self.decode_jyutping)
+        # render tables of the syllables in every tone style, see render_tones
+        self.tone_renderers = {
+            'pinyin': tones.ToneRenderer(self.decode_pinyin, self.DECODE_CACHE_SIZE),
+            'jyutping': tones.ToneRenderer(self.decode_jyutping, self.DECODE_CACHE_SIZE),
+        }
+        # optional, see enable_sentence_cache
+        self.sentence_cache = None
+        # optional, see enable_segmentation_cache
+        self.segmentation_cache = None
+        # optional, see enable_instrumentation
+        self.instrumentation = None
+        # dictionary file name -> number of entries and malformed lines, filled when the maps get built
+        self.dictionary_reports = {}
+        # entries added with add_entries / load_user_dictionary, applied over the loaded maps
+        self.user_dictionary = user_dictionary.UserDictionary(self.conversion_data.get_user_dictionary_file_path())
+        # ranked readings of the characters, for analyze
+        self.reading_index = analysis.ReadingIndex()
+        self.set_segmenter(segmenter)
+
+    def set_segmenter(self, segmenter):
+        # 'jieba': jieba.cut, the default
+        # 'trie': dictionary based segmentation against the keys of the word maps, see segmenter.TrieSegmenter
+        if segmenter not in segmenters.SEGMENTERS:
+            raise ValueError(f'unknown segmenter {segmenter}, available: {", ".join(segmenters.SEGMENTERS.keys())}')
+        self.segmenter_name = segmenter
+        self.segmenter = segmenters.SEGMENTERS[segmenter](self)
+        # (id(word_map), word) -> syllables of the word or None, see get_whole_word_syllables
+        self.whole_words = {}
+        self.whole_words_version = None
+        if len(self.user_dictionary.entries) > 0:
+            self.segmenter.add_words(self.user_dictionary.get_words(), None)
 
     def decode_pinyin(self, s, tone_numbers, remove_tones):
         if remove_tones:
@@ -136,7 +388,7 @@ class RomanizationConversion():
 
     def decode_jyutping(self, syllable, tone_numbers, remove_tones):
         if remove_tones:
-            return ''.join(i for i in s if not i.isdigit())        
+            return ''.join(i for i in syllable if not i.isdigit())
         if tone_numbers:
             return syllable
         # extract tone
@@ -169,7 +421,7 @@ class RomanizationConversion():
         result = {}
         if len(romanization) > 0:
             romanization_tokens = romanization.split(" ")
-            chinese = ''.join( c for c in chinese if  c not in ',， ' )
+            chinese = chinese.translate(self.CHINESE_REMOVED_CHARACTERS)
             chinese_characters = list(chinese)
             if len(romanization_tokens) == len(chinese_characters):
                 for pair in zip(chinese_characters, romanization_tokens):
@@ -195,14 +447,14 @@ class RomanizationConversion():
         result = {}
         if len(romanization) > 0:
             # remove unwanted characters
-            romanization = ''.join( c for c in romanization if  c not in ',，' )
-            chinese = ''.join( c for c in chinese if  c not in ',， ' )
+            romanization = romanization.translate(self.ROMANIZATION_REMOVED_CHARACTERS)
+            chinese = chinese.translate(self.CHINESE_REMOVED_CHARACTERS)
             romanization_tokens = romanization.split(" ")
             chinese_characters = list(chinese)
             if len(romanization_tokens) == len(chinese_characters):
                 #print(romanization_tokens)
                 #print(chinese_characters)
-                chinese_word_list = list(jieba.cut(chinese))
+                chinese_word_list = list(self.build_tokenizer.cut(chinese))
                 chinese_index = 0
                 for chinese_word in chinese_word_list:
                     equivalent_romanization_syllables = romanization_tokens[chinese_index:chinese_index+len(chinese_word)]
@@ -215,182 +467,787 @@ class RomanizationConversion():
         return result
         
     def process_line(self, line, jyutping_word_map, pinyin_word_map, jyutping_char_map, pinyin_char_map):
-        m = re.match('([^\s]+)\s([^\s]+)\s\[([^\]]*)\]\s\{([^\}]+)\}\s.*', line)
-        if m == None:
-            logger.info(line)
-        traditional_chinese = m.group(1)
-        simplified_chinese = m.group(2)
-        pinyin = m.group(3)
-        jyutping = m.group(4)
-        
-        
+        entry = dictionary.parse_cccanto_line(line)
+        if entry is None:
+            logger.warning('malformed dictionary line: %s', line)
+            return
+        self.process_entry(entry, jyutping_word_map, pinyin_word_map, jyutping_char_map, pinyin_char_map)
+
+    def process_cedict_line(self, line, pinyin_word_map, pinyin_char_map):
+        entry = dictionary.parse_cedict_line(line)
+        if entry is None:
+            logger.warning('malformed dictionary line: %s', line)
+            return
+        self.process_entry(entry, None, pinyin_word_map, None, pinyin_char_map)
+
+    def process_entry(self, entry, jyutping_word_map, pinyin_word_map, jyutping_char_map, pinyin_char_map):
+        # adds a dictionary.DictionaryEntry to the maps which aren't None
+        traditional_chinese = entry.traditional
+        simplified_chinese = entry.simplified
+        pinyin = entry.pinyin
+        jyutping = entry.jyutping
+        # most entries are identical in traditional and simplified, their tokens only need to be computed once
+        same_characters = traditional_chinese == simplified_chinese
+
         # process full words with tokens
         # ==============================
 
         # jyutping, process both traditional and simplified
         # -------------------------------------------------
 
-        jyutping_traditional_token_map = self.get_token_map(traditional_chinese, jyutping)
-        jyutping_simplified_token_map = self.get_token_map(simplified_chinese, jyutping)
-        jyutping_word_map.update(jyutping_traditional_token_map)
-        jyutping_word_map.update(jyutping_simplified_token_map)
+        if jyutping_word_map is not None and jyutping is not None:
+            jyutping_word_map.update(self.get_token_map(traditional_chinese, jyutping))
+            if not same_characters:
+                jyutping_word_map.update(self.get_token_map(simplified_chinese, jyutping))
 
         # pinyin, process both traditional and simplified
         # -----------------------------------------------
 
-        pinyin_simplified_token_map = self.get_token_map(simplified_chinese, pinyin)
-        pinyin_traditional_token_map = self.get_token_map(traditional_chinese, pinyin)
-        
-        pinyin_word_map.update(pinyin_simplified_token_map)
-        pinyin_word_map.update(pinyin_traditional_token_map)
-        
+        if pinyin_word_map is not None:
+            pinyin_word_map.update(self.get_token_map(simplified_chinese, pinyin))
+            if not same_characters:
+                pinyin_word_map.update(self.get_token_map(traditional_chinese, pinyin))
+
         # process character by character
         # ==============================
 
         # jyutping
         # --------
 
-        self.get_character_map(traditional_chinese, jyutping, jyutping_char_map)
-        self.get_character_map(simplified_chinese, jyutping, jyutping_char_map)
+        if jyutping_char_map is not None and jyutping is not None:
+            self.get_character_map(traditional_chinese, jyutping, jyutping_char_map)
+            self.get_character_map(simplified_chinese, jyutping, jyutping_char_map)
 
         # pinyin
         # ------
 
-        self.get_character_map(simplified_chinese, pinyin, pinyin_char_map)
-        self.get_character_map(traditional_chinese, pinyin, pinyin_char_map)
+        if pinyin_char_map is not None:
+            self.get_character_map(simplified_chinese, pinyin, pinyin_char_map)
+            self.get_character_map(traditional_chinese, pinyin, pinyin_char_map)
 
+    def process_file(self, filename, pinyin=True, jyutping=True):
+        # pinyin / jyutping select which maps get populated, so that a single romanization
+        # can be built without paying for the other one
+        logger.info("opening file %s", filename)
+        data = self.conversion_data
+        parser = dictionary.DictionaryParser('cccanto')
+        for entry in parser.parse_file(filename):
+            self.process_entry(entry,
+                               data.jyutping_word_map if jyutping else None,
+                               data.pinyin_word_map if pinyin else None,
+                               data.jyutping_char_map if jyutping else None,
+                               data.pinyin_char_map if pinyin else None)
+        self.report_malformed_lines(filename, parser)
 
-    def process_cedict_line(self, line, pinyin_word_map, pinyin_char_map):
-        m = re.match('([^\s]+)\s([^\s]+)\s\[([^\]]*)\]\s\/([^\/]+)\/.*', line)
-        if m == None:
-            logger.info(line)
-        traditional_chinese = m.group(1)
-        simplified_chinese = m.group(2)
-        pinyin = m.group(3)
-        definition = m.group(4)        
-        
-        # process full words with tokens
-        # ==============================
+    def process_cedict_file(self, filename):
+        logger.info("opening file %s", filename)
+        parser = dictionary.DictionaryParser('cedict')
+        for entry in parser.parse_file(filename):
+            self.process_entry(entry, None, self.conversion_data.pinyin_word_map, None, self.conversion_data.pinyin_char_map)
+        self.report_malformed_lines(filename, parser)
 
-        # pinyin, process both traditional and simplified
-        # -----------------------------------------------
+    def report_malformed_lines(self, filename, parser):
+        report = parser.report()
+        self.dictionary_reports[filename] = report
+        if report['malformed'] > 0:
+            logger.warning('%s: skipped %d malformed lines, for instance: %s', filename, report['malformed'], report['malformed_examples'][0])
 
-        pinyin_simplified_token_map = self.get_token_map(simplified_chinese, pinyin)
-        pinyin_traditional_token_map = self.get_token_map(traditional_chinese, pinyin)
-        
-        pinyin_word_map.update(pinyin_simplified_token_map)
-        pinyin_word_map.update(pinyin_traditional_token_map)
-        
-        # process character by character
-        # ==============================
+    def load_jieba_dictionary(self):
+        # only done once, jieba.set_dictionary resets the jieba tokenizer
+        if self.jieba_dictionary_loaded:
+            return
+        module_dir = os.path.dirname(__file__)
+        logger.debug('START loading jieba with dict.txt.big')
+        jieba_big_dictionary_filename = os.path.join(module_dir, self.JIEBA_DICTIONARY_FILENAME)
+        jieba.set_dictionary(jieba_big_dictionary_filename)
+        logger.debug('DONE loading jieba with dict.txt.big')
+        self.jieba_dictionary_loaded = True
 
-        # pinyin
-        # ------
+    def get_build_tokenizer(self):
+        # the global jieba tokenizer, unless the jieba segmenter added user dictionary words to it: they would end
+        # up in the maps built after that, in the build cache and in the data artifact. a separate tokenizer with
+        # only the jieba dictionary is used then
+        self.load_jieba_dictionary()
+        if segmenters.jieba_user_words_added and self.build_tokenizer is jieba.dt:
+            logger.debug('user words were added to jieba, loading a separate tokenizer to build the maps')
+            module_dir = os.path.dirname(__file__)
+            self.build_tokenizer = jieba.Tokenizer(os.path.join(module_dir, self.JIEBA_DICTIONARY_FILENAME))
+        # initialized before forking the build workers, they inherit it
+        self.build_tokenizer.initialize()
+        return self.build_tokenizer
 
-        self.get_character_map(simplified_chinese, pinyin, pinyin_char_map)
-        self.get_character_map(traditional_chinese, pinyin, pinyin_char_map)
+    def merge_word_map(self, word_map, other_word_map):
+        # same result as if the entries of other_word_map had been processed after the ones of word_map
+        word_map.update(other_word_map)
 
-        
-    def process_file(self, filename):
-        logger.info("opening file %s", filename)
-        with open(filename, 'r', encoding="utf8") as filehandle:
-            for line in filehandle:
-                first_char = line[:1]
-                if first_char != '#' and line != "and add boilerplate:\n":
-                    self.process_line(line,
-                                      self.conversion_data.jyutping_word_map, 
-                                      self.conversion_data.pinyin_word_map, 
-                                      self.conversion_data.jyutping_char_map, 
-                                      self.conversion_data.pinyin_char_map)
-                    
-    def process_cedict_file(self, filename):
-        logger.info("opening file %s", filename)
-        with open(filename, 'r', encoding="utf8") as filehandle:
-            for line in filehandle:
-                first_char = line[:1]
-                if first_char != '#':
-                    self.process_cedict_line(line,
-                                            self.conversion_data.pinyin_word_map, 
-                                            self.conversion_data.pinyin_char_map)
-        
-    def load_files(self):
-        if self.conversion_data.cache_file_present():
-            logger.debug('loading cached data')
-            self.conversion_data.deserialize()
+    def merge_char_map(self, char_map, other_char_map):
+        # adds up the counts, readings not seen before are added in order, so that ties resolve the same way
+        for char, readings in other_char_map.items():
+            if char not in char_map:
+                char_map[char] = dict(readings)
+            else:
+                char_readings = char_map[char]
+                for rom, count in readings.items():
+                    char_readings[rom] = char_readings.get(rom, 0) + count
+
+    def build_maps(self, mode, entries):
+        # (word_map, char_map) for one romanization out of a list of dictionary.DictionaryEntry
+        word_map = {}
+        char_map = {}
+        for entry in entries:
+            if mode == 'pinyin':
+                self.process_entry(entry, None, word_map, None, char_map)
+            else:
+                self.process_entry(entry, word_map, None, char_map, None)
+        return word_map, char_map
+
+    def get_file_digest(self, filename):
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as filehandle:
+            for block in iter(lambda: filehandle.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get_file_contribution(self, filename, kind, mode, jieba_dictionary_digest, workers):
+        # the (word_map, char_map) which one dictionary file contributes to one romanization. cached
+        # by content, so that updating one dictionary only rebuilds its own contribution.
+        key = hashlib.sha256(f'{self.BUILD_CACHE_VERSION} {kind} {mode} {self.get_file_digest(filename)} {jieba_dictionary_digest}'.encode('utf-8')).hexdigest()
+        build_cache_dir = self.conversion_data.get_build_cache_dir()
+        cache_filename = os.path.join(build_cache_dir, f'{key}.json')
+        if os.path.isfile(cache_filename):
+            logger.debug(f'loading cached {mode} contribution of {filename}')
+            with open(cache_filename, 'r', encoding='utf8') as input_file:
+                data = json.load(input_file)
+            if 'report' in data:
+                self.dictionary_reports[filename] = data['report']
+            return data['word_map'], data['char_map']
+
+        logger.debug(f'START processing {filename} ({mode})')
+        parser = dictionary.DictionaryParser(kind)
+        entries = list(parser.parse_file(filename))
+        self.report_malformed_lines(filename, parser)
+        chunks = [entries[i:i + self.BUILD_CHUNK_SIZE] for i in range(0, len(entries), self.BUILD_CHUNK_SIZE)]
+        if workers > 1 and len(chunks) > 1:
+            results = parallel.build_chunks(self, [(mode, chunk) for chunk in chunks], workers)
         else:
-            module_dir = os.path.dirname(__file__)
-            
-            logger.debug('START loading jieba with dict.txt.big')
-            jieba_big_dictionary_filename = os.path.join(module_dir, "dict.txt.big")
-            jieba.set_dictionary(jieba_big_dictionary_filename)
-            logger.debug('DONE loading jieba with dict.txt.big')
-            
-            filename = os.path.join(module_dir, "cccanto-webdist-160115.txt")
-            logger.debug(f'START processing {filename}')
-            self.process_file(filename)
-            logger.debug(f'DONE processing {filename}')
-
-            filename = os.path.join(module_dir, "cccedict-canto-readings-150923.txt")
-            logger.debug(f'START processing {filename}')
-            self.process_file(filename)
-            logger.debug(f'DONE processing {filename}')
-            # pinyin only
-            filename = os.path.join(module_dir, "cedict_1_0_ts_utf-8_mdbg.txt")
-            logger.debug(f'START processing {filename}')
-            self.process_cedict_file(filename)
-            logger.debug(f'DONE processing {filename}')
+            results = [self.build_maps(mode, chunk) for chunk in chunks]
+        # merge in chunk order, the result is identical to a serial build
+        word_map = {}
+        char_map = {}
+        for chunk_word_map, chunk_char_map in results:
+            self.merge_word_map(word_map, chunk_word_map)
+            self.merge_char_map(char_map, chunk_char_map)
+        logger.debug(f'DONE processing {filename} ({mode})')
 
-        
-    def get_romanization(self, chinese, word_map, char_map, processing_function, tone_numbers, spaces, remove_tones):
-        logger.debug(f'get_romanization: [{chinese}] tone_numbers: {tone_numbers} spaces: {spaces} remove_tones: {remove_tones}')
+        try:
+            os.makedirs(build_cache_dir, exist_ok=True)
+            content = json.dumps({'word_map': word_map, 'char_map': char_map, 'report': parser.report()})
+            binary_cache.write_file(cache_filename, content.encode('utf8'))
+        except OSError as e:
+            logger.warning('could not write build cache file %s: %s', cache_filename, e)
+        return word_map, char_map
+
+    def load_files(self, pinyin=True, jyutping=True, workers=None):
+        # only loads the maps which are requested and not loaded yet.
+        # workers: number of processes used to build the maps when there is no cache file, all cores by default
+        with self.load_lock:
+            pinyin = pinyin and not self.pinyin_loaded
+            jyutping = jyutping and not self.jyutping_loaded
+            if not pinyin and not jyutping:
+                return
+            shared_data_name = os.environ.get(self.SHARED_DATA_ENVIRONMENT_VARIABLE)
+            if shared_data_name:
+                try:
+                    logger.debug('attaching shared data %s', shared_data_name)
+                    self.attach_shared_data(shared_data_name)
+                    return
+                except (ImportError, OSError, binary_cache.BinaryCacheError) as e:
+                    logger.warning('could not attach shared data %s, ignoring it: %s', shared_data_name, e)
+            data = self.conversion_data
+            # the artifact built on this machine first, then the one shipped in the package
+            for filename in [data.get_data_artifact_path(), data.get_binary_cache_file_path()]:
+                if not os.path.isfile(filename):
+                    continue
+                try:
+                    logger.debug('loading data artifact %s', filename)
+                    data.deserialize_binary(filename, verify=self.VERIFY_DATA, check=self.check_data_artifact)
+                    self.apply_user_dictionary(['pinyin', 'jyutping'])
+                    self.pinyin_loaded = True
+                    self.jyutping_loaded = True
+                    return
+                except binary_cache.BinaryCacheError as e:
+                    logger.warning('could not load data artifact, ignoring it: %s', e)
+            if data.cache_file_present():
+                # the cache file contains all the maps
+                logger.debug('loading cached data')
+                data.deserialize()
+                self.apply_user_dictionary(['pinyin', 'jyutping'])
+                self.pinyin_loaded = True
+                self.jyutping_loaded = True
+                return
+
+            self.build_conversion_data(data, pinyin, jyutping, workers)
+            # once both romanizations are built, the ones built earlier included. the user entries are never written
+            if self.AUTO_BUILD_DATA and (pinyin or self.pinyin_loaded) and (jyutping or self.jyutping_loaded):
+                try:
+                    self.write_data_artifact(data, data.get_data_artifact_path())
+                except OSError as e:
+                    logger.warning('could not write data artifact %s: %s', data.get_data_artifact_path(), e)
+            self.apply_user_dictionary([mode for mode, loaded in [('jyutping', jyutping), ('pinyin', pinyin)] if loaded])
+
+            self.pinyin_loaded = self.pinyin_loaded or pinyin
+            self.jyutping_loaded = self.jyutping_loaded or jyutping
+
+    def build_conversion_data(self, data, pinyin, jyutping, workers):
+        # builds the maps of the requested romanizations from the dictionary files into data.
+        # workers: number of processes, all cores when None
+        module_dir = os.path.dirname(__file__)
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self.get_build_tokenizer()
+        jieba_dictionary_digest = self.get_file_digest(os.path.join(module_dir, self.JIEBA_DICTIONARY_FILENAME))
+
+        modes = []
+        if jyutping:
+            modes.append(('jyutping', data.jyutping_word_map, data.jyutping_char_map))
+        if pinyin:
+            modes.append(('pinyin', data.pinyin_word_map, data.pinyin_char_map))
+        for mode, word_map, char_map in modes:
+            for filename, kind in self.DICTIONARY_FILES:
+                if kind == 'cedict' and mode == 'jyutping':
+                    continue
+                filename = os.path.join(module_dir, filename)
+                file_word_map, file_char_map = self.get_file_contribution(filename, kind, mode, jieba_dictionary_digest, workers)
+                self.merge_word_map(word_map, file_word_map)
+                self.merge_char_map(char_map, file_char_map)
+
+        data.compact_word_maps()
+        data.compute_best_readings(pinyin=pinyin, jyutping=jyutping)
+        data.mark_modified()
+
+    def get_source_files(self):
+        # (name, path) of the files the maps are built from
+        module_dir = os.path.dirname(__file__)
+        names = [filename for filename, kind in self.DICTIONARY_FILES] + [self.JIEBA_DICTIONARY_FILENAME]
+        return [(name, os.path.join(module_dir, name)) for name in names]
+
+    def check_data_artifact(self, cache, digests=False):
+        # raises binary_cache.BinaryCacheError when the data artifact opened as cache was built by another version,
+        # or from other dictionary files than the ones installed. sources are compared by size, and by digest too
+        # when digests is True. missing dictionary files aren't checked, the artifact is all there is then
+        metadata = self.conversion_data.get_metadata(cache)
+        if metadata.get('data_version') != str(self.BUILD_CACHE_VERSION):
+            raise binary_cache.BinaryCacheError(f'{cache.filename}: data version {metadata.get("data_version")}, expected {self.BUILD_CACHE_VERSION}')
+        sources = json.loads(metadata.get('sources', '{}'))
+        for name, path in self.get_source_files():
+            if not os.path.isfile(path):
+                continue
+            size, digest = sources.get(name, (None, None))
+            if os.path.getsize(path) != size or (digests and self.get_file_digest(path) != digest):
+                raise binary_cache.BinaryCacheError(f'{cache.filename}: built from another version of {name}')
+
+    def write_data_artifact(self, data, filename):
+        # all the maps of data, in the binary cache format, with the version and the digests of the sources
+        sources = {name: [os.path.getsize(path), self.get_file_digest(path)] for name, path in self.get_source_files() if os.path.isfile(path)}
+        metadata = {
+            'data_version': str(self.BUILD_CACHE_VERSION),
+            'sources': json.dumps(sources),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data.serialize_binary(filename, metadata)
+
+    def build_data(self, filename=None, force=False, workers=None):
+        # builds the data artifact from the dictionary files, into the cache directory by default. an artifact
+        # which is intact and up to date with the dictionaries is left alone, unless force.
+        # returns True when the artifact was (re)built
+        filename = filename or self.conversion_data.get_data_artifact_path()
+        if not force and os.path.isfile(filename):
+            try:
+                cache = binary_cache.BinaryCache(filename, verify=True)
+                try:
+                    self.check_data_artifact(cache, digests=True)
+                finally:
+                    cache.close()
+                logger.info('%s is up to date', filename)
+                return False
+            except binary_cache.BinaryCacheError as e:
+                logger.info('rebuilding %s: %s', filename, e)
+        missing = [path for name, path in self.get_source_files() if not os.path.isfile(path)]
+        if len(missing) > 0:
+            raise FileNotFoundError(f'missing dictionary files: {", ".join(missing)}')
+        data = ConversionData()
+        self.build_conversion_data(data, pinyin=True, jyutping=True, workers=workers)
+        self.write_data_artifact(data, filename)
+        logger.info('built %s', filename)
+        return True
+
+    def publish_shared_data(self, name=None):
+        # loads the maps and publishes them in a shared memory segment (python 3.8+), which this process
+        # then uses too. returns the segment name: other processes attach to it with attach_shared_data, or
+        # automatically when SHARED_DATA_ENVIRONMENT_VARIABLE holds the name. the segment is removed when this
+        # process exits, or with conversion_data.binary_cache.unlink()
+        self.ensure_loaded(pinyin=True, jyutping=True)
+        with self.load_lock:
+            name = self.conversion_data.publish_shared(name)
+            # the user entries aren't published, every process applies them
+            self.apply_user_dictionary(['pinyin', 'jyutping'])
+        return name
+
+    def attach_shared_data(self, name):
+        with self.load_lock:
+            self.conversion_data.attach_shared(name)
+            self.apply_user_dictionary(['pinyin', 'jyutping'])
+            self.pinyin_loaded = True
+            self.jyutping_loaded = True
+
+    def apply_user_dictionary(self, modes):
+        # applies the user entries to the maps of the modes which were just loaded
+        self.user_dictionary.load()
+        if len(self.user_dictionary.entries) > 0:
+            self.apply_user_entries([(entry, priority) for entry, priority, persistent in self.user_dictionary.entries], modes)
+
+    def apply_user_entries(self, entries, modes):
+        # only the words and characters of the (entry, priority) pairs are updated, the trie segmenter index is
+        # extended in place and only the cached sentences containing one of their characters are dropped
+        data = self.conversion_data
+        previous_generation = data.generation
+        changed = set()
+        for entry, priority in entries:
+            changed.update(user_dictionary.apply_entry(data, entry, priority, modes))
+        data.mark_modified()
+        self.segmenter.add_words([word for word in changed if len(word) > 1], (id(data), previous_generation))
+        characters = set(''.join(changed))
+        if self.sentence_cache is not None:
+            self.sentence_cache.update_version((id(data), previous_generation, self.segmenter_name),
+                                               (id(data), data.generation, self.segmenter_name),
+                                               lambda key: not characters.isdisjoint(key[0]))
+        if self.segmentation_cache is not None:
+            # a new word can only change the segmentation of the sentences which contain its characters
+            self.segmentation_cache.update_version((id(data), previous_generation, self.segmenter_name),
+                                                   (id(data), data.generation, self.segmenter_name),
+                                                   lambda key: not characters.isdisjoint(key))
+        logger.debug('applied %d user dictionary entries, %d words and characters changed', len(entries), len(changed))
+
+    def add_entries(self, entries, priority='override', persist=False):
+        # adds user dictionary entries over the dictionaries, without rebuilding anything. entries are
+        # dictionary.DictionaryEntry records or lines in CC-Canto or CC-CEDICT format (pinyin only).
+        # priority: 'override' (the user entries win) or 'fallback' (only words and characters missing from
+        # the dictionaries are added), see user_dictionary.
+        # persist: save the entries next to the cache files, they are applied again every time the data is loaded.
+        # returns the number of entries added
+        if priority not in user_dictionary.PRIORITIES:
+            raise ValueError(f'unknown priority {priority}, expected {" or ".join(user_dictionary.PRIORITIES)}')
+        parsed_entries = []
+        for entry in entries:
+            if isinstance(entry, str):
+                line = entry
+                entry = dictionary.parse_line(line)
+                if entry is None:
+                    raise ValueError(f'malformed dictionary line: {line}')
+            parsed_entries.append(entry)
+        self.ensure_loaded(pinyin=True, jyutping=True)
+        with self.load_lock:
+            self.user_dictionary.add(parsed_entries, priority, persist)
+            self.apply_user_entries([(entry, priority) for entry in parsed_entries], ['pinyin', 'jyutping'])
+        return len(parsed_entries)
+
+    def load_user_dictionary(self, filename, kind='cccanto', priority='override', persist=False):
+        # adds the entries of a dictionary file, kind is 'cccanto' or 'cedict'. malformed lines are skipped
+        # and reported like for the main dictionaries, see dictionary_reports
+        parser = dictionary.DictionaryParser(kind)
+        entries = list(parser.parse_file(filename))
+        self.report_malformed_lines(filename, parser)
+        return self.add_entries(entries, priority=priority, persist=persist)
+
+    def clear_user_entries(self):
+        # removes the user entries, the persisted ones too. words already added to jieba stay there
+        with self.load_lock:
+            self.user_dictionary.clear()
+            data = self.conversion_data
+            for name in data.MAP_NAMES + data.BEST_READING_MAP_NAMES:
+                setattr(data, name, data.get_base_map(name))
+            data.mark_modified()
+
+    def ensure_loaded(self, pinyin=False, jyutping=False):
+        # cheap check first, load_files takes the lock
+        if (pinyin and not self.pinyin_loaded) or (jyutping and not self.jyutping_loaded):
+            self.load_files(pinyin=pinyin, jyutping=jyutping)
+
+    def warm_up(self, pinyin=True, jyutping=False):
+        # load everything needed ahead of time, for instance before a preforking server forks its workers
+        self.ensure_loaded(pinyin=pinyin, jyutping=jyutping)
+        self.segmenter.initialize()
+
+    def get_romanization(self, chinese, word_map, char_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map=None):
+        logger.debug('get_romanization: [%s] tone_numbers: %s spaces: %s remove_tones: %s', chinese, tone_numbers, spaces, remove_tones)
         spacing = ""
         if spaces == True:
             # add space between every character
             spacing = " "
         # 1. see if the word in its entirety is present in the word map (but only if it's not a single character)
         if len(chinese) > 1 and chinese in word_map:
-            logger.debug(f'processing {chinese} as word')
+            logger.debug('processing %s as word', chinese)
             romanization_tokens = word_map[chinese]
             processed_syllables = [processing_function(syllable, tone_numbers, remove_tones) for syllable in romanization_tokens]
             result = spacing.join(processed_syllables)
-            logger.debug(f'word processing result: {result}')
+            logger.debug('word processing result: %s', result)
             return result
-        # 2. if the word is not found, proceed character by character using the character map
-        chinese_characters = list(chinese)
-        logger.debug(f'processing character by character {chinese_characters}')
+        # 2. if the word is not found, proceed character by character, using the most frequent reading of each character
+        logger.debug('processing character by character %s', chinese)
         result = []
-        for char in chinese_characters:
-            if char in char_map:
-                romanizations = []
-                for k, v in char_map[char].items():
-                    romanizations.append({'rom': k, 'count': v})
-                romanizations = sorted(romanizations, key=lambda entry: entry['count'], reverse=True)
-                logger.debug(f'romanizations: {romanizations}')
-                syllable = romanizations[0]['rom']
+        for char in chinese:
+            if best_reading_map is not None:
+                syllable = best_reading_map.get(char)
+            elif char in char_map:
+                syllable = self.conversion_data.get_best_reading(char_map[char])
+            else:
+                syllable = None
+            if syllable is not None:
                 processed_syllable = processing_function(syllable, tone_numbers, remove_tones)
             else:
                 processed_syllable = char
             result.append(processed_syllable)
         return spacing.join(result)        
 
-    def process_sentence(self, sentence, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones):
-        logger.debug(f'process_sentence [{sentence}]')
-        seg_list = jieba.cut(sentence)
-        word_list = list(seg_list)
-        logger.debug(f'word_list: {word_list}')
+    def segment(self, sentence):
+        # words of sentence, from the segmentation cache when it's enabled. the same segmentation serves the
+        # pinyin and the jyutping conversions
+        segmentation_cache = self.segmentation_cache
+        if segmentation_cache is None:
+            return self.segmenter.segment(sentence)
+        # segmentations computed with another segmenter, or before the maps were reloaded or modified, are dropped
+        segmentation_cache.validate((id(self.conversion_data), self.conversion_data.generation, self.segmenter_name))
+        word_list = segmentation_cache.get(sentence)
+        if word_list is None:
+            word_list = self.segmenter.segment(sentence)
+            segmentation_cache.put(sentence, word_list)
+        return word_list
+
+    def get_syllables(self, chinese, word_map, char_map, best_reading_map):
+        # the syllables chosen by get_romanization for a word, None for the characters without a reading
+        if len(chinese) > 1 and chinese in word_map:
+            return word_map[chinese]
+        if best_reading_map is not None:
+            return [best_reading_map.get(char) for char in chinese]
+        return [self.conversion_data.get_best_reading(char_map[char]) if char in char_map else None for char in chinese]
+
+    def get_whole_word_syllables(self, word, word_map):
+        # syllables of word when it's in word_map and the segmenter doesn't split it, None otherwise.
+        # remembered until the data changes, looking words up in the memory-mapped tables isn't free either
+        data = self.conversion_data
+        version = (id(data), data.generation)
+        if version != self.whole_words_version or len(self.whole_words) >= self.WHOLE_WORD_MEMO_SIZE:
+            self.whole_words = {}
+            self.whole_words_version = version
+        key = (id(word_map), word)
+        syllables = self.whole_words.get(key, False)
+        if syllables is False:
+            syllables = word_map.get(word)
+            if syllables is not None and self.segmenter.segment(word) != [word]:
+                syllables = None
+            self.whole_words[key] = syllables
+        return syllables
+
+    def convert_short_input(self, sentence, word_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map):
+        # same result as process_sentence for a single character, or a word of the word map which the segmenter
+        # doesn't split, without segmenting. None for any other input
+        if len(sentence) == 1:
+            syllable = best_reading_map.get(sentence)
+            if syllable is None:
+                return sentence
+            return processing_function(syllable, tone_numbers, remove_tones)
+        if len(sentence) == 0:
+            return sentence
+        syllables = self.get_whole_word_syllables(sentence, word_map)
+        if syllables is None:
+            return None
+        spacing = ' ' if spaces else ''
+        return spacing.join([processing_function(syllable, tone_numbers, remove_tones) for syllable in syllables])
+
+    def process_sentence(self, sentence, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map=None):
+        if self.instrumentation is not None:
+            return self.process_sentence_instrumented(sentence, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map)
+        if len(sentence) <= self.SHORT_INPUT_MAX_LENGTH and best_reading_map is not None:
+            result = self.convert_short_input(sentence, word_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map)
+            if result is not None:
+                return result
+        logger.debug('process_sentence [%s]', sentence)
+        word_list = self.segment(sentence)
+        logger.debug('word_list: %s', word_list)
         #print(word_list)
-        processed_words = [self.get_romanization(word, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones) for word in word_list]
-        logger.debug(f'processed_words: {processed_words}')
+        processed_words = [self.get_romanization(word, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map) for word in word_list]
+        logger.debug('processed_words: %s', processed_words)
         return " ".join(processed_words)
 
+    def process_sentence_instrumented(self, sentence, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map=None):
+        # same as process_sentence, timing every stage and counting how the words get converted
+        measurements = self.instrumentation.new_measurements()
+        decode_time = 0.0
+        def timed_processing_function(syllable, tone_numbers, remove_tones):
+            nonlocal decode_time
+            start = time.perf_counter()
+            result = processing_function(syllable, tone_numbers, remove_tones)
+            decode_time += time.perf_counter() - start
+            measurements['decode_calls'] += 1
+            return result
+
+        start = time.perf_counter()
+        word_list = self.segment(sentence)
+        measurements['segment_time'] = time.perf_counter() - start
+        start = time.perf_counter()
+        processed_words = [self.get_romanization(word, word_map, character_map, timed_processing_function, tone_numbers, spaces, remove_tones, best_reading_map) for word in word_list]
+        measurements['lookup_time'] = time.perf_counter() - start - decode_time
+        measurements['decode_time'] = decode_time
+        result = " ".join(processed_words)
+
+        measurements['sentences'] = 1
+        for word in word_list:
+            self.instrumentation.count_word(measurements, word, word_map, character_map, best_reading_map)
+        measurements['sentence'] = sentence
+        measurements['result'] = result
+        self.instrumentation.record(measurements)
+        return result
+
+    def process_sentences(self, sentences, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map=None):
+        # generator, same result as process_sentence for every sentence. words repeat a lot across a batch,
+        # so their romanization is only computed once.
+        if self.instrumentation is not None:
+            # measurements are per sentence
+            for sentence in sentences:
+                yield self.process_sentence_instrumented(sentence, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map)
+            return
+        word_cache = {}
+        for sentence in sentences:
+            processed_words = []
+            for word in self.segment(sentence):
+                processed_word = word_cache.get(word)
+                if processed_word is None:
+                    if len(word_cache) >= self.BATCH_WORD_CACHE_SIZE:
+                        word_cache.clear()
+                    processed_word = self.get_romanization(word, word_map, character_map, processing_function, tone_numbers, spaces, remove_tones, best_reading_map)
+                    word_cache[word] = processed_word
+                processed_words.append(processed_word)
+            yield " ".join(processed_words)
+
+    def get_character_readings(self, char, char_map):
+        # all the known readings of a character with their counts, most frequent first
+        readings = char_map.get(char, {})
+        return sorted(readings.items(), key=lambda entry: entry[1], reverse=True)
+
+    def character_readings_pinyin(self, char):
+        self.ensure_loaded(pinyin=True)
+        return self.get_character_readings(char, self.conversion_data.pinyin_char_map)
+
+    def character_readings_jyutping(self, char):
+        self.ensure_loaded(jyutping=True)
+        return self.get_character_readings(char, self.conversion_data.jyutping_char_map)
+
+    def analyze(self, sentence, mode='pinyin', tone_numbers=False, spaces=False, remove_tones=False, top_n=None):
+        # the conversion of sentence word by word, as a list of analysis.Token: how each word was converted
+        # and the readings of its characters, most frequent first (at most top_n of them).
+        # joining the romanization of the tokens with spaces gives the same result as process_sentence_pinyin /
+        # process_sentence_jyutping
+        if mode not in ['pinyin', 'jyutping']:
+            raise ValueError(f'unknown mode {mode}, expected pinyin or jyutping')
+        self.ensure_loaded(pinyin=mode == 'pinyin', jyutping=mode == 'jyutping')
+        data = self.conversion_data
+        if mode == 'pinyin':
+            maps = (data.pinyin_word_map, data.pinyin_char_map, data.pinyin_best_reading_map, self.decode_pinyin_cached)
+        else:
+            maps = (data.jyutping_word_map, data.jyutping_char_map, data.jyutping_best_reading_map, self.decode_jyutping_cached)
+        self.reading_index.validate((id(data), data.generation))
+        return [analysis.analyze_word(word, mode, *maps, self.reading_index, tone_numbers, spaces, remove_tones, top_n) for word in self.segment(sentence)]
+
+    def render_tones(self, syllables, mode='pinyin', style='diacritics'):
+        # syllables as found in the dictionaries (tone numbers) -> list of the syllables in a tones.STYLES style
+        # ('diacritics', 'tone_numbers', 'no_tones', 'superscript'). style can also be a list of styles, to
+        # render several of them at once, the result is then a {style: list of syllables} dict
+        if mode not in self.tone_renderers:
+            raise ValueError(f'unknown mode {mode}, expected pinyin or jyutping')
+        renderer = self.tone_renderers[mode]
+        if isinstance(style, str):
+            tones.check_style(style)
+            return renderer.render(syllables, style)
+        for name in style:
+            tones.check_style(name)
+        return renderer.render_styles(syllables, style)
+
+    def convert(self, sentence, outputs=('pinyin', 'jyutping'), spaces=False):
+        # several conversions of sentence at once, {output: result}. outputs are names of CONVERT_OUTPUTS:
+        # 'pinyin' and 'jyutping' with diacritics, or followed by a tone style: 'pinyin_tone_numbers',
+        # 'jyutping_no_tones', 'pinyin_superscript'... the sentence is only segmented once, each word is looked
+        # up once per romanization, and the syllables are rendered in every requested style together.
+        # each result is the same as the one of process_sentence_pinyin / process_sentence_jyutping
+        styles = {}
+        for output in outputs:
+            if output not in self.CONVERT_OUTPUTS:
+                raise ValueError(f'unknown output {output}, available: {", ".join(self.CONVERT_OUTPUTS.keys())}')
+            mode, style = self.CONVERT_OUTPUTS[output]
+            styles.setdefault(mode, []).append(style)
+        self.ensure_loaded(pinyin='pinyin' in styles, jyutping='jyutping' in styles)
+        data = self.conversion_data
+        word_list = self.segment(sentence)
+        spacing = ' ' if spaces else ''
+        results = {}
+        for mode, mode_styles in styles.items():
+            if mode == 'pinyin':
+                maps = (data.pinyin_word_map, data.pinyin_char_map, data.pinyin_best_reading_map)
+            else:
+                maps = (data.jyutping_word_map, data.jyutping_char_map, data.jyutping_best_reading_map)
+            word_syllables = [self.get_syllables(word, *maps) for word in word_list]
+            rendered = self.tone_renderers[mode].render_styles([syllable for syllables in word_syllables for syllable in syllables if syllable is not None], mode_styles)
+            for style in mode_styles:
+                rendered_syllables = iter(rendered[style])
+                # syllables are None only for characters converted one by one, which are then kept as they are
+                processed_words = [spacing.join(word[index] if syllable is None else next(rendered_syllables) for index, syllable in enumerate(syllables))
+                    for word, syllables in zip(word_list, word_syllables)]
+                results[mode if style == tones.DIACRITICS else f'{mode}_{style}'] = ' '.join(processed_words)
+        return {output: results[output] for output in outputs}
+
+    def enable_sentence_cache(self, max_entries=10000, max_bytes=None):
+        # cache the results of process_sentence_pinyin / process_sentence_jyutping, for repetitive input
+        self.sentence_cache = caching.LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def disable_sentence_cache(self):
+        self.sentence_cache = None
+
+    def sentence_cache_stats(self):
+        # hits, misses, evictions and size of the sentence cache, None if it's not enabled
+        if self.sentence_cache is None:
+            return None
+        return self.sentence_cache.stats()
+
+    def enable_segmentation_cache(self, max_entries=10000, max_bytes=None):
+        # cache the words of the segmented sentences, for repetitive input and for the same sentences converted
+        # to both pinyin and jyutping. unlike the sentence cache, it's shared by all the conversion options
+        self.segmentation_cache = caching.SegmentationCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def disable_segmentation_cache(self):
+        self.segmentation_cache = None
+
+    def segmentation_cache_stats(self):
+        # hits, misses, evictions and size of the segmentation cache, None if it's not enabled
+        if self.segmentation_cache is None:
+            return None
+        return self.segmentation_cache.stats()
+
+    def enable_instrumentation(self, callback=None):
+        # counts word map hits, character fallbacks and unknown characters, times the segmentation, lookup
+        # and decode stages, see stats. callback(measurements) is called after every sentence.
+        # nothing is measured when instrumentation isn't enabled, which is the default.
+        self.instrumentation = instrumentation.Instrumentation(callback)
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
+    def stats(self):
+        # instrumentation totals (when enabled), sentence cache, segmentation cache and syllable decoding cache stats
+        stats = {}
+        if self.instrumentation is not None:
+            stats.update(self.instrumentation.stats())
+        stats['sentence_cache'] = self.sentence_cache_stats()
+        stats['segmentation_cache'] = self.segmentation_cache_stats()
+        stats['decode_cache'] = {
+            'pinyin': self.decode_pinyin_cached.cache_info()._asdict(),
+            'jyutping': self.decode_jyutping_cached.cache_info()._asdict(),
+        }
+        stats['tone_tables'] = {mode: renderer.get_table_size() for mode, renderer in self.tone_renderers.items()}
+        return stats
+
+    def process_sentence_cached(self, mode, sentence, tone_numbers, spaces, remove_tones, convert):
+        sentence_cache = self.sentence_cache
+        if sentence_cache is None:
+            return convert()
+        # entries computed from maps which were since reloaded or modified are dropped
+        sentence_cache.validate((id(self.conversion_data), self.conversion_data.generation, self.segmenter_name))
+        key = (sentence, mode, tone_numbers, spaces, remove_tones)
+        result = sentence_cache.get(key)
+        if result is None:
+            result = convert()
+            sentence_cache.put(key, result)
+        return result
+
     def process_sentence_pinyin(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
-        return self.process_sentence(sentence, self.conversion_data.pinyin_word_map, self.conversion_data.pinyin_char_map, self.decode_pinyin, tone_numbers, spaces, remove_tones)
+        self.ensure_loaded(pinyin=True)
+        data = self.conversion_data
+        return self.process_sentence_cached('pinyin', sentence, tone_numbers, spaces, remove_tones,
+            lambda: self.process_sentence(sentence, data.pinyin_word_map, data.pinyin_char_map, self.decode_pinyin_cached, tone_numbers, spaces, remove_tones, data.pinyin_best_reading_map))
     
     def process_sentence_jyutping(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
-        return self.process_sentence(sentence, self.conversion_data.jyutping_word_map, self.conversion_data.jyutping_char_map, self.decode_jyutping, tone_numbers, spaces, remove_tones)
+        self.ensure_loaded(jyutping=True)
+        data = self.conversion_data
+        return self.process_sentence_cached('jyutping', sentence, tone_numbers, spaces, remove_tones,
+            lambda: self.process_sentence(sentence, data.jyutping_word_map, data.jyutping_char_map, self.decode_jyutping_cached, tone_numbers, spaces, remove_tones, data.jyutping_best_reading_map))
         
+    def process_sentences_parallel(self, mode, sentences, tone_numbers, spaces, remove_tones, workers):
+        with ParallelConverter(self, workers=workers) as converter:
+            yield from converter.process_sentences(mode, sentences, tone_numbers, spaces, remove_tones)
+
+    def process_sentences_pinyin(self, sentences, tone_numbers=False, spaces=False, remove_tones=False, workers=None):
+        # sentences can be any iterable, results are generated in the same order.
+        # workers: number of processes to shard the sentences across, see ParallelConverter
+        if workers is not None and workers > 1:
+            return self.process_sentences_parallel('pinyin', sentences, tone_numbers, spaces, remove_tones, workers)
+        self.ensure_loaded(pinyin=True)
+        data = self.conversion_data
+        return self.process_sentences(sentences, data.pinyin_word_map, data.pinyin_char_map, self.decode_pinyin_cached, tone_numbers, spaces, remove_tones, data.pinyin_best_reading_map)
+
+    def process_sentences_jyutping(self, sentences, tone_numbers=False, spaces=False, remove_tones=False, workers=None):
+        # sentences can be any iterable, results are generated in the same order.
+        # workers: number of processes to shard the sentences across, see ParallelConverter
+        if workers is not None and workers > 1:
+            return self.process_sentences_parallel('jyutping', sentences, tone_numbers, spaces, remove_tones, workers)
+        self.ensure_loaded(jyutping=True)
+        data = self.conversion_data
+        return self.process_sentences(sentences, data.jyutping_word_map, data.jyutping_char_map, self.decode_jyutping_cached, tone_numbers, spaces, remove_tones, data.jyutping_best_reading_map)
+
+    def convert_stream(self, in_fh, out_fh, mode='pinyin', tone_numbers=False, spaces=False, remove_tones=False, workers=None):
+        # converts a text file of any size piece by piece, writing the output as it goes. the file handles can
+        # be text or binary (utf-8). line endings are kept, the input is cut on sentence boundaries.
+        # returns a streaming.StreamStats with the bytes and lines per second.
+        return streaming.convert_stream(self, in_fh, out_fh, mode, tone_numbers, spaces, remove_tones, workers)
+
+    def iter_convert_stream(self, in_fh, mode='pinyin', tone_numbers=False, spaces=False, remove_tones=False, workers=None, stats=None):
+        # generator variant of convert_stream, joining the generated strings gives the converted text.
+        # pass a streaming.StreamStats to follow the throughput.
+        return streaming.iter_convert_stream(self, in_fh, mode, tone_numbers, spaces, remove_tones, workers, stats)
+
+# data is loaded on first use, call warm_up to load it ahead of time
 romanization_conversion = RomanizationConversion()
-romanization_conversion.load_files()
 pinyin = romanization_conversion.process_sentence_pinyin
 jyutping = romanization_conversion.process_sentence_jyutping
+pinyin_many = romanization_conversion.process_sentences_pinyin
+jyutping_many = romanization_conversion.process_sentences_jyutping
+convert_stream = romanization_conversion.convert_stream
+iter_convert_stream = romanization_conversion.iter_convert_stream
+# asyncio: await apinyin(sentence), async for result in apinyin_many(sentences). conversions run on a thread
+# pool by default, see configure_async to use processes or to change the concurrency limit
+async_converter = AsyncConverter(romanization_conversion)
+apinyin = async_converter.pinyin
+ajyutping = async_converter.jyutping
+apinyin_many = async_converter.pinyin_many
+ajyutping_many = async_converter.jyutping_many
+configure_async = async_converter.configure
+warm_up = romanization_conversion.warm_up
+set_segmenter = romanization_conversion.set_segmenter
+enable_sentence_cache = romanization_conversion.enable_sentence_cache
+sentence_cache_stats = romanization_conversion.sentence_cache_stats
+enable_segmentation_cache = romanization_conversion.enable_segmentation_cache
+segmentation_cache_stats = romanization_conversion.segmentation_cache_stats
+enable_instrumentation = romanization_conversion.enable_instrumentation
+disable_instrumentation = romanization_conversion.disable_instrumentation
+conversion_stats = romanization_conversion.stats
+pinyin_character_readings = romanization_conversion.character_readings_pinyin
+jyutping_character_readings = romanization_conversion.character_readings_jyutping
+analyze = romanization_conversion.analyze
+render_tones = romanization_conversion.render_tones
+convert = romanization_conversion.convert
+publish_shared_data = romanization_conversion.publish_shared_data
+attach_shared_data = romanization_conversion.attach_shared_data
+add_entries = romanization_conversion.add_entries
+load_user_dictionary = romanization_conversion.load_user_dictionary
         
@@ -0,0 +1,57 @@
+import argparse
+import logging
+import pinyin_jyutping_sentence
+from pinyin_jyutping_sentence import server
+
+# usage:
+#  python -m pinyin_jyutping_sentence serve                 (unix socket, server.DEFAULT_SOCKET_PATH)
+#  python -m pinyin_jyutping_sentence serve --port 8765     (http on localhost)
+#  python -m pinyin_jyutping_sentence build-data            (data artifact in the cache directory)
+#  python -m pinyin_jyutping_sentence build-data --output pinyin_jyutping_sentence/mandarin_cantonese_data.bin --force
+
+
+def serve(arguments):
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.set_segmenter(arguments.segmenter)
+    if arguments.sentence_cache > 0:
+        rc.enable_sentence_cache(max_entries=arguments.sentence_cache)
+    if arguments.segmentation_cache > 0:
+        rc.enable_segmentation_cache(max_entries=arguments.segmentation_cache)
+    server.serve(rc, socket_path=arguments.socket, host=arguments.host, port=arguments.port)
+
+
+def build_data(arguments):
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    filename = arguments.output or rc.conversion_data.get_data_artifact_path()
+    built = rc.build_data(filename, force=arguments.force, workers=arguments.workers)
+    print(f'{filename}: {"built" if built else "up to date"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m pinyin_jyutping_sentence')
+    parser.add_argument('--log-level', default='INFO', help='logging level, INFO by default')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser('serve', help='keep the conversion data loaded and serve newline delimited json requests')
+    serve_parser.add_argument('--socket', help=f'unix socket path, {server.DEFAULT_SOCKET_PATH} by default')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='http host, with --port')
+    serve_parser.add_argument('--port', type=int, help=f'serve http on this port instead of a unix socket (for instance {server.DEFAULT_PORT})')
+    serve_parser.add_argument('--segmenter', default='jieba', choices=sorted(pinyin_jyutping_sentence.segmenters.SEGMENTERS.keys()))
+    serve_parser.add_argument('--sentence-cache', type=int, default=0, help='number of sentence results to cache, disabled by default')
+    serve_parser.add_argument('--segmentation-cache', type=int, default=0, help='number of segmented sentences to cache, disabled by default')
+    serve_parser.set_defaults(function=serve)
+
+    build_data_parser = subparsers.add_parser('build-data', help='build the data artifact from the dictionary files, if it is missing, corrupt or out of date')
+    build_data_parser.add_argument('--output', help=f'artifact path, in the cache directory by default (${pinyin_jyutping_sentence.ConversionData.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE} or ~/.cache)')
+    build_data_parser.add_argument('--force', action='store_true', help='build even if the artifact is up to date')
+    build_data_parser.add_argument('--workers', type=int, help='number of build processes, all cores by default')
+    build_data_parser.set_defaults(function=build_data)
+
+    arguments = parser.parse_args()
+    logging.basicConfig(level=arguments.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    arguments.function(arguments)
+
+
+if __name__ == '__main__':
+    main()
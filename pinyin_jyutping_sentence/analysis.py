@@ -0,0 +1,58 @@
+import collections
+
+# structured output of RomanizationConversion.analyze: the words of a sentence, as segmented for the
+# conversion, with how each of them was converted and the alternative readings of their characters.
+
+# one segmented word. source is 'word' when the word as a whole is in the word map, 'char' when it's converted
+# character by character, 'unknown' when none of its characters has a reading (punctuation, latin text).
+# romanization is the text used in the converted sentence
+Token = collections.namedtuple('Token', ['text', 'source', 'romanization', 'characters'])
+# one character of a token. reading is the one used in the conversion (None when there is none), readings
+# are the (reading, count) of the character in the dictionaries, most frequent first
+CharacterReadings = collections.namedtuple('CharacterReadings', ['character', 'reading', 'readings'])
+
+
+class ReadingIndex():
+    # character -> ((reading, count), ...) most frequent first, for each romanization and decoding options.
+    # computed once per character, on first use, and emptied when the maps are reloaded or modified.
+    # ties keep the order of the char map, so the first reading is always the best reading.
+
+    def __init__(self):
+        self.rankings = {}
+        self.data_version = None
+
+    def validate(self, data_version):
+        if data_version != self.data_version:
+            self.rankings = {}
+            self.data_version = data_version
+
+    def get_readings(self, mode, char_map, char, processing_function, tone_numbers, remove_tones):
+        key = (mode, char, tone_numbers, remove_tones)
+        readings = self.rankings.get(key)
+        if readings is None:
+            ranked_readings = sorted(char_map.get(char, {}).items(), key=lambda entry: entry[1], reverse=True)
+            readings = tuple((processing_function(syllable, tone_numbers, remove_tones), count) for syllable, count in ranked_readings)
+            self.rankings[key] = readings
+        return readings
+
+
+def analyze_word(word, mode, word_map, char_map, best_reading_map, processing_function, reading_index, tone_numbers, spaces, remove_tones, top_n):
+    # same decisions as RomanizationConversion.get_romanization
+    spacing = ' ' if spaces else ''
+    if len(word) > 1 and word in word_map:
+        source = 'word'
+        syllables = word_map[word]
+        readings = [processing_function(syllable, tone_numbers, remove_tones) for syllable in syllables]
+        romanization = spacing.join(readings)
+    else:
+        source = 'char'
+        syllables = [best_reading_map.get(char) for char in word]
+        readings = [processing_function(syllable, tone_numbers, remove_tones) if syllable is not None else None for syllable in syllables]
+        romanization = spacing.join(char if reading is None else reading for char, reading in zip(word, readings))
+        if all(reading is None for reading in readings):
+            source = 'unknown'
+    characters = []
+    for char, reading in zip(word, readings):
+        ranked_readings = reading_index.get_readings(mode, char_map, char, processing_function, tone_numbers, remove_tones)
+        characters.append(CharacterReadings(char, reading, list(ranked_readings[:top_n])))
+    return Token(word, source, romanization, characters)
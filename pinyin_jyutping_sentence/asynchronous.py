@@ -0,0 +1,174 @@
+import os
+import asyncio
+import weakref
+import functools
+import collections
+import concurrent.futures
+import multiprocessing
+import logging
+from . import parallel
+
+logger = logging.getLogger(__name__)
+
+
+def convert_in_process(arguments):
+    # runs in a process pool worker, which may not have been started with parallel.initialize_worker
+    parallel.initialize_worker()
+    return parallel.convert_chunk(arguments)
+
+
+class AsyncConverter():
+    # asyncio front-end: the conversions run on an executor so that they don't block the event loop.
+    # at most max_concurrency conversions are submitted to the executor at a time, the other callers wait
+    # their turn, and batches don't read their input further ahead than that.
+    # usage:
+    #   converter = AsyncConverter(pinyin_jyutping_sentence.romanization_conversion, executor='process')
+    #   result = await converter.pinyin('我很好')
+    #   async for result in converter.pinyin_many(sentences):
+    #       ...
+    # executor: 'thread', 'process', or a concurrent.futures.Executor owned by the caller. with 'process' and
+    # the fork start method, the data is loaded in the parent before the workers start, call warm_up
+    # beforehand to avoid doing it on the event loop.
+
+    # sentences per executor call, for batches
+    CHUNK_SIZE = 64
+
+    def __init__(self, romanization_conversion, executor='thread', max_concurrency=None, chunk_size=None):
+        self.romanization_conversion = romanization_conversion
+        self.executor = None
+        self.owns_executor = False
+        self.uses_processes = False
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.configure(executor, max_concurrency, chunk_size)
+
+    def configure(self, executor='thread', max_concurrency=None, chunk_size=None):
+        if executor not in ['thread', 'process'] and not isinstance(executor, concurrent.futures.Executor):
+            raise ValueError(f'unknown executor {executor}, expected thread, process or a concurrent.futures.Executor')
+        self.close()
+        self.executor = None
+        self.executor_kind = executor
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.semaphores = weakref.WeakKeyDictionary()
+        if isinstance(executor, concurrent.futures.Executor):
+            self.executor = executor
+            self.uses_processes = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+
+    def get_executor(self):
+        if self.executor is None:
+            if self.executor_kind == 'process':
+                start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+                context = multiprocessing.get_context(start_method)
+                if context.get_start_method() == 'fork':
+                    # load everything once in the parent, the workers share the pages
+                    self.romanization_conversion.warm_up(pinyin=True, jyutping=True)
+                    parallel.worker_conversion = self.romanization_conversion
+                logger.info('starting %d conversion processes (%s)', self.max_concurrency, context.get_start_method())
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.max_concurrency, mp_context=context, initializer=parallel.initialize_worker)
+                self.uses_processes = True
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='pinyin_jyutping_sentence')
+                self.uses_processes = False
+            self.owns_executor = True
+        return self.executor
+
+    def get_semaphore(self):
+        # asyncio primitives belong to one event loop
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.semaphores[loop] = semaphore
+        return semaphore
+
+    def get_chunk_function(self, mode, sentences, tone_numbers, spaces, remove_tones):
+        if self.uses_processes:
+            return functools.partial(convert_in_process, (mode, sentences, tone_numbers, spaces, remove_tones))
+        rc = self.romanization_conversion
+        if mode == 'pinyin':
+            return lambda: list(rc.process_sentences_pinyin(sentences, tone_numbers, spaces, remove_tones))
+        return lambda: list(rc.process_sentences_jyutping(sentences, tone_numbers, spaces, remove_tones))
+
+    async def convert(self, mode, sentence, tone_numbers, spaces, remove_tones):
+        executor = self.get_executor()
+        loop = asyncio.get_running_loop()
+        async with self.get_semaphore():
+            if self.uses_processes:
+                function = self.get_chunk_function(mode, [sentence], tone_numbers, spaces, remove_tones)
+                return (await loop.run_in_executor(executor, function))[0]
+            # single sentences go through process_sentence_*, which uses the sentence cache when enabled
+            rc = self.romanization_conversion
+            function = rc.process_sentence_pinyin if mode == 'pinyin' else rc.process_sentence_jyutping
+            return await loop.run_in_executor(executor, function, sentence, tone_numbers, spaces, remove_tones)
+
+    async def get_chunks(self, sentences):
+        # chunks of chunk_size sentences, from a regular or an asynchronous iterable
+        chunk = []
+        if hasattr(sentences, '__aiter__'):
+            async for sentence in sentences:
+                chunk.append(sentence)
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+        else:
+            for sentence in sentences:
+                chunk.append(sentence)
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    async def process_sentences(self, mode, sentences, tone_numbers, spaces, remove_tones):
+        # asynchronous generator, results in input order
+        executor = self.get_executor()
+        loop = asyncio.get_running_loop()
+        semaphore = self.get_semaphore()
+        pending = collections.deque()
+        try:
+            async for chunk in self.get_chunks(sentences):
+                # backpressure: at most max_concurrency chunks are converting or waiting to be consumed, a slow
+                # chunk at the head stops the reading until its results are consumed
+                while len(pending) >= self.max_concurrency:
+                    await asyncio.wait([pending[0]])
+                    for result in pending.popleft().result():
+                        yield result
+                # the semaphore is shared with the other callers
+                await semaphore.acquire()
+                future = loop.run_in_executor(executor, self.get_chunk_function(mode, chunk, tone_numbers, spaces, remove_tones))
+                future.add_done_callback(lambda future: semaphore.release())
+                pending.append(future)
+                while len(pending) > 0 and pending[0].done():
+                    for result in pending.popleft().result():
+                        yield result
+            while len(pending) > 0:
+                for result in await pending.popleft():
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def pinyin(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
+        return await self.convert('pinyin', sentence, tone_numbers, spaces, remove_tones)
+
+    async def jyutping(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
+        return await self.convert('jyutping', sentence, tone_numbers, spaces, remove_tones)
+
+    def pinyin_many(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.process_sentences('pinyin', sentences, tone_numbers, spaces, remove_tones)
+
+    def jyutping_many(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.process_sentences('jyutping', sentences, tone_numbers, spaces, remove_tones)
+
+    def close(self):
+        # shuts down the executor if it was created here, a later call starts a new one
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown()
+            self.executor = None
+            self.owns_executor = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
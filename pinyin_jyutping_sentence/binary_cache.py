@@ -0,0 +1,407 @@
+import os
+import sys
+import mmap
+import threading
+import array
+import zlib
+import struct
+import collections.abc
+
+# binary cache file layout (all integers little endian):
+#
+# header:    MAGIC, FORMAT_VERSION (uint32), table count (uint32), crc32 of everything after the header (uint32)
+# directory: one TABLE_ENTRY per table: name, value kind, flags, entry count, table offset
+# tables:    key offsets (count + 1 uint32), value offsets (count + 1 uint32), key blob, value blob,
+#            hash index when flags has FLAG_HASH_INDEX: bucket count (uint32), displacements (bucket count
+#            uint32), slots (count uint32)
+#
+# keys are stored as utf-8, sorted, so that lookups are a binary search straight on the mapped
+# pages, nothing gets parsed when the file is opened. the hash index is a minimal perfect hash of the keys
+# (hash and displace over the crc32 of the key and the crc32 of the reversed key), a lookup is two hashes and one
+# key comparison instead.
+#
+# the same layout can be published in a shared memory segment instead of a file, see SharedBinaryCache.
+
+MAGIC = b'PJSDATA\x00'
+# version 2: table names up to 32 bytes, jyutping_best_reading_map didn't fit in 24
+# version 3: checksum in the header
+# version 4: hash index
+FORMAT_VERSION = 4
+HEADER = struct.Struct('<8sIII')
+TABLE_ENTRY = struct.Struct('<32ssB2xII')
+MAX_TABLE_NAME_LENGTH = 32
+
+# table flags
+FLAG_HASH_INDEX = 1
+# average number of keys per bucket of the hash index
+HASH_BUCKET_SIZE = 1
+EMPTY_SLOT = 0xFFFFFFFF
+
+# value kinds
+VALUE_LIST = b'L' # list of syllables, ie word maps
+VALUE_COUNTS = b'C' # {romanization: count}, ie char maps
+VALUE_STRING = b'S' # a single string
+
+SEPARATOR = '\x00'
+
+
+class BinaryCacheError(Exception):
+    pass
+
+
+def encode_value(kind, value):
+    if kind == VALUE_LIST:
+        return SEPARATOR.join(value).encode('utf-8')
+    if kind == VALUE_COUNTS:
+        return SEPARATOR.join(f'{rom}{SEPARATOR}{count}' for rom, count in value.items()).encode('utf-8')
+    return value.encode('utf-8')
+
+
+def decode_value(kind, data):
+    value = data.decode('utf-8')
+    if kind == VALUE_LIST:
+        if len(value) == 0:
+            return []
+        return value.split(SEPARATOR)
+    if kind == VALUE_COUNTS:
+        fields = value.split(SEPARATOR)
+        return {fields[i]: int(fields[i + 1]) for i in range(0, len(fields), 2)}
+    return value
+
+
+def offset_array(offsets):
+    result = array.array('I', offsets)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def get_key_hashes(encoded_key):
+    # two independent hashes: the first one picks the bucket and the step, the second one the start slot
+    return zlib.crc32(encoded_key), zlib.crc32(encoded_key[::-1])
+
+
+def get_hash_slot(first_hash, second_hash, bucket_count, displacements, count):
+    # slot of a key in the hash index: start + d0 * step + d1, with d0 and d1 packed in the displacement of its bucket
+    d0, d1 = divmod(displacements[first_hash % bucket_count], count)
+    return (second_hash + d0 * (first_hash // bucket_count % max(1, count - 1) + 1) + d1) % count
+
+
+def build_hash_index(encoded_keys):
+    # hash and displace: the keys are spread over buckets by their first hash, then the buckets get placed, the
+    # largest first, each with the first displacement which sends all of its keys to free slots.
+    # returns (displacements, slots) with slots[slot] = key index, or None when two keys can't be separated
+    count = len(encoded_keys)
+    bucket_count = max(1, count // HASH_BUCKET_SIZE)
+    key_hashes = [get_key_hashes(key) for key in encoded_keys]
+    buckets = [[] for i in range(bucket_count)]
+    for index, (first_hash, second_hash) in enumerate(key_hashes):
+        buckets[first_hash % bucket_count].append(index)
+    displacements = [0] * bucket_count
+    slots = [EMPTY_SLOT] * count
+    free_slots = None
+    for bucket_number in sorted(range(bucket_count), key=lambda number: len(buckets[number]), reverse=True):
+        bucket = buckets[bucket_number]
+        if len(bucket) == 0:
+            break
+        starts = [key_hashes[index][1] % count for index in bucket]
+        if len(bucket) == 1:
+            # any free slot will do, no need to search
+            if free_slots is None:
+                free_slots = [slot for slot in range(count) if slots[slot] == EMPTY_SLOT]
+            slot = free_slots.pop()
+            displacements[bucket_number] = (slot - starts[0]) % count
+            slots[slot] = bucket[0]
+            continue
+        steps = [key_hashes[index][0] // bucket_count % max(1, count - 1) + 1 for index in bucket]
+        if len(set(zip(starts, steps))) != len(bucket):
+            # no displacement can separate them
+            return None
+        # the displacement is packed in 32 bits
+        for displacement in range(min(count * count, EMPTY_SLOT)):
+            d0, d1 = divmod(displacement, count)
+            positions = [(start + d0 * step + d1) % count for start, step in zip(starts, steps)]
+            if len(set(positions)) == len(positions) and all(slots[position] == EMPTY_SLOT for position in positions):
+                break
+        else:
+            return None
+        displacements[bucket_number] = displacement
+        for index, position in zip(bucket, positions):
+            slots[position] = index
+    return displacements, slots
+
+
+def encode_binary_cache(tables, hash_index=True):
+    # tables: list of (name, value kind, dict), returns the whole layout as bytes.
+    # hash_index: add a hash index to every table, which takes a while to build for large tables
+    encoded_tables = []
+    for name, kind, table in tables:
+        if len(name.encode('ascii')) > MAX_TABLE_NAME_LENGTH:
+            raise ValueError(f'table name {name} is longer than {MAX_TABLE_NAME_LENGTH} bytes')
+        keys = sorted(table.keys())
+        encoded_keys = [key.encode('utf-8') for key in keys]
+        key_offsets = [0]
+        value_offsets = [0]
+        key_blob = bytearray()
+        value_blob = bytearray()
+        for key, encoded_key in zip(keys, encoded_keys):
+            key_blob += encoded_key
+            key_offsets.append(len(key_blob))
+            value_blob += encode_value(kind, table[key])
+            value_offsets.append(len(value_blob))
+        data = offset_array(key_offsets).tobytes() + offset_array(value_offsets).tobytes() + key_blob + value_blob
+        # keep every table aligned on 4 bytes so that the offset arrays can be cast without copying
+        data += b'\x00' * (-len(data) % 4)
+        flags = 0
+        index = build_hash_index(encoded_keys) if hash_index and len(keys) > 0 else None
+        if index is not None:
+            displacements, slots = index
+            data += offset_array([len(displacements)]).tobytes() + offset_array(displacements).tobytes() + offset_array(slots).tobytes()
+            flags |= FLAG_HASH_INDEX
+        encoded_tables.append((name, kind, flags, len(keys), data))
+
+    offset = HEADER.size + TABLE_ENTRY.size * len(encoded_tables)
+    offset += -offset % 4
+    layout = bytearray(HEADER.size)
+    for name, kind, flags, count, data in encoded_tables:
+        layout += TABLE_ENTRY.pack(name.encode('ascii'), kind, flags, count, offset)
+        offset += len(data)
+    layout += b'\x00' * (-len(layout) % 4)
+    for name, kind, flags, count, data in encoded_tables:
+        layout += data
+    HEADER.pack_into(layout, 0, MAGIC, FORMAT_VERSION, len(encoded_tables), zlib.crc32(memoryview(layout)[HEADER.size:]))
+    return bytes(layout)
+
+
+def write_file(filename, content):
+    # writes the bytes of content to a temporary file of this process and thread in the same directory, then
+    # renames it: readers see the previous file or the new one, never a half written one, even with several
+    # processes writing it at the same time. unlike mkstemp, the file gets the permissions of the umask
+    temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_filename, 'wb') as outfile:
+            outfile.write(content)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.unlink(temp_filename)
+        raise
+
+
+def write_binary_cache(filename, tables, hash_index=True):
+    # tables: list of (name, value kind, dict)
+    write_file(filename, encode_binary_cache(tables, hash_index))
+
+
+class MappedTable(collections.abc.Mapping):
+    # read-only Mapping view over one table, values are decoded on lookup
+
+    def __init__(self, buffer, kind, count, table_offset, flags=0):
+        self.buffer = buffer
+        self.kind = kind
+        self.count = count
+        offsets_size = (count + 1) * 4
+        self.key_offsets = self.get_array(buffer, table_offset, count + 1)
+        self.value_offsets = self.get_array(buffer, table_offset + offsets_size, count + 1)
+        self.key_blob_start = table_offset + 2 * offsets_size
+        self.value_blob_start = self.key_blob_start + self.key_offsets[count]
+        # end of the table, hash index included
+        self.end = self.value_blob_start + self.value_offsets[count]
+        self.end += -self.end % 4
+        self.slots = None
+        if flags & FLAG_HASH_INDEX:
+            if self.end + 4 > len(buffer):
+                raise BinaryCacheError('truncated hash index')
+            self.bucket_count = self.get_array(buffer, self.end, 1)[0]
+            self.displacements = self.get_array(buffer, self.end + 4, self.bucket_count)
+            self.slots = self.get_array(buffer, self.end + 4 + self.bucket_count * 4, count)
+            self.end += 4 + (self.bucket_count + count) * 4
+
+    def get_array(self, buffer, start, length):
+        # uint32 array, a view on the buffer when the byte order allows it
+        view = memoryview(buffer)[start:start + length * 4]
+        if len(view) != length * 4:
+            raise BinaryCacheError('truncated table')
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        offsets = array.array('I', view.tobytes())
+        offsets.byteswap()
+        return offsets
+
+    def get_key(self, index):
+        start = self.key_blob_start
+        return self.buffer[start + self.key_offsets[index]:start + self.key_offsets[index + 1]]
+
+    def find(self, key):
+        # index of key, -1 when not found. the hash index gives the only possible index, without it it's a
+        # binary search over the sorted utf-8 keys
+        if not isinstance(key, str):
+            return -1
+        encoded_key = key.encode('utf-8')
+        buffer = self.buffer
+        key_offsets = self.key_offsets
+        start = self.key_blob_start
+        if self.slots is not None:
+            index = self.slots[get_hash_slot(*get_key_hashes(encoded_key), self.bucket_count, self.displacements, self.count)]
+            if buffer[start + key_offsets[index]:start + key_offsets[index + 1]] == encoded_key:
+                return index
+            return -1
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if buffer[start + key_offsets[middle]:start + key_offsets[middle + 1]] < encoded_key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and buffer[start + key_offsets[low]:start + key_offsets[low + 1]] == encoded_key:
+            return low
+        return -1
+
+    def get_value(self, index):
+        start = self.value_blob_start
+        data = self.buffer[start + self.value_offsets[index]:start + self.value_offsets[index + 1]]
+        return decode_value(self.kind, data)
+
+    def __getitem__(self, key):
+        index = self.find(key)
+        if index == -1:
+            raise KeyError(key)
+        return self.get_value(index)
+
+    def __contains__(self, key):
+        return self.find(key) != -1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.get_key(index).decode('utf-8')
+
+
+class BinaryCache():
+    # opens a cache file written by write_binary_cache, tables are exposed as MappedTable views.
+    # the pages are shared between all the processes which open the same file.
+
+    def __init__(self, filename, verify=False):
+        # verify: check the checksum, which reads the whole file, before reading the table directory.
+        # BinaryCacheError when the file can't be opened or is corrupt
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as filehandle:
+                if os.fstat(filehandle.fileno()).st_size < HEADER.size:
+                    raise BinaryCacheError(f'{filename}: truncated header')
+                self.mmap = mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise BinaryCacheError(f'{filename}: {e}') from e
+        self.load_tables(verify)
+
+    def load_tables(self, verify):
+        # errors raised by the struct, memoryview and decoding calls on a corrupt buffer become BinaryCacheError
+        try:
+            if verify:
+                self.verify()
+            self.tables = self.read_tables(self.mmap)
+        except BinaryCacheError:
+            self.close()
+            raise
+        except (struct.error, ValueError, IndexError) as e:
+            self.close()
+            raise BinaryCacheError(f'{self.filename}: corrupt file, {e}') from e
+
+    def verify(self):
+        self.read_header(self.mmap)
+        checksum = HEADER.unpack_from(self.mmap, 0)[3]
+        with memoryview(self.mmap) as view:
+            if zlib.crc32(view[HEADER.size:]) != checksum:
+                raise BinaryCacheError(f'{self.filename}: checksum mismatch, the file is corrupt')
+
+    def read_header(self, buffer):
+        # the number of tables
+        if len(buffer) < HEADER.size:
+            raise BinaryCacheError(f'{self.filename}: truncated header')
+        magic, version, table_count, checksum = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise BinaryCacheError(f'{self.filename}: not a data cache file')
+        if version != FORMAT_VERSION:
+            raise BinaryCacheError(f'{self.filename}: format version {version}, expected {FORMAT_VERSION}')
+        if HEADER.size + table_count * TABLE_ENTRY.size > len(buffer):
+            raise BinaryCacheError(f'{self.filename}: truncated table directory')
+        return table_count
+
+    def read_tables(self, buffer):
+        table_count = self.read_header(buffer)
+        tables = {}
+        for i in range(table_count):
+            name, kind, flags, count, table_offset = TABLE_ENTRY.unpack_from(buffer, HEADER.size + i * TABLE_ENTRY.size)
+            try:
+                table = MappedTable(buffer, kind, count, table_offset, flags)
+            except BinaryCacheError as e:
+                raise BinaryCacheError(f'{self.filename}: {e}')
+            if table.end > len(buffer):
+                raise BinaryCacheError(f'{self.filename}: truncated table')
+            tables[name.rstrip(b'\x00').decode('ascii')] = table
+        return tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def close(self):
+        # the tables can't be used after this
+        self.tables = {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            # memoryviews on the offset arrays are still referenced, let the gc close the map
+            pass
+
+
+class SharedBinaryCache(BinaryCache):
+    # the tables of a binary cache in a multiprocessing.shared_memory segment (python 3.8+). one process
+    # creates it with create(), the others attach to it by name: they all map the same pages and only
+    # the segment name gets passed around. the segment stays until the creating process unlinks it, or exits.
+
+    def __init__(self, name, segment=None):
+        # segment: the multiprocessing.shared_memory.SharedMemory, in the process which created it
+        self.owner = segment is not None
+        self.segment = segment
+        self.name = name
+        self.filename = f'shared memory segment {name}'
+        # a read-only mapping of our own, MappedTable compares slices of the buffer with bytes, which a
+        # memoryview like SharedMemory.buf doesn't support
+        if os.name == 'posix':
+            # rather than SharedMemory, which before python 3.13 registers the segment with a resource tracker
+            # process (started on demand) that unlinks it when this process exits
+            import _posixshmem
+            fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+            try:
+                self.mmap = mmap.mmap(fd, os.fstat(fd).st_size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        else:
+            from multiprocessing import shared_memory
+            attached_segment = shared_memory.SharedMemory(name=name)
+            self.mmap = mmap.mmap(-1, attached_segment.size, tagname=name, access=mmap.ACCESS_READ)
+            attached_segment.close()
+        self.load_tables(verify=False)
+
+    @classmethod
+    def create(cls, tables, name=None):
+        # tables: list of (name, value kind, dict), like write_binary_cache. a random name when it's None
+        from multiprocessing import shared_memory
+        layout = encode_binary_cache(tables)
+        segment = shared_memory.SharedMemory(name=name, create=True, size=len(layout))
+        segment.buf[:len(layout)] = layout
+        # the tables use their own mapping
+        segment.close()
+        return cls(segment.name, segment)
+
+    def unlink(self):
+        # removes the name of the segment, processes already attached keep their mapping
+        if self.owner:
+            self.segment.unlink()
+            self.owner = False
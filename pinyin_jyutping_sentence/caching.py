@@ -0,0 +1,100 @@
+import sys
+import threading
+import collections
+
+
+class LRUCache():
+    # bounded least recently used cache, by number of entries and / or approximate size in bytes.
+    # the version passed to validate identifies the data the entries were computed from, the
+    # cache empties itself when it changes.
+
+    # rough per-entry overhead of the key tuple and the OrderedDict node
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_entry_size(self, key, value):
+        size = self.ENTRY_OVERHEAD + sys.getsizeof(value)
+        if isinstance(key, tuple):
+            return size + sum(sys.getsizeof(item) for item in key if isinstance(item, str))
+        return size + sys.getsizeof(key)
+
+    def validate(self, version):
+        if version != self.version:
+            with self.lock:
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+
+    def update_version(self, previous_version, version, predicate):
+        # the data changed from previous_version to version in a way which only affects the keys for which
+        # predicate(key) is true: those entries are dropped, the others stay valid. a cache which wasn't
+        # at previous_version is left alone, validate empties it
+        with self.lock:
+            if self.version != previous_version:
+                return
+            for key in [key for key in self.entries if predicate(key)]:
+                self.size -= self.entries.pop(key)[1]
+            self.version = version
+
+    def get(self, key):
+        # returns None when the key isn't cached
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        entry_size = self.get_entry_size(key, value)
+        if self.max_bytes is not None and entry_size > self.max_bytes:
+            return
+        with self.lock:
+            previous_entry = self.entries.pop(key, None)
+            if previous_entry is not None:
+                self.size -= previous_entry[1]
+            self.entries[key] = (value, entry_size)
+            self.size += entry_size
+            while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                  (self.max_bytes is not None and self.size > self.max_bytes):
+                evicted_key, evicted_entry = self.entries.popitem(last=False)
+                self.size -= evicted_entry[1]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+
+class SegmentationCache(LRUCache):
+    # sentence -> list of words, as segmented. the lists are shared by every caller and must not be modified
+
+    def get_entry_size(self, key, value):
+        return self.ENTRY_OVERHEAD + sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(word) for word in value)
@@ -0,0 +1,125 @@
+import sys
+import array
+import collections.abc
+
+# compact storage for the word maps: instead of a list of syllable strings per word, each distinct syllable
+# gets a small integer id in a SyllableTable shared by the maps, the syllable id sequences are stored once
+# each in a flat array, with an offsets array, and every word points to its sequence number. the
+# traditional and simplified forms of a word share the same sequence.
+
+
+class SyllableTable():
+
+    def __init__(self):
+        self.syllables = []
+        self.ids = {}
+
+    def get_id(self, syllable):
+        syllable_id = self.ids.get(syllable)
+        if syllable_id is None:
+            syllable_id = len(self.syllables)
+            # the same string object is shared by every sequence
+            syllable = sys.intern(syllable)
+            self.syllables.append(syllable)
+            self.ids[syllable] = syllable_id
+        return syllable_id
+
+    def __len__(self):
+        return len(self.syllables)
+
+
+class CompactWordMap(collections.abc.MutableMapping):
+    # {word: [syllable, ...]} Mapping, values are rebuilt as lists of strings on lookup
+
+    def __init__(self, syllable_table, items=None):
+        self.syllable_table = syllable_table
+        self.sequence_numbers = {}
+        # syllable ids, array('I') once an id doesn't fit on 16 bits
+        self.tokens = array.array('H')
+        self.offsets = array.array('I', [0])
+        # (syllable ids) -> sequence number, to deduplicate sequences. only needed while adding words, it
+        # gets dropped after a bulk load and rebuilt when more words are added
+        self.sequence_index = {}
+        if items is not None:
+            self.update(items)
+            self.sequence_index = None
+
+    def get_sequence_index(self):
+        if self.sequence_index is None:
+            self.sequence_index = {}
+            for sequence_number in range(len(self.offsets) - 1):
+                key = tuple(self.tokens[self.offsets[sequence_number]:self.offsets[sequence_number + 1]])
+                self.sequence_index.setdefault(key, sequence_number)
+        return self.sequence_index
+
+    def add_sequence(self, syllables):
+        syllable_ids = tuple(self.syllable_table.get_id(syllable) for syllable in syllables)
+        sequence_index = self.get_sequence_index()
+        sequence_number = sequence_index.get(syllable_ids)
+        if sequence_number is None:
+            if self.tokens.typecode == 'H' and len(syllable_ids) > 0 and max(syllable_ids) > 0xFFFF:
+                self.tokens = array.array('I', self.tokens)
+            sequence_number = len(self.offsets) - 1
+            self.tokens.extend(syllable_ids)
+            self.offsets.append(len(self.tokens))
+            sequence_index[syllable_ids] = sequence_number
+        return sequence_number
+
+    def __setitem__(self, word, syllables):
+        self.sequence_numbers[word] = self.add_sequence(syllables)
+
+    def __getitem__(self, word):
+        sequence_number = self.sequence_numbers[word]
+        syllables = self.syllable_table.syllables
+        return [syllables[syllable_id] for syllable_id in self.tokens[self.offsets[sequence_number]:self.offsets[sequence_number + 1]]]
+
+    def __delitem__(self, word):
+        # the sequence itself stays in the arrays
+        del self.sequence_numbers[word]
+
+    def __contains__(self, word):
+        return word in self.sequence_numbers
+
+    def __iter__(self):
+        return iter(self.sequence_numbers)
+
+    def __len__(self):
+        return len(self.sequence_numbers)
+
+    def get_sequence_count(self):
+        return len(self.offsets) - 1
+
+    def get_size(self):
+        # bytes used by this map, not counting the shared syllable table
+        seen = set()
+        size = sys.getsizeof(self.sequence_numbers) + sys.getsizeof(self.tokens) + sys.getsizeof(self.offsets)
+        for word, sequence_number in self.sequence_numbers.items():
+            size += get_size(word, seen) + get_size(sequence_number, seen)
+        if self.sequence_index is not None:
+            size += get_size(self.sequence_index, seen)
+        return size
+
+
+def get_size(value, seen):
+    # approximate deep size in bytes of plain containers and strings, objects already in seen (by id) aren't counted again
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += get_size(key, seen) + get_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += get_size(item, seen)
+    return size
+
+
+def get_map_size(word_map):
+    # bytes of python objects used by a map, for memory reports. memory-mapped tables don't use any, their
+    # pages are shared between all the processes which map the cache file
+    if isinstance(word_map, CompactWordMap):
+        return word_map.get_size()
+    if isinstance(word_map, dict):
+        return get_size(word_map, set())
+    return 0
@@ -0,0 +1,81 @@
+import re
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# one dictionary line. jyutping is None for CC-CEDICT entries, definition is the raw /.../ text
+DictionaryEntry = collections.namedtuple('DictionaryEntry', ['traditional', 'simplified', 'pinyin', 'jyutping', 'definition'])
+
+# CC-Canto: traditional simplified [pinyin] {jyutping} /definition/
+CCCANTO_LINE_RE = re.compile(r'([^\s]+)\s([^\s]+)\s\[([^\]]*)\]\s\{([^\}]+)\}\s(.*)')
+# CC-CEDICT: traditional simplified [pinyin] /definition/
+CEDICT_LINE_RE = re.compile(r'([^\s]+)\s([^\s]+)\s\[([^\]]*)\]\s(\/[^\/]+\/.*)')
+# characters ignored when matching the characters of an entry with its syllables
+CHINESE_REMOVED_CHARACTERS = str.maketrans('', '', ',， ')
+ROMANIZATION_REMOVED_CHARACTERS = str.maketrans('', '', ',，')
+
+
+def parse_cccanto_line(line):
+    # DictionaryEntry, None if the line is malformed
+    m = CCCANTO_LINE_RE.match(line)
+    if m is None:
+        return None
+    return DictionaryEntry(*m.groups())
+
+
+def parse_cedict_line(line):
+    m = CEDICT_LINE_RE.match(line)
+    if m is None:
+        return None
+    traditional, simplified, pinyin, definition = m.groups()
+    return DictionaryEntry(traditional, simplified, pinyin, None, definition)
+
+
+def parse_line(line):
+    # a line in either format, None if it's malformed
+    entry = parse_cccanto_line(line)
+    if entry is None:
+        entry = parse_cedict_line(line)
+    return entry
+
+
+class DictionaryParser():
+    # parses the lines of one kind of dictionary file ('cccanto' or 'cedict') into DictionaryEntry records.
+    # comments are skipped, malformed lines are counted and skipped.
+
+    MAX_MALFORMED_EXAMPLES = 10
+
+    def __init__(self, kind):
+        if kind not in ['cccanto', 'cedict']:
+            raise ValueError(f'unknown dictionary kind {kind}, expected cccanto or cedict')
+        self.kind = kind
+        self.parse_line = parse_cccanto_line if kind == 'cccanto' else parse_cedict_line
+        self.entry_count = 0
+        self.malformed_count = 0
+        # the first few malformed lines, for the report
+        self.malformed_lines = []
+
+    def parse_lines(self, lines):
+        for line in lines:
+            if line[:1] == '#':
+                continue
+            if self.kind == 'cccanto' and line == "and add boilerplate:\n":
+                continue
+            entry = self.parse_line(line)
+            if entry is None:
+                if len(line.strip()) == 0:
+                    continue
+                self.malformed_count += 1
+                if len(self.malformed_lines) < self.MAX_MALFORMED_EXAMPLES:
+                    self.malformed_lines.append(line.rstrip('\n'))
+                continue
+            self.entry_count += 1
+            yield entry
+
+    def parse_file(self, filename):
+        with open(filename, 'r', encoding='utf8') as filehandle:
+            yield from self.parse_lines(filehandle)
+
+    def report(self):
+        return {'entries': self.entry_count, 'malformed': self.malformed_count, 'malformed_examples': list(self.malformed_lines)}
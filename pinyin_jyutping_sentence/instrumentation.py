@@ -0,0 +1,73 @@
+import time
+import threading
+
+# counters, per sentence and in total
+COUNTERS = [
+    'sentences',
+    'words',
+    # words found as a whole in the word map
+    'word_map_hits',
+    # words of several characters missing from the word map, converted character by character
+    'char_fallback_words',
+    # characters converted with their most frequent reading
+    'char_readings',
+    # characters without any reading (punctuation, latin, unknown), passed through as is
+    'unknown_characters',
+    'decode_calls',
+]
+
+# seconds, per sentence and in total. lookup_time is the time spent in get_romanization, minus decoding
+TIMERS = [
+    'segment_time',
+    'lookup_time',
+    'decode_time',
+]
+
+
+class Instrumentation():
+    # accumulates the measurements of every instrumented sentence. the callback, when given, is called
+    # after each sentence with its own measurements, plus 'sentence' and 'result'.
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = dict.fromkeys(COUNTERS, 0)
+            self.totals.update(dict.fromkeys(TIMERS, 0.0))
+            self.start_time = time.time()
+
+    def new_measurements(self):
+        measurements = dict.fromkeys(COUNTERS, 0)
+        measurements.update(dict.fromkeys(TIMERS, 0.0))
+        return measurements
+
+    def count_word(self, measurements, word, word_map, char_map, best_reading_map):
+        # same decisions as RomanizationConversion.get_romanization
+        measurements['words'] += 1
+        if len(word) > 1 and word in word_map:
+            measurements['word_map_hits'] += 1
+            return
+        if len(word) > 1:
+            measurements['char_fallback_words'] += 1
+        readings = best_reading_map if best_reading_map is not None else char_map
+        for char in word:
+            if char in readings:
+                measurements['char_readings'] += 1
+            else:
+                measurements['unknown_characters'] += 1
+
+    def record(self, measurements):
+        with self.lock:
+            for key in self.totals:
+                self.totals[key] += measurements[key]
+        if self.callback is not None:
+            self.callback(measurements)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.totals)
+        stats['elapsed'] = time.time() - self.start_time
+        return stats
@@ -0,0 +1,118 @@
+import os
+import itertools
+import collections
+import multiprocessing
+import logging
+import jieba
+
+logger = logging.getLogger(__name__)
+
+# RomanizationConversion used inside the worker processes. with the fork start method it is set in
+# the parent right before the pool is created and inherited by the workers, already loaded.
+worker_conversion = None
+
+
+def initialize_worker():
+    # spawn start method: the workers don't inherit anything, use the module level instance, which
+    # loads from the memory-mapped cache file when present
+    global worker_conversion
+    if worker_conversion is None:
+        import pinyin_jyutping_sentence
+        worker_conversion = pinyin_jyutping_sentence.romanization_conversion
+
+
+def convert_chunk(arguments):
+    mode, sentences, tone_numbers, spaces, remove_tones = arguments
+    if mode == 'pinyin':
+        results = worker_conversion.process_sentences_pinyin(sentences, tone_numbers, spaces, remove_tones)
+    else:
+        results = worker_conversion.process_sentences_jyutping(sentences, tone_numbers, spaces, remove_tones)
+    return list(results)
+
+
+def build_chunk(arguments):
+    mode, entries = arguments
+    worker_conversion.load_jieba_dictionary()
+    return worker_conversion.build_maps(mode, entries)
+
+
+def build_chunks(romanization_conversion, tasks, workers, start_method=None):
+    # runs RomanizationConversion.build_maps over (mode, entries) tasks, results in task order
+    global worker_conversion
+    if start_method is None and 'fork' in multiprocessing.get_all_start_methods():
+        start_method = 'fork'
+    context = multiprocessing.get_context(start_method)
+    if context.get_start_method() == 'fork':
+        # initialize jieba once in the parent, the workers inherit it
+        romanization_conversion.load_jieba_dictionary()
+        jieba.initialize()
+        worker_conversion = romanization_conversion
+    with context.Pool(min(workers, len(tasks)), initializer=initialize_worker) as pool:
+        return pool.map(build_chunk, tasks, chunksize=1)
+
+
+class ParallelConverter():
+    # shards batches of sentences across a pool of processes, results come back in input order.
+    # usage:
+    #   with ParallelConverter(pinyin_jyutping_sentence.romanization_conversion, workers=16) as converter:
+    #       for result in converter.process_sentences_pinyin(sentences):
+    #           ...
+
+    CHUNK_SIZE = 256
+    # chunks submitted ahead of the one being consumed, per worker
+    CHUNKS_IN_FLIGHT_PER_WORKER = 4
+
+    def __init__(self, romanization_conversion, workers=None, chunk_size=None, start_method=None):
+        self.romanization_conversion = romanization_conversion
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        if start_method is None and 'fork' in multiprocessing.get_all_start_methods():
+            start_method = 'fork'
+        self.start_method = start_method
+        self.pool = None
+
+    def get_pool(self):
+        global worker_conversion
+        if self.pool is None:
+            context = multiprocessing.get_context(self.start_method)
+            if context.get_start_method() == 'fork':
+                # load everything once in the parent, the workers share the pages
+                self.romanization_conversion.warm_up(pinyin=True, jyutping=True)
+                worker_conversion = self.romanization_conversion
+            logger.info('starting %d conversion workers (%s)', self.workers, context.get_start_method())
+            self.pool = context.Pool(self.workers, initializer=initialize_worker)
+        return self.pool
+
+    def process_sentences(self, mode, sentences, tone_numbers, spaces, remove_tones):
+        pool = self.get_pool()
+        sentences = iter(sentences)
+        # bounded number of chunks in flight, so that a large input isn't read all at once
+        pending = collections.deque()
+        max_pending = self.workers * self.CHUNKS_IN_FLIGHT_PER_WORKER
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(itertools.islice(sentences, self.chunk_size))
+                if len(chunk) == 0:
+                    break
+                pending.append(pool.apply_async(convert_chunk, [(mode, chunk, tone_numbers, spaces, remove_tones)]))
+            if len(pending) == 0:
+                return
+            yield from pending.popleft().get()
+
+    def process_sentences_pinyin(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.process_sentences('pinyin', sentences, tone_numbers, spaces, remove_tones)
+
+    def process_sentences_jyutping(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.process_sentences('jyutping', sentences, tone_numbers, spaces, remove_tones)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,166 @@
+import re
+import math
+import threading
+import logging
+import jieba
+
+logger = logging.getLogger(__name__)
+
+# runs of latin letters / digits are kept together, like jieba does
+LATIN_RE = re.compile('[a-zA-Z0-9+#&\\._%\\-]+')
+# anything else which isn't whitespace goes through the dictionary based segmentation
+OTHER_RE = re.compile('[^a-zA-Z0-9+#&\\._%\\-\\s]+')
+# set once user dictionary words have been added to the global jieba tokenizer, which then can't be used to
+# build the maps anymore, see RomanizationConversion.get_build_tokenizer
+jieba_user_words_added = False
+
+
+class JiebaSegmenter():
+
+    def __init__(self, romanization_conversion):
+        self.romanization_conversion = romanization_conversion
+
+    def initialize(self):
+        jieba.initialize()
+
+    def segment(self, sentence):
+        return list(jieba.cut(sentence))
+
+    def add_words(self, words, previous_version):
+        # user dictionary words, jieba picks a frequency high enough for them to be kept whole.
+        # note that this changes the global jieba tokenizer
+        global jieba_user_words_added
+        for word in words:
+            if len(word) > 1:
+                jieba.add_word(word)
+                jieba_user_words_added = True
+
+
+class TrieSegmenter():
+    # segments against the keys of pinyin_word_map and jyutping_word_map, ie the words which can actually
+    # be romanized as a whole. all the prefixes of the words are stored in a flat dict (prefix -> is a word),
+    # which works like a trie: extending a match stops as soon as the prefix isn't known.
+    # among all the segmentations of a run of characters, the one with the fewest words wins, ties go to the
+    # segmentation whose single characters are the most frequent according to the char map counts.
+
+    def __init__(self, romanization_conversion):
+        self.romanization_conversion = romanization_conversion
+        self.prefixes = None
+        self.char_weights = {}
+        self.data_version = None
+        self.lock = threading.Lock()
+
+    def initialize(self):
+        self.get_prefixes()
+
+    def get_prefixes(self):
+        rc = self.romanization_conversion
+        rc.ensure_loaded(pinyin=True, jyutping=True)
+        data = rc.conversion_data
+        data_version = (id(data), data.generation)
+        if self.prefixes is None or self.data_version != data_version:
+            with self.lock:
+                if self.prefixes is None or self.data_version != data_version:
+                    logger.debug('building trie segmenter index')
+                    prefixes = {}
+                    for word_map in [data.pinyin_word_map, data.jyutping_word_map]:
+                        for word in word_map:
+                            self.add_word(prefixes, word)
+                    self.char_weights = {}
+                    self.prefixes = prefixes
+                    self.data_version = data_version
+        return self.prefixes
+
+    def add_words(self, words, previous_version):
+        # words added to the word maps since previous_version, the (id(data), generation) of the data
+        # before they were added. the index is updated in place when it was up to date, otherwise it
+        # gets rebuilt on next use anyway
+        data = self.romanization_conversion.conversion_data
+        with self.lock:
+            if self.prefixes is None or self.data_version != previous_version:
+                return
+            for word in words:
+                self.add_word(self.prefixes, word)
+            # the character counts changed too
+            self.char_weights = {}
+            self.data_version = (id(data), data.generation)
+
+    def add_word(self, prefixes, word):
+        for length in range(1, len(word)):
+            prefixes.setdefault(word[:length], False)
+        prefixes[word] = True
+
+    def get_char_weight(self, char):
+        weight = self.char_weights.get(char)
+        if weight is None:
+            data = self.romanization_conversion.conversion_data
+            count = 0
+            for char_map in [data.pinyin_char_map, data.jyutping_char_map]:
+                readings = char_map.get(char)
+                if readings is not None:
+                    count += sum(readings.values())
+            weight = math.log(count + 1)
+            self.char_weights[char] = weight
+        return weight
+
+    def segment_run(self, text, prefixes):
+        length = len(text)
+        # route[i]: (word count, -weight, end of the first word) of the best segmentation of text[i:]
+        route = [None] * length + [(0, 0.0, length)]
+        for i in range(length - 1, -1, -1):
+            next_route = route[i + 1]
+            best = (next_route[0] + 1, next_route[1] - self.get_char_weight(text[i]), i + 1)
+            j = i + 2
+            while j <= length:
+                is_word = prefixes.get(text[i:j])
+                if is_word is None:
+                    break
+                if is_word:
+                    next_route = route[j]
+                    candidate = (next_route[0] + 1, next_route[1], j)
+                    if candidate < best:
+                        best = candidate
+                j += 1
+            route[i] = best
+        words = []
+        i = 0
+        while i < length:
+            end = route[i][2]
+            words.append(text[i:end])
+            i = end
+        return words
+
+    def segment(self, sentence):
+        prefixes = self.get_prefixes()
+        words = []
+        position = 0
+        length = len(sentence)
+        while position < length:
+            char = sentence[position]
+            if char == '\r' and sentence[position + 1:position + 2] == '\n':
+                words.append('\r\n')
+                position += 2
+                continue
+            if char.isspace():
+                words.append(char)
+                position += 1
+                continue
+            m = LATIN_RE.match(sentence, position)
+            if m is not None:
+                words.append(m.group(0))
+                position = m.end()
+                continue
+            m = OTHER_RE.match(sentence, position)
+            if m is None:
+                words.append(char)
+                position += 1
+                continue
+            words.extend(self.segment_run(m.group(0), prefixes))
+            position = m.end()
+        return words
+
+
+SEGMENTERS = {
+    'jieba': JiebaSegmenter,
+    'trie': TrieSegmenter,
+}
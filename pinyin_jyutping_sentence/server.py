@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import stat
+import socket
+import tempfile
+import threading
+import collections
+import socketserver
+import http.server
+import http.client
+import logging
+
+logger = logging.getLogger(__name__)
+
+# protocol: newline delimited json, one request per line, one response line per request, in order.
+#
+# request:  {"id": 1, "mode": "pinyin", "sentences": ["我很好", ...], "tone_numbers": false, "spaces": false, "remove_tones": false}
+#           {"id": 2, "mode": "jyutping", "sentence": "我很好"}
+#           {"id": 3, "command": "stats"}
+# response: {"id": 1, "results": ["wǒ hěn hǎo", ...], "latency_ms": 0.21, "queue_depth": 1}
+#           {"id": 2, "result": "ngǒ hǎn hóu", "latency_ms": 0.05, "queue_depth": 1}
+#           {"id": 3, "stats": {...}}
+#           {"id": 4, "error": "unknown mode"}
+#
+# over a unix socket, the lines are exchanged on a persistent connection. over http, the request lines
+# are the body of a POST to /, the response lines come back in the response body, GET /stats returns the stats.
+
+
+def get_default_socket_path():
+    # per user: in $XDG_RUNTIME_DIR, which only the user can access, otherwise in the temp directory with the user
+    # id in the name
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'pinyin_jyutping_sentence.sock')
+    return os.path.join(tempfile.gettempdir(), f'pinyin_jyutping_sentence-{os.getuid()}.sock')
+
+
+DEFAULT_SOCKET_PATH = get_default_socket_path()
+DEFAULT_PORT = 8765
+# number of recent latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+
+class ConversionService():
+    # executes the requests against one warm RomanizationConversion, keeps the latency and queue depth stats
+
+    def __init__(self, romanization_conversion):
+        self.romanization_conversion = romanization_conversion
+        self.lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.request_count = 0
+        self.error_count = 0
+        self.sentence_count = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.start_time = time.time()
+
+    def convert(self, request):
+        mode = request.get('mode', 'pinyin')
+        if mode not in ['pinyin', 'jyutping']:
+            raise ValueError(f'unknown mode {mode}, expected pinyin or jyutping')
+        options = [bool(request.get('tone_numbers', False)), bool(request.get('spaces', False)), bool(request.get('remove_tones', False))]
+        rc = self.romanization_conversion
+        if 'sentences' in request:
+            sentences = request['sentences']
+            if not isinstance(sentences, list) or not all(isinstance(sentence, str) for sentence in sentences):
+                raise ValueError('sentences should be a list of strings')
+            convert_many = rc.process_sentences_pinyin if mode == 'pinyin' else rc.process_sentences_jyutping
+            return {'results': list(convert_many(sentences, *options))}, len(sentences)
+        sentence = request.get('sentence')
+        if not isinstance(sentence, str):
+            raise ValueError('either sentence or sentences is required')
+        convert_one = rc.process_sentence_pinyin if mode == 'pinyin' else rc.process_sentence_jyutping
+        return {'result': convert_one(sentence, *options)}, 1
+
+    def handle_request(self, request):
+        if not isinstance(request, dict):
+            return {'error': 'request should be a json object'}
+        if request.get('command') == 'stats':
+            return {'id': request.get('id'), 'stats': self.stats()}
+        with self.lock:
+            self.queue_depth += 1
+            queue_depth = self.queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        start = time.perf_counter()
+        try:
+            response, sentence_count = self.convert(request)
+            error = False
+        except Exception as exception:
+            response, sentence_count = {'error': str(exception)}, 0
+            error = True
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.queue_depth -= 1
+            self.request_count += 1
+            self.error_count += error
+            self.sentence_count += sentence_count
+            self.latencies.append(latency)
+        response['id'] = request.get('id')
+        response['latency_ms'] = latency * 1000
+        response['queue_depth'] = queue_depth
+        logger.debug('request %s: %d sentences in %.3fms, queue depth %d', request.get('id'), sentence_count, latency * 1000, queue_depth)
+        return response
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as exception:
+            response = {'id': None, 'error': f'invalid json: {exception}'}
+        else:
+            response = self.handle_request(request)
+        return json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'uptime': time.time() - self.start_time,
+                'requests': self.request_count,
+                'errors': self.error_count,
+                'sentences': self.sentence_count,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+            }
+        for name, fraction in [('latency_p50_ms', 0.5), ('latency_p99_ms', 0.99)]:
+            stats[name] = latencies[int(fraction * (len(latencies) - 1))] * 1000 if len(latencies) > 0 else None
+        stats['latency_mean_ms'] = sum(latencies) / len(latencies) * 1000 if len(latencies) > 0 else None
+        stats['sentence_cache'] = self.romanization_conversion.sentence_cache_stats()
+        stats['segmentation_cache'] = self.romanization_conversion.segmentation_cache_stats()
+        return stats
+
+
+class StreamRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if len(line.strip()) == 0:
+                continue
+            self.wfile.write(self.server.service.handle_line(line))
+            self.wfile.flush()
+
+
+class HTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_body(404, b'not found\n', 'text/plain')
+            return
+        body = json.dumps(self.server.service.stats()).encode('utf-8') + b'\n'
+        self.send_body(200, body, 'application/json')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        lines = self.rfile.read(length).splitlines()
+        body = b''.join(self.server.service.handle_line(line) for line in lines if len(line.strip()) > 0)
+        self.send_body(200, body, 'application/x-ndjson')
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        super().server_bind()
+        # only the user running the server can connect
+        os.chmod(self.server_address, 0o600)
+
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(socket_path):
+    # removes a socket left over by a server which didn't shut down cleanly. raises OSError when a server is
+    # still listening on it, or when the path isn't a socket
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise OSError(f'{socket_path} exists and is not a socket')
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        logger.info('removing stale socket %s', socket_path)
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f'a server is already running on {socket_path}')
+
+
+def create_server(romanization_conversion, socket_path=None, host=None, port=None):
+    # unix socket server on socket_path, or http server on host:port when a port is given
+    service = ConversionService(romanization_conversion)
+    if port is not None:
+        server = HTTPServer((host or '127.0.0.1', port), HTTPRequestHandler)
+    else:
+        socket_path = socket_path or DEFAULT_SOCKET_PATH
+        if os.path.exists(socket_path):
+            remove_stale_socket(socket_path)
+        server = UnixServer(socket_path, StreamRequestHandler)
+    server.service = service
+    return server
+
+
+def serve(romanization_conversion, socket_path=None, host=None, port=None):
+    # loads everything, then serves until interrupted
+    start = time.perf_counter()
+    romanization_conversion.warm_up(pinyin=True, jyutping=True)
+    logger.info('conversion data loaded in %.2fs', time.perf_counter() - start)
+    server = create_server(romanization_conversion, socket_path, host, port)
+    logger.info('serving on %s', server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if port is None:
+            os.unlink(server.server_address)
+
+
+class Client():
+    # thin client for a conversion server. when the server can't be reached and fallback is enabled, the
+    # conversions are done in-process with the module level RomanizationConversion instead.
+    # usage:
+    #   client = Client()  # default unix socket
+    #   client = Client(port=8765)  # http server on localhost
+    #   client.pinyin('我很好'), client.pinyin_many(sentences)
+
+    def __init__(self, socket_path=None, host=None, port=None, timeout=30, fallback=True):
+        self.socket_path = socket_path or DEFAULT_SOCKET_PATH
+        self.host = host or '127.0.0.1'
+        self.port = port
+        self.timeout = timeout
+        self.fallback = fallback
+        self.connection = None
+        self.socket = None
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.port is not None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        if self.socket_path == DEFAULT_SOCKET_PATH and os.stat(self.socket_path).st_uid != os.getuid():
+            # the default socket is in the temp directory, another user could have created it
+            raise PermissionError(f'{self.socket_path} belongs to another user')
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        self.socket.connect(self.socket_path)
+        return self.socket.makefile('rwb')
+
+    def exchange(self, request_line):
+        if self.connection is None:
+            self.connection = self.connect()
+        if self.port is not None:
+            self.connection.request('POST', '/', body=request_line, headers={'Content-Type': 'application/x-ndjson'})
+            response = self.connection.getresponse()
+            return response.read()
+        self.connection.write(request_line)
+        self.connection.flush()
+        response_line = self.connection.readline()
+        if len(response_line) == 0:
+            raise ConnectionError('connection closed by the server')
+        return response_line
+
+    def send(self, request):
+        with self.lock:
+            self.next_id += 1
+            request['id'] = self.next_id
+            request_line = json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n'
+            # a connection which went stale (server restarted) is retried once
+            for attempt in range(2):
+                try:
+                    response = json.loads(self.exchange(request_line))
+                    break
+                except (OSError, http.client.HTTPException) as exception:
+                    self.close()
+                    if attempt == 1:
+                        raise
+                    logger.debug('retrying after error: %s', exception)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def convert(self, mode, sentence, sentences, tone_numbers, spaces, remove_tones):
+        request = {'mode': mode, 'tone_numbers': tone_numbers, 'spaces': spaces, 'remove_tones': remove_tones}
+        if sentences is not None:
+            request['sentences'] = list(sentences)
+        else:
+            request['sentence'] = sentence
+        try:
+            response = self.send(request)
+        except (OSError, http.client.HTTPException) as exception:
+            if not self.fallback:
+                raise
+            logger.warning('conversion server unavailable (%s), converting in-process', exception)
+            return self.convert_in_process(mode, sentence, sentences, tone_numbers, spaces, remove_tones)
+        if sentences is not None:
+            return response['results']
+        return response['result']
+
+    def convert_in_process(self, mode, sentence, sentences, tone_numbers, spaces, remove_tones):
+        import pinyin_jyutping_sentence
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        if sentences is not None:
+            convert_many = rc.process_sentences_pinyin if mode == 'pinyin' else rc.process_sentences_jyutping
+            return list(convert_many(sentences, tone_numbers, spaces, remove_tones))
+        convert_one = rc.process_sentence_pinyin if mode == 'pinyin' else rc.process_sentence_jyutping
+        return convert_one(sentence, tone_numbers, spaces, remove_tones)
+
+    def pinyin(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.convert('pinyin', sentence, None, tone_numbers, spaces, remove_tones)
+
+    def jyutping(self, sentence, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.convert('jyutping', sentence, None, tone_numbers, spaces, remove_tones)
+
+    def pinyin_many(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        # returns a list, the whole batch is sent as one request
+        return self.convert('pinyin', None, sentences, tone_numbers, spaces, remove_tones)
+
+    def jyutping_many(self, sentences, tone_numbers=False, spaces=False, remove_tones=False):
+        return self.convert('jyutping', None, sentences, tone_numbers, spaces, remove_tones)
+
+    def stats(self):
+        # server stats, raises if the server can't be reached
+        return self.send({'command': 'stats'})['stats']
+
+    def close(self):
+        for connection in [self.connection, self.socket]:
+            if connection is not None:
+                try:
+                    connection.close()
+                except OSError:
+                    pass
+        self.connection = None
+        self.socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
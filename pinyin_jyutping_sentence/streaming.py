@@ -0,0 +1,144 @@
+import io
+import re
+import time
+import codecs
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the input is cut after a newline, or after a run of sentence ending punctuation (with its closing quotes).
+# punctuation is always a word of its own, so converting the pieces separately gives the same result as
+# converting the whole line.
+SENTENCE_END_RE = re.compile('\n|[。！？!?；;…]+[」』”’）)]*')
+
+READ_SIZE = 65536
+# a piece without any sentence boundary is cut at this length, so that memory stays bounded
+MAX_PIECE_LENGTH = 65536
+
+
+class StreamStats():
+    # throughput of a streaming conversion, updated as the conversion runs
+
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def get_elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    def bytes_per_second(self):
+        elapsed = self.get_elapsed()
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def lines_per_second(self):
+        elapsed = self.get_elapsed()
+        return self.lines / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'bytes': self.bytes,
+            'lines': self.lines,
+            'elapsed': self.get_elapsed(),
+            'bytes_per_second': self.bytes_per_second(),
+            'lines_per_second': self.lines_per_second(),
+        }
+
+
+def read_text(in_fh, stats, read_size):
+    # text chunks from a text or binary (utf-8) file handle
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = in_fh.read(read_size)
+        if isinstance(chunk, bytes):
+            # a multibyte character can straddle two reads, the decoder keeps the incomplete bytes
+            stats.bytes += len(chunk)
+            text = decoder.decode(chunk, final=len(chunk) == 0)
+        else:
+            stats.bytes += len(chunk.encode('utf-8'))
+            text = chunk
+        if len(text) > 0:
+            yield text
+        if len(chunk) == 0:
+            return
+
+
+def split_pieces(in_fh, stats, read_size=READ_SIZE, max_piece_length=MAX_PIECE_LENGTH):
+    # generates (text, line ending) pieces. the line ending is None when the piece is followed by more
+    # text on the same line, '' for the last line of a file which doesn't end with a newline.
+    buffer = ''
+    for chunk in read_text(in_fh, stats, read_size):
+        buffer += chunk
+        position = 0
+        for m in SENTENCE_END_RE.finditer(buffer):
+            end = m.end()
+            if m.group(0) == '\n':
+                text = buffer[position:end - 1]
+                if text.endswith('\r'):
+                    yield text[:-1], '\r\n'
+                else:
+                    yield text, '\n'
+                stats.lines += 1
+            else:
+                yield buffer[position:end], None
+            position = end
+        buffer = buffer[position:]
+        while len(buffer) > max_piece_length:
+            yield buffer[:max_piece_length], None
+            buffer = buffer[max_piece_length:]
+    if len(buffer) > 0:
+        yield buffer, ''
+        stats.lines += 1
+
+
+def convert_pieces(romanization_conversion, in_fh, mode, tone_numbers, spaces, remove_tones, workers, stats):
+    line_endings = collections.deque()
+
+    def get_texts():
+        for text, line_ending in split_pieces(in_fh, stats):
+            line_endings.append(line_ending)
+            yield text
+
+    if mode == 'pinyin':
+        results = romanization_conversion.process_sentences_pinyin(get_texts(), tone_numbers, spaces, remove_tones, workers=workers)
+    elif mode == 'jyutping':
+        results = romanization_conversion.process_sentences_jyutping(get_texts(), tone_numbers, spaces, remove_tones, workers=workers)
+    else:
+        raise ValueError(f'unknown mode {mode}, expected pinyin or jyutping')
+
+    # pieces of the same line are joined with a space, like the words of a sentence
+    line_started = False
+    for result in results:
+        line_ending = line_endings.popleft()
+        if len(result) > 0:
+            if line_started:
+                result = ' ' + result
+            line_started = True
+        if line_ending is not None:
+            result += line_ending
+            line_started = False
+        if len(result) > 0:
+            yield result
+
+
+def iter_convert_stream(romanization_conversion, in_fh, mode='pinyin', tone_numbers=False, spaces=False, remove_tones=False, workers=None, stats=None):
+    # generator over the converted text, see RomanizationConversion.iter_convert_stream
+    stats = stats if stats is not None else StreamStats()
+    try:
+        yield from convert_pieces(romanization_conversion, in_fh, mode, tone_numbers, spaces, remove_tones, workers, stats)
+    finally:
+        stats.end_time = time.perf_counter()
+
+
+def convert_stream(romanization_conversion, in_fh, out_fh, mode='pinyin', tone_numbers=False, spaces=False, remove_tones=False, workers=None):
+    # see RomanizationConversion.convert_stream
+    stats = StreamStats()
+    binary_output = isinstance(out_fh, (io.RawIOBase, io.BufferedIOBase))
+    for result in iter_convert_stream(romanization_conversion, in_fh, mode, tone_numbers, spaces, remove_tones, workers, stats):
+        out_fh.write(result.encode('utf-8') if binary_output else result)
+    logger.info('converted %d lines, %d bytes in %.2fs: %.0f lines/s, %.0f bytes/s',
+        stats.lines, stats.bytes, stats.get_elapsed(), stats.lines_per_second(), stats.bytes_per_second())
+    return stats
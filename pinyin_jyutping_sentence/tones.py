@@ -0,0 +1,87 @@
+import threading
+
+# tone rendering as a separate stage, over the syllables of a whole word, sentence or batch: each syllable is
+# rendered in a style once, with the decoder of its romanization, and looked up in the render table of the
+# style after that.
+#
+# styles:
+#  'diacritics':   nǐ hǎo, něi hóu
+#  'tone_numbers': ni3 hao3, nei5 hou2, the syllables as they are in the dictionaries
+#  'no_tones':     ni hao, nei hou
+#  'superscript':  ni³ hao³, nei⁵ hou²
+
+DIACRITICS = 'diacritics'
+TONE_NUMBERS = 'tone_numbers'
+NO_TONES = 'no_tones'
+SUPERSCRIPT = 'superscript'
+STYLES = [DIACRITICS, TONE_NUMBERS, NO_TONES, SUPERSCRIPT]
+
+# (tone_numbers, remove_tones) arguments of the decoders for each style, superscript is derived from tone_numbers
+DECODE_ARGUMENTS = {
+    DIACRITICS: (False, False),
+    TONE_NUMBERS: (True, False),
+    NO_TONES: (False, True),
+}
+SUPERSCRIPT_DIGITS = str.maketrans('0123456789', '⁰¹²³⁴⁵⁶⁷⁸⁹')
+
+
+def get_style(tone_numbers, remove_tones):
+    # style of the tone_numbers / remove_tones options of the conversion functions
+    if remove_tones:
+        return NO_TONES
+    if tone_numbers:
+        return TONE_NUMBERS
+    return DIACRITICS
+
+
+def check_style(style):
+    if style not in STYLES:
+        raise ValueError(f'unknown tone style {style}, available: {", ".join(STYLES)}')
+
+
+class ToneRenderer():
+    # render tables of one romanization, {syllable: rendered syllable} for each style. decode_function is
+    # decode_pinyin or decode_jyutping. the set of distinct syllables is small, tables are only emptied
+    # if they grow past max_size (garbage input, user entries)
+
+    def __init__(self, decode_function, max_size):
+        self.decode_function = decode_function
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tables = {style: {} for style in STYLES}
+
+    def render_syllable(self, syllable, style):
+        if style == SUPERSCRIPT:
+            return self.decode_function(syllable, True, False).translate(SUPERSCRIPT_DIGITS)
+        tone_numbers, remove_tones = DECODE_ARGUMENTS[style]
+        return self.decode_function(syllable, tone_numbers, remove_tones)
+
+    def fill(self, syllables, style):
+        # adds the missing syllables to the table of style, returns the table
+        table = self.tables[style]
+        missing = [syllable for syllable in set(syllables) if syllable not in table]
+        if len(missing) > 0:
+            with self.lock:
+                if len(table) + len(missing) > self.max_size:
+                    table = {}
+                    self.tables[style] = table
+                for syllable in missing:
+                    table[syllable] = self.render_syllable(syllable, style)
+        return table
+
+    def render(self, syllables, style):
+        # list of the rendered syllables
+        table = self.tables[style]
+        try:
+            return [table[syllable] for syllable in syllables]
+        except KeyError:
+            table = self.fill(syllables, style)
+            return [table[syllable] for syllable in syllables]
+
+    def render_styles(self, syllables, styles):
+        # {style: list of the rendered syllables}, the syllables are only iterated once per style
+        syllables = list(syllables)
+        return {style: self.render(syllables, style) for style in styles}
+
+    def get_table_size(self):
+        return sum(len(table) for table in self.tables.values())
@@ -0,0 +1,202 @@
+import os
+import json
+import collections.abc
+import logging
+from . import binary_cache
+from . import dictionary
+
+logger = logging.getLogger(__name__)
+
+# user entries are applied as an overlay over the maps loaded from the cache files or built from the
+# dictionaries. the base maps, which can be read-only tables over the memory-mapped binary cache, are
+# never modified, and the user entries are persisted in their own file next to the cache files.
+#
+# priorities:
+#  'override': the user entry wins. its words replace the dictionary ones, a single character entry
+#              becomes the most frequent reading of its character, the characters of longer entries
+#              get their readings counted like a dictionary entry would.
+#  'fallback': the user entry only fills the gaps, words and characters already known are left alone.
+
+OVERRIDE = 'override'
+FALLBACK = 'fallback'
+PRIORITIES = [OVERRIDE, FALLBACK]
+
+FILE_VERSION = 1
+
+
+class OverlayMap(collections.abc.Mapping):
+    # read-only Mapping over a base map, with the overrides looked up first. values are never None
+
+    def __init__(self, base):
+        self.base = base
+        self.overrides = {}
+        # number of overridden keys which aren't in the base map
+        self.added_count = 0
+
+    def set_override(self, key, value):
+        if key not in self.overrides and key not in self.base:
+            self.added_count += 1
+        self.overrides[key] = value
+
+    def __getitem__(self, key):
+        value = self.overrides.get(key)
+        if value is not None:
+            return value
+        return self.base[key]
+
+    def get(self, key, default=None):
+        value = self.overrides.get(key)
+        if value is not None:
+            return value
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.base
+
+    def __iter__(self):
+        yield from self.overrides
+        for key in self.base:
+            if key not in self.overrides:
+                yield key
+
+    def __len__(self):
+        return len(self.base) + self.added_count
+
+
+def get_base_map(word_map):
+    # the map without the user entries
+    if isinstance(word_map, OverlayMap):
+        return word_map.base
+    return word_map
+
+
+def get_overlay(data, name):
+    # the OverlayMap of ConversionData.<name>, created on first use
+    word_map = getattr(data, name)
+    if not isinstance(word_map, OverlayMap):
+        word_map = OverlayMap(word_map)
+        setattr(data, name, word_map)
+    return word_map
+
+
+def get_syllables(chinese, romanization):
+    # (characters, syllables) of an entry, None when they don't match one to one
+    chinese = chinese.translate(dictionary.CHINESE_REMOVED_CHARACTERS)
+    syllables = romanization.translate(dictionary.ROMANIZATION_REMOVED_CHARACTERS).split()
+    if len(chinese) == 0 or len(syllables) != len(chinese):
+        return None
+    return chinese, syllables
+
+
+def add_reading(data, char_map, best_reading_map, char, syllable, priority, single_character):
+    readings = char_map.get(char)
+    if priority == FALLBACK:
+        if char in char_map.base:
+            return
+        readings = dict(readings or {})
+        readings[syllable] = readings.get(syllable, 0) + 1
+    else:
+        readings = dict(readings or {})
+        if single_character and len(readings) > 0:
+            if data.get_best_reading(readings) != syllable:
+                # one more than the most frequent reading, so that recomputing the best readings from the
+                # counts gives the same result
+                readings[syllable] = max(readings.values()) + 1
+        else:
+            readings[syllable] = readings.get(syllable, 0) + 1
+    char_map.set_override(char, readings)
+    best_reading_map.set_override(char, data.get_best_reading(readings))
+
+
+def apply_entry(data, entry, priority, modes):
+    # applies a dictionary.DictionaryEntry to the maps of the given modes ('pinyin', 'jyutping').
+    # returns the set of words and characters whose conversion may have changed
+    changed = set()
+    for mode in modes:
+        romanization = entry.pinyin if mode == 'pinyin' else entry.jyutping
+        if romanization is None:
+            continue
+        word_map = get_overlay(data, f'{mode}_word_map')
+        char_map = get_overlay(data, f'{mode}_char_map')
+        best_reading_map = get_overlay(data, f'{mode}_best_reading_map')
+        # both forms, the characters are counted twice when they are the same, like in the dictionaries
+        for chinese in [entry.traditional, entry.simplified]:
+            result = get_syllables(chinese, romanization)
+            if result is None:
+                continue
+            chinese, syllables = result
+            if len(chinese) > 1 and (priority == OVERRIDE or chinese not in word_map):
+                word_map.set_override(chinese, syllables)
+                changed.add(chinese)
+            for char, syllable in zip(chinese, syllables):
+                add_reading(data, char_map, best_reading_map, char, syllable.lower(), priority, len(chinese) == 1)
+                changed.add(char)
+    return changed
+
+
+class UserDictionary():
+    # the user entries, in the order in which they were added, with their priority. the persistent ones
+    # are saved to filename, and applied again every time the maps are loaded.
+
+    def __init__(self, filename):
+        self.filename = filename
+        # (DictionaryEntry, priority, persistent)
+        self.entries = []
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'r', encoding='utf8') as input_file:
+            data = json.load(input_file)
+        if data.get('version') != FILE_VERSION:
+            logger.warning('ignoring user dictionary %s, unsupported version %s', self.filename, data.get('version'))
+            return
+        persisted = [(dictionary.DictionaryEntry(*record['entry']), record['priority'], True) for record in data['entries']]
+        # persisted entries come before the ones added in this process
+        self.entries = persisted + self.entries
+        logger.debug('loaded %d user dictionary entries from %s', len(persisted), self.filename)
+
+    def save(self):
+        records = [{'entry': list(entry), 'priority': priority} for entry, priority, persistent in self.entries if persistent]
+        if len(records) == 0:
+            if os.path.isfile(self.filename):
+                os.unlink(self.filename)
+            return
+        # the cache directory doesn't exist yet when the data is loaded from the package
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        content = json.dumps({'version': FILE_VERSION, 'entries': records}, ensure_ascii=False)
+        binary_cache.write_file(self.filename, content.encode('utf8'))
+
+    def add(self, entries, priority, persistent):
+        # the file is read first, saving rewrites it. nothing is added when the entries can't be saved
+        self.load()
+        previous_count = len(self.entries)
+        self.entries.extend((entry, priority, persistent) for entry in entries)
+        if persistent:
+            try:
+                self.save()
+            except OSError:
+                del self.entries[previous_count:]
+                raise
+
+    def clear(self):
+        # removes all the entries, the persisted ones too
+        self.entries = []
+        self.loaded = True
+        self.save()
+
+    def get_words(self):
+        # the multi-character words of the entries, to teach them to the segmenter
+        words = set()
+        for entry, priority, persistent in self.entries:
+            for chinese in [entry.traditional, entry.simplified]:
+                chinese = chinese.translate(dictionary.CHINESE_REMOVED_CHARACTERS)
+                if len(chinese) > 1:
+                    words.add(chinese)
+        return words
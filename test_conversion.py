@@ -1,6 +1,38 @@
 import logging
+import io
+import asyncio
+import threading
+import socket
+import os
+import tempfile
+import json
 import pinyin_jyutping_sentence
+import pinyin_jyutping_sentence.binary_cache
+import pinyin_jyutping_sentence.caching
+import pinyin_jyutping_sentence.compact
+import pinyin_jyutping_sentence.server
+import pinyin_jyutping_sentence.user_dictionary
+import subprocess
+import sys
 import unittest
+import unittest.mock
+
+
+def make_conversion(lines, segmenter='jieba', user_dictionary_filename=None):
+    # RomanizationConversion over the maps of a few dictionary lines, marked as loaded so that the dictionary
+    # files and the cache files are never read. user_dictionary_filename replaces the user dictionary of the
+    # cache directory
+    rc = pinyin_jyutping_sentence.RomanizationConversion(segmenter=segmenter)
+    if user_dictionary_filename is not None:
+        rc.user_dictionary = pinyin_jyutping_sentence.user_dictionary.UserDictionary(user_dictionary_filename)
+    data = rc.conversion_data
+    for line in lines:
+        rc.process_line(line + '\n', data.jyutping_word_map, data.pinyin_word_map, data.jyutping_char_map, data.pinyin_char_map)
+    data.compute_best_readings()
+    rc.pinyin_loaded = True
+    rc.jyutping_loaded = True
+    return rc
+
 
 class FileLoadTests(unittest.TestCase):
     def test_process_line_1(self):
@@ -119,6 +151,13 @@ class FileLoadTests(unittest.TestCase):
         expected_result = 'nei5'
         actual_result = rc.decode_jyutping(source, True, False)
         self.assertEqual(actual_result, expected_result)  
+
+    def test_decode_jyutping_remove_tones(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        source = 'nei5'
+        expected_result = 'nei'
+        actual_result = rc.decode_jyutping(source, False, True)
+        self.assertEqual(actual_result, expected_result)
         
 class EndToEndTests(unittest.TestCase):
 
@@ -271,3 +310,1070 @@ class EndToEndTests(unittest.TestCase):
         for source, expected_result in expected_map.items():
             actual_result = self.rc.process_sentence_pinyin(source, tone_numbers=True)
             self.assertEqual(expected_result, actual_result)
+
+
+    def test_process_sentences(self):
+        sentences = ['忘拿一些东西了', '有啲好貴', '我很好', '好', '', '请问，你叫什么名字？', '我很好']
+        actual_result = list(self.rc.process_sentences_pinyin(iter(sentences), tone_numbers=True))
+        expected_result = [self.rc.process_sentence_pinyin(sentence, tone_numbers=True) for sentence in sentences]
+        self.assertEqual(expected_result, actual_result)
+
+        actual_result = list(pinyin_jyutping_sentence.jyutping_many(sentences, spaces=True))
+        expected_result = [self.rc.process_sentence_jyutping(sentence, spaces=True) for sentence in sentences]
+        self.assertEqual(expected_result, actual_result)
+
+    def test_process_sentences_parallel(self):
+        sentences = ['忘拿一些东西了', '有啲好貴', '我很好', '好', '', '请问，你叫什么名字？'] * 50
+        expected_result = [self.rc.process_sentence_pinyin(sentence) for sentence in sentences]
+        actual_result = list(self.rc.process_sentences_pinyin(sentences, workers=2))
+        self.assertEqual(expected_result, actual_result)
+
+        expected_result = [self.rc.process_sentence_jyutping(sentence) for sentence in sentences]
+        with pinyin_jyutping_sentence.ParallelConverter(self.rc, workers=3, chunk_size=7) as converter:
+            actual_result = list(converter.process_sentences_jyutping(iter(sentences)))
+        self.assertEqual(expected_result, actual_result)
+
+class LazyLoadingTests(unittest.TestCase):
+
+    def test_nothing_loaded_before_first_use(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion()
+        self.assertFalse(rc.pinyin_loaded)
+        self.assertFalse(rc.jyutping_loaded)
+        self.assertEqual({}, rc.conversion_data.pinyin_word_map)
+
+    def test_warm_up_pinyin(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion()
+        rc.warm_up(pinyin=True, jyutping=False)
+        self.assertTrue(rc.pinyin_loaded)
+        self.assertEqual('wo3 hen3 hao3', rc.process_sentence_pinyin('我很好', tone_numbers=True))
+        # loading again is a no-op, counts don't get incremented twice
+        pinyin_char_map = rc.conversion_data.pinyin_char_map
+        count = pinyin_char_map['好']['hao3']
+        rc.load_files()
+        self.assertEqual(count, pinyin_char_map['好']['hao3'])
+        self.assertTrue(rc.jyutping_loaded)
+
+
+class BinaryCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, 'data.bin')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def build_data(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        data = pinyin_jyutping_sentence.ConversionData()
+        rc.process_line("一團 一团 [yi1 tuan2] {jat1 tyun4} /a group /", data.jyutping_word_map, data.pinyin_word_map, data.jyutping_char_map, data.pinyin_char_map)
+        rc.process_line("一個 一个 [yi1 ge5] {jat1 go3} /a; one/", data.jyutping_word_map, data.pinyin_word_map, data.jyutping_char_map, data.pinyin_char_map)
+        data.pinyin_char_map['一']['yi2'] = 1
+        data.compute_best_readings()
+        return data
+
+    def test_serialize_deserialize_binary(self):
+        data = self.build_data()
+        data.serialize_binary(self.filename)
+
+        loaded_data = pinyin_jyutping_sentence.ConversionData()
+        loaded_data.deserialize_binary(self.filename)
+        for name in pinyin_jyutping_sentence.ConversionData.MAP_NAMES:
+            self.assertEqual(getattr(data, name), dict(getattr(loaded_data, name)))
+
+        self.assertEqual(['yi1', 'tuan2'], loaded_data.pinyin_word_map['一团'])
+        self.assertEqual({'yi1': 4, 'yi2': 1}, loaded_data.pinyin_char_map['一'])
+        # insertion order of the readings is kept
+        self.assertEqual(['yi1', 'yi2'], list(loaded_data.pinyin_char_map['一'].keys()))
+        self.assertIn('一個', loaded_data.jyutping_word_map)
+        self.assertNotIn('二', loaded_data.jyutping_char_map)
+        self.assertIsNone(loaded_data.pinyin_char_map.get('二'))
+        with self.assertRaises(KeyError):
+            loaded_data.pinyin_word_map['二']
+        self.assertEqual(4, len(loaded_data.pinyin_word_map))
+        self.assertEqual('yi1', loaded_data.pinyin_best_reading_map['一'])
+        # read from the file rather than recomputed
+        for name in pinyin_jyutping_sentence.ConversionData.BEST_READING_MAP_NAMES:
+            self.assertIsInstance(getattr(loaded_data, name), pinyin_jyutping_sentence.binary_cache.MappedTable)
+
+    def test_concurrent_writes(self):
+        # every writer has its own temporary file, the result is one of the contents, whole
+        contents = [bytes([i]) * 1000000 for i in range(4)]
+        threads = [threading.Thread(target=pinyin_jyutping_sentence.binary_cache.write_file, args=(self.filename, content)) for content in contents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(self.filename, 'rb') as input_file:
+            self.assertIn(input_file.read(), contents)
+        self.assertEqual(['data.bin'], os.listdir(self.temp_dir.name))
+
+    def test_invalid_file(self):
+        with open(self.filename, 'wb') as outfile:
+            outfile.write(b'{"pinyin_word_map": {}}')
+        data = pinyin_jyutping_sentence.ConversionData()
+        with self.assertRaises(pinyin_jyutping_sentence.binary_cache.BinaryCacheError):
+            data.deserialize_binary(self.filename)
+
+
+class HashIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_build_hash_index(self):
+        binary_cache = pinyin_jyutping_sentence.binary_cache
+        keys = [f'詞{i}'.encode('utf-8') for i in range(1000)]
+        displacements, slots = binary_cache.build_hash_index(keys)
+        # every key has its own slot
+        self.assertEqual(list(range(len(keys))), sorted(slots))
+        for index, key in enumerate(keys):
+            self.assertEqual(index, slots[binary_cache.get_hash_slot(*binary_cache.get_key_hashes(key), len(displacements), displacements, len(keys))])
+
+    def test_lookups(self):
+        binary_cache = pinyin_jyutping_sentence.binary_cache
+        word_map = {f'詞{i}': [f'ci{i % 4}', 'yu3'] for i in range(1000)}
+        tables = [('word_map', binary_cache.VALUE_LIST, word_map), ('empty', binary_cache.VALUE_STRING, {})]
+        caches = []
+        for hash_index in [True, False]:
+            filename = os.path.join(self.temp_dir.name, f'{hash_index}.bin')
+            binary_cache.write_binary_cache(filename, tables, hash_index)
+            caches.append(binary_cache.BinaryCache(filename, verify=True))
+        hashed_table, sorted_table = [cache['word_map'] for cache in caches]
+        self.assertIsNotNone(hashed_table.slots)
+        self.assertIsNone(sorted_table.slots)
+        for word in list(word_map.keys()) + ['詞', '詞1000', '', 'x']:
+            self.assertEqual(word_map.get(word), hashed_table.get(word))
+            self.assertEqual(word in word_map, word in hashed_table)
+            self.assertEqual(sorted_table.get(word), hashed_table.get(word))
+        self.assertEqual(list(sorted_table), list(hashed_table))
+        self.assertNotIn('詞1', caches[0]['empty'])
+        for cache in caches:
+            cache.close()
+
+
+class BestReadingTests(unittest.TestCase):
+
+    def test_compute_best_readings(self):
+        data = pinyin_jyutping_sentence.ConversionData()
+        data.pinyin_char_map = {
+            '了': {'liao3': 1, 'le5': 3},
+            '行': {'xing2': 2, 'hang2': 2},
+        }
+        data.compute_best_readings(pinyin=True, jyutping=False)
+        # on a tie, the first reading wins, like the sorted list used to
+        self.assertEqual({'了': 'le5', '行': 'xing2'}, data.pinyin_best_reading_map)
+
+    def test_get_romanization_best_reading_map(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        char_map = {'了': {'liao3': 1, 'le5': 3}}
+        best_reading_map = {'了': 'le5'}
+        self.assertEqual('le5x', rc.get_romanization('了x', {}, char_map, rc.decode_pinyin, True, False, False, best_reading_map))
+        self.assertEqual('le5x', rc.get_romanization('了x', {}, char_map, rc.decode_pinyin, True, False, False))
+
+    def test_character_readings(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        char_map = {'了': {'liao3': 1, 'le5': 3}}
+        self.assertEqual([('le5', 3), ('liao3', 1)], rc.get_character_readings('了', char_map))
+        self.assertEqual([], rc.get_character_readings('x', char_map))
+
+
+class DecodeCacheTests(unittest.TestCase):
+
+    def test_decode_cached(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion()
+        for syllable in ['ni3', 'lu:4', 'nu:3', 'Zhong1', 'r5', 'xx']:
+            for tone_numbers, remove_tones in [(False, False), (True, False), (True, True)]:
+                self.assertEqual(rc.decode_pinyin(syllable, tone_numbers, remove_tones), rc.decode_pinyin_cached(syllable, tone_numbers, remove_tones))
+        for syllable in ['nei5', 'jat1', 'm4', 'ng5']:
+            for tone_numbers in [False, True]:
+                self.assertEqual(rc.decode_jyutping(syllable, tone_numbers, False), rc.decode_jyutping_cached(syllable, tone_numbers, False))
+        rc.decode_pinyin_cached('ni3', False, False)
+        self.assertEqual(1, rc.decode_pinyin_cached.cache_info().hits)
+
+
+class ToneRendererTests(unittest.TestCase):
+
+    def test_render_styles(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion()
+        self.assertEqual(['nǐ', 'hǎo'], rc.render_tones(['ni3', 'hao3']))
+        self.assertEqual(['nei', 'hou'], rc.render_tones(['nei5', 'hou2'], mode='jyutping', style='no_tones'))
+        self.assertEqual(['nei⁵', 'hou²'], rc.render_tones(['nei5', 'hou2'], mode='jyutping', style='superscript'))
+        self.assertEqual({'diacritics': ['nǚ', 'ér'], 'tone_numbers': ['nu:3', 'er2'], 'superscript': ['nu:³', 'er²']},
+            rc.render_tones(['nu:3', 'er2'], style=['diacritics', 'tone_numbers', 'superscript']))
+        with self.assertRaises(ValueError):
+            rc.render_tones(['ni3'], style='numbers')
+
+    def test_same_as_decoders(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion()
+        for mode, decode_function, syllables in [
+                ('pinyin', rc.decode_pinyin, ['ni3', 'lu:4', 'Zhong1', 'r5', 'xx', 'ni3']),
+                ('jyutping', rc.decode_jyutping, ['nei5', 'jat1', 'm4', 'ng5', 'xx'])]:
+            for tone_numbers, remove_tones in [(False, False), (True, False), (False, True), (True, True)]:
+                style = pinyin_jyutping_sentence.tones.get_style(tone_numbers, remove_tones)
+                expected_result = [decode_function(syllable, tone_numbers, remove_tones) for syllable in syllables]
+                self.assertEqual(expected_result, rc.render_tones(syllables, mode=mode, style=style))
+
+    def test_table_size(self):
+        renderer = pinyin_jyutping_sentence.tones.ToneRenderer(pinyin_jyutping_sentence.romanization_conversion.decode_pinyin, 3)
+        self.assertEqual(['nǐ', 'hǎo', 'nǐ'], renderer.render(['ni3', 'hao3', 'ni3'], 'diacritics'))
+        self.assertEqual(2, renderer.get_table_size())
+        # the table is emptied rather than growing past its maximum size
+        self.assertEqual(['wǒ', 'men'], renderer.render(['wo3', 'men5'], 'diacritics'))
+        self.assertEqual(2, renderer.get_table_size())
+
+
+class BuildTests(unittest.TestCase):
+
+    LINES = [
+        "一團 一团 [yi1 tuan2] {jat1 tyun4} /a group /\n",
+        "一個 一个 [yi1 ge5] {jat1 go3} /a; one/\n",
+        "行 行 [hang2] {hong4} /row/\n",
+        "行 行 [xing2] {hang4} /to walk/\n",
+        "行 行 [xing2] {hang4} /to walk/\n",
+    ]
+
+    def get_entries(self, lines):
+        return list(pinyin_jyutping_sentence.dictionary.DictionaryParser('cccanto').parse_lines(lines))
+
+    def test_build_maps(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        jyutping_word_map = {}
+        pinyin_word_map = {}
+        jyutping_char_map = {}
+        pinyin_char_map = {}
+        for line in self.LINES:
+            rc.process_line(line, jyutping_word_map, pinyin_word_map, jyutping_char_map, pinyin_char_map)
+        self.assertEqual((pinyin_word_map, pinyin_char_map), rc.build_maps('pinyin', self.get_entries(self.LINES)))
+        self.assertEqual((jyutping_word_map, jyutping_char_map), rc.build_maps('jyutping', self.get_entries(self.LINES)))
+
+    def test_merge_chunks(self):
+        # merging the maps of consecutive chunks gives the same result as processing all the lines at once
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        expected_word_map, expected_char_map = rc.build_maps('pinyin', self.get_entries(self.LINES))
+        word_map = {}
+        char_map = {}
+        for lines in [self.LINES[:3], self.LINES[3:]]:
+            chunk_word_map, chunk_char_map = rc.build_maps('pinyin', self.get_entries(lines))
+            rc.merge_word_map(word_map, chunk_word_map)
+            rc.merge_char_map(char_map, chunk_char_map)
+        self.assertEqual(expected_word_map, word_map)
+        self.assertEqual(expected_char_map, char_map)
+        # traditional and simplified are both counted
+        self.assertEqual({'hang2': 2, 'xing2': 4}, char_map['行'])
+        # order of the readings is kept, it decides ties
+        self.assertEqual(['hang2', 'xing2'], list(char_map['行'].keys()))
+
+
+class SentenceCacheTests(unittest.TestCase):
+
+    def test_lru_cache(self):
+        cache = pinyin_jyutping_sentence.caching.LRUCache(max_entries=2)
+        cache.put('a', '1')
+        cache.put('b', '2')
+        self.assertEqual('1', cache.get('a'))
+        cache.put('c', '3')
+        # b was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual('3', cache.get('c'))
+        stats = cache.stats()
+        self.assertEqual(2, stats['entries'])
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['evictions'])
+
+    def test_lru_cache_max_bytes(self):
+        cache = pinyin_jyutping_sentence.caching.LRUCache(max_bytes=1000)
+        for i in range(100):
+            cache.put(str(i), 'x' * 100)
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+        self.assertGreater(cache.stats()['evictions'], 0)
+        self.assertEqual('x' * 100, cache.get('99'))
+
+    def test_sentence_cache(self):
+        rc = make_conversion(["好 好 [hao3] {hou2} /good/"])
+        self.assertIsNone(rc.sentence_cache_stats())
+        rc.enable_sentence_cache(max_entries=100)
+        self.assertEqual('hao3', rc.process_sentence_pinyin('好', tone_numbers=True))
+        self.assertEqual('hao3', rc.process_sentence_pinyin('好', tone_numbers=True))
+        self.assertEqual('hǎo', rc.process_sentence_pinyin('好'))
+        stats = rc.sentence_cache_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+
+        # modifying the data invalidates the cache
+        rc.conversion_data.pinyin_char_map['好'] = {'hao4': 1}
+        rc.conversion_data.compute_best_readings()
+        rc.conversion_data.mark_modified()
+        self.assertEqual('hao4', rc.process_sentence_pinyin('好', tone_numbers=True))
+
+
+class SegmentationCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.rc = make_conversion(["好人 好人 [hao3 ren2] {hou2 jan4} /good person/",
+                                   "人 人 [ren2] {jan4} /person/",
+                                   "天 天 [tian1] {tin1} /day/"], 'trie', os.path.join(self.temp_dir.name, 'user_data.json'))
+
+    def test_shared_between_conversions(self):
+        self.assertIsNone(self.rc.segmentation_cache_stats())
+        self.rc.enable_segmentation_cache(max_entries=100)
+        self.assertEqual('hǎorén tiān', self.rc.process_sentence_pinyin('好人天'))
+        self.assertEqual('hou2jan4 tin1', self.rc.process_sentence_jyutping('好人天', tone_numbers=True))
+        self.assertEqual({'pinyin': 'hǎorén tiān'}, self.rc.convert('好人天', outputs=['pinyin']))
+        stats = self.rc.stats()['segmentation_cache']
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+        self.rc.disable_segmentation_cache()
+        self.assertIsNone(self.rc.segmentation_cache_stats())
+
+    def test_invalidation(self):
+        self.rc.enable_segmentation_cache(max_entries=100)
+        self.assertEqual(['人', '天'], self.rc.segment('人天'))
+        self.assertEqual(['好', '好'], self.rc.segment('好好'))
+        # only the sentences with a character of the new word are segmented again
+        self.rc.add_entries(['人天 人天 [ren2 tian1] {jan4 tin1} /test/'])
+        self.assertEqual(['好', '好'], self.rc.segment('好好'))
+        self.assertEqual(1, self.rc.segmentation_cache_stats()['hits'])
+        self.assertEqual(['人天'], self.rc.segment('人天'))
+        self.assertEqual(3, self.rc.segmentation_cache_stats()['misses'])
+        # another segmenter empties the cache
+        self.rc.set_segmenter('jieba')
+        self.rc.segment('好人')
+        self.assertEqual(1, self.rc.segmentation_cache_stats()['entries'])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+
+class TrieSegmenterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["一個 一个 [yi1 ge5] {jat1 go3} /a; one/",
+                                   "個人 个人 [ge4 ren2] {go3 jan4} /individual/",
+                                   "人 人 [ren2] {jan4} /person/",
+                                   "好 好 [hao3] {hou2} /good/",
+                                   "好人 好人 [hao3 ren2] {hou2 jan4} /good person/"], 'trie')
+
+    def test_segment(self):
+        segmenter = self.rc.segmenter
+        self.assertEqual(['一个', '好人'], segmenter.segment('一个好人'))
+        # latin text and digits are kept together, whitespace is kept as is
+        self.assertEqual(['OK', ' ', '2020', '好人', '，', '一個'], segmenter.segment('OK 2020好人，一個'))
+        self.assertEqual([], segmenter.segment(''))
+
+    def test_process_sentence(self):
+        self.assertEqual('yīge hǎorén', self.rc.process_sentence_pinyin('一个好人'))
+        self.assertEqual('jat1 go3 hou2 jan4', self.rc.process_sentence_jyutping('一個好人', tone_numbers=True, spaces=True))
+
+    def test_index_follows_data_changes(self):
+        data = self.rc.conversion_data
+        self.assertEqual(['好', '个', '个'], self.rc.segmenter.segment('好个个'))
+        data.pinyin_word_map['个个'] = ['ge4', 'ge4']
+        data.mark_modified()
+        self.assertEqual(['好', '个个'], self.rc.segmenter.segment('好个个'))
+
+    def test_unknown_segmenter(self):
+        with self.assertRaises(ValueError):
+            pinyin_jyutping_sentence.RomanizationConversion(segmenter='unknown')
+
+
+class StreamingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["我 我 [wo3] {ngo5} /I/",
+                                   "很 很 [hen3] {han2} /very/",
+                                   "好 好 [hao3] {hou2} /good/",
+                                   "你 你 [ni3] {nei5} /you/"])
+
+    def test_split_pieces(self):
+        stats = pinyin_jyutping_sentence.StreamStats()
+        text = '我很好。你好！\r\n\n你好'
+        pieces = list(pinyin_jyutping_sentence.streaming.split_pieces(io.BytesIO(text.encode('utf-8')), stats, read_size=4))
+        self.assertEqual([('我很好。', None), ('你好！', None), ('', '\r\n'), ('', '\n'), ('你好', '')], pieces)
+        self.assertEqual(3, stats.lines)
+        self.assertEqual(len(text.encode('utf-8')), stats.bytes)
+
+        # no boundary at all: cut at the maximum length
+        pieces = list(pinyin_jyutping_sentence.streaming.split_pieces(io.StringIO('我' * 10), stats, read_size=3, max_piece_length=4))
+        self.assertEqual('我' * 10, ''.join(text for text, line_ending in pieces))
+        self.assertTrue(all(len(text) <= 4 for text, line_ending in pieces))
+
+    def test_convert_stream(self):
+        lines = ['我很好。你好！', '', '你好 OK？好', '好']
+        expected_result = '\n'.join(self.rc.process_sentence_pinyin(line, tone_numbers=True) for line in lines)
+        out_fh = io.StringIO()
+        stats = self.rc.convert_stream(io.StringIO('\n'.join(lines)), out_fh, mode='pinyin', tone_numbers=True)
+        self.assertEqual(expected_result, out_fh.getvalue())
+        self.assertEqual(4, stats.lines)
+        self.assertEqual(len('\n'.join(lines).encode('utf-8')), stats.as_dict()['bytes'])
+
+        # binary file handles, generator variant
+        expected_result = '\n'.join(self.rc.process_sentence_jyutping(line) for line in lines) + '\n'
+        in_fh = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+        self.assertEqual(expected_result, ''.join(self.rc.iter_convert_stream(in_fh, mode='jyutping')))
+
+        with self.assertRaises(ValueError):
+            list(self.rc.iter_convert_stream(io.StringIO('好'), mode='unknown'))
+
+
+class AsyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["我 我 [wo3] {ngo5} /I/",
+                                   "很 很 [hen3] {han2} /very/",
+                                   "好 好 [hao3] {hou2} /good/",
+                                   "你 你 [ni3] {nei5} /you/"])
+        self.sentences = ['我很好', '你好', '', '好 OK', '你'] * 30
+
+    def convert_all(self, converter):
+        async def convert():
+            single_results = await asyncio.gather(*[converter.pinyin(sentence, tone_numbers=True) for sentence in self.sentences])
+            batch_results = [result async for result in converter.jyutping_many(iter(self.sentences))]
+            return single_results, batch_results
+        return asyncio.run(convert())
+
+    def test_thread_executor(self):
+        converter = pinyin_jyutping_sentence.AsyncConverter(self.rc, max_concurrency=2, chunk_size=7)
+        single_results, batch_results = self.convert_all(converter)
+        self.assertEqual([self.rc.process_sentence_pinyin(sentence, tone_numbers=True) for sentence in self.sentences], single_results)
+        self.assertEqual([self.rc.process_sentence_jyutping(sentence) for sentence in self.sentences], batch_results)
+        # a new event loop can use the same converter
+        single_results, batch_results = self.convert_all(converter)
+        self.assertEqual(len(self.sentences), len(batch_results))
+        converter.close()
+
+    def test_process_executor(self):
+        converter = pinyin_jyutping_sentence.AsyncConverter(self.rc, executor='process', max_concurrency=2, chunk_size=7)
+        single_results, batch_results = self.convert_all(converter)
+        converter.close()
+        self.assertEqual([self.rc.process_sentence_pinyin(sentence, tone_numbers=True) for sentence in self.sentences], single_results)
+        self.assertEqual([self.rc.process_sentence_jyutping(sentence) for sentence in self.sentences], batch_results)
+
+    def test_slow_first_chunk(self):
+        converter = pinyin_jyutping_sentence.AsyncConverter(self.rc, max_concurrency=2, chunk_size=1)
+        release = threading.Event()
+        get_chunk_function = converter.get_chunk_function
+        def get_slow_chunk_function(mode, sentences, *options):
+            function = get_chunk_function(mode, sentences, *options)
+            if sentences == ['slow']:
+                return lambda: release.wait(10) and function()
+            return function
+        converter.get_chunk_function = get_slow_chunk_function
+        read_count = 0
+        def read_sentences():
+            nonlocal read_count
+            for sentence in ['slow'] + self.sentences:
+                read_count += 1
+                yield sentence
+        async def convert():
+            results = converter.pinyin_many(read_sentences())
+            first_result = asyncio.ensure_future(results.__anext__())
+            await asyncio.sleep(0.2)
+            # the reading stops while the first chunk is converting
+            self.assertFalse(first_result.done())
+            self.assertLessEqual(read_count, 3)
+            release.set()
+            return [await first_result] + [result async for result in results]
+        results = asyncio.run(convert())
+        converter.close()
+        self.assertEqual([self.rc.process_sentence_pinyin(sentence) for sentence in ['slow'] + self.sentences], results)
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            pinyin_jyutping_sentence.AsyncConverter(self.rc, executor='unknown')
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["我 我 [wo3] {ngo5} /I/",
+                                   "很 很 [hen3] {han2} /very/",
+                                   "好 好 [hao3] {hou2} /good/"])
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def start_server(self, **kwargs):
+        server = pinyin_jyutping_sentence.server.create_server(self.rc, **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def check_client(self, client):
+        sentences = ['我很好', '', '好 OK']
+        self.assertEqual(self.rc.process_sentence_pinyin('我很好', tone_numbers=True), client.pinyin('我很好', tone_numbers=True))
+        self.assertEqual([self.rc.process_sentence_jyutping(sentence) for sentence in sentences], client.jyutping_many(sentences))
+        with self.assertRaises(ValueError):
+            client.convert('unknown', '好', None, False, False, False)
+        stats = client.stats()
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(4, stats['sentences'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertIsNotNone(stats['latency_p99_ms'])
+
+    def test_unix_socket(self):
+        socket_path = os.path.join(self.temp_dir.name, 'server.sock')
+        self.start_server(socket_path=socket_path)
+        self.assertEqual(0o600, os.stat(socket_path).st_mode & 0o777)
+        with pinyin_jyutping_sentence.server.Client(socket_path=socket_path, fallback=False) as client:
+            self.check_client(client)
+        # a live server keeps its socket
+        with self.assertRaises(OSError):
+            pinyin_jyutping_sentence.server.create_server(self.rc, socket_path=socket_path)
+        self.assertEqual('wǒ', pinyin_jyutping_sentence.server.Client(socket_path=socket_path, fallback=False).pinyin('我'))
+
+    def test_default_socket_path(self):
+        get_default_socket_path = pinyin_jyutping_sentence.server.get_default_socket_path
+        previous_runtime_dir = os.environ.pop('XDG_RUNTIME_DIR', None)
+        try:
+            self.assertIn(str(os.getuid()), os.path.basename(get_default_socket_path()))
+            os.environ['XDG_RUNTIME_DIR'] = self.temp_dir.name
+            self.assertEqual(self.temp_dir.name, os.path.dirname(get_default_socket_path()))
+        finally:
+            os.environ.pop('XDG_RUNTIME_DIR', None)
+            if previous_runtime_dir is not None:
+                os.environ['XDG_RUNTIME_DIR'] = previous_runtime_dir
+
+    def test_stale_socket(self):
+        socket_path = os.path.join(self.temp_dir.name, 'server.sock')
+        stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale_socket.bind(socket_path)
+        stale_socket.close()
+        self.start_server(socket_path=socket_path)
+        with pinyin_jyutping_sentence.server.Client(socket_path=socket_path, fallback=False) as client:
+            self.assertEqual('wǒ', client.pinyin('我'))
+
+    def test_http(self):
+        server = self.start_server(port=0)
+        with pinyin_jyutping_sentence.server.Client(port=server.server_address[1], fallback=False) as client:
+            self.check_client(client)
+
+    def test_fallback(self):
+        socket_path = os.path.join(self.temp_dir.name, 'missing.sock')
+        with self.assertRaises(OSError):
+            pinyin_jyutping_sentence.server.Client(socket_path=socket_path, fallback=False).pinyin('好')
+        client = pinyin_jyutping_sentence.server.Client(socket_path=socket_path)
+        self.assertEqual(pinyin_jyutping_sentence.pinyin('好'), client.pinyin('好'))
+
+
+class InstrumentationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["好人 好人 [hao3 ren2] {hou2 jan4} /good person/",
+                                   "我 我 [wo3] {ngo5} /I/",
+                                   "是 是 [shi4] {si6} /to be/"], 'trie')
+
+    def test_counters(self):
+        expected_result = self.rc.process_sentence_pinyin('我是好人，OK')
+        sentence_measurements = []
+        self.rc.enable_instrumentation(callback=sentence_measurements.append)
+        self.assertEqual(expected_result, self.rc.process_sentence_pinyin('我是好人，OK'))
+        self.assertEqual([expected_result], list(self.rc.process_sentences_pinyin(['我是好人，OK'])))
+
+        self.assertEqual(2, len(sentence_measurements))
+        measurements = sentence_measurements[0]
+        self.assertEqual('我是好人，OK', measurements['sentence'])
+        self.assertEqual(expected_result, measurements['result'])
+        # 我 / 是 / 好人 / ， / OK
+        self.assertEqual(5, measurements['words'])
+        self.assertEqual(1, measurements['word_map_hits'])
+        self.assertEqual(1, measurements['char_fallback_words'])
+        self.assertEqual(2, measurements['char_readings'])
+        self.assertEqual(3, measurements['unknown_characters'])
+        self.assertEqual(4, measurements['decode_calls'])
+        self.assertGreater(measurements['segment_time'], 0)
+
+        stats = self.rc.stats()
+        self.assertEqual(2, stats['sentences'])
+        self.assertEqual(10, stats['words'])
+        self.assertEqual(2, stats['word_map_hits'])
+        self.assertIn('hits', stats['decode_cache']['pinyin'])
+        self.assertIsNone(stats['sentence_cache'])
+
+        self.rc.disable_instrumentation()
+        self.rc.process_sentence_pinyin('我是好人')
+        self.assertEqual(2, len(sentence_measurements))
+        self.assertNotIn('sentences', self.rc.stats())
+
+
+class CompactWordMapTests(unittest.TestCase):
+
+    def test_compact_word_map(self):
+        syllable_table = pinyin_jyutping_sentence.compact.SyllableTable()
+        items = {'個人': ['ge4', 'ren2'], '个人': ['ge4', 'ren2'], '人': ['ren2'], '空': []}
+        word_map = pinyin_jyutping_sentence.compact.CompactWordMap(syllable_table, items)
+        self.assertEqual(items, dict(word_map))
+        self.assertEqual(['ge4', 'ren2'], word_map['个人'])
+        self.assertIn('個人', word_map)
+        self.assertNotIn('个', word_map)
+        # traditional and simplified share their sequence, syllables are stored once
+        self.assertEqual(3, word_map.get_sequence_count())
+        self.assertEqual(2, len(syllable_table))
+
+        word_map['人人'] = ['ren2', 'ren2']
+        word_map['人'] = ['ren2']
+        del word_map['空']
+        self.assertEqual(['ren2', 'ren2'], word_map['人人'])
+        self.assertEqual(4, len(word_map))
+        self.assertEqual(4, word_map.get_sequence_count())
+
+    def test_conversion_data(self):
+        data = pinyin_jyutping_sentence.ConversionData()
+        data.pinyin_word_map = {'個人': ['ge4', 'ren2'], '个人': ['ge4', 'ren2']}
+        data.jyutping_word_map = {'個人': ['go3', 'jan4']}
+        data.compact_word_maps()
+        self.assertIsInstance(data.pinyin_word_map, pinyin_jyutping_sentence.compact.CompactWordMap)
+        self.assertIs(data.syllable_table, data.jyutping_word_map.syllable_table)
+        report = data.memory_report()
+        self.assertEqual(2, report['pinyin_word_map']['entries'])
+        self.assertEqual(1, report['pinyin_word_map']['sequences'])
+        self.assertEqual(4, report['syllable_table']['entries'])
+        self.assertGreater(report['total_bytes'], 0)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'data.json')
+            data.serialize(filename)
+            other_data = pinyin_jyutping_sentence.ConversionData()
+            other_data.deserialize(filename)
+        self.assertIsInstance(other_data.pinyin_word_map, pinyin_jyutping_sentence.compact.CompactWordMap)
+        self.assertEqual(dict(data.pinyin_word_map), dict(other_data.pinyin_word_map))
+
+
+class DictionaryParserTests(unittest.TestCase):
+
+    def test_parse_lines(self):
+        parser = pinyin_jyutping_sentence.dictionary.DictionaryParser('cccanto')
+        lines = [
+            "# comment\n",
+            "一團 一团 [yi1 tuan2] {jat1 tyun4} /a group /\n",
+            "and add boilerplate:\n",
+            "\n",
+            "not a dictionary line\n",
+            "行 行 [xing2] {hang4} /to walk/\n",
+        ]
+        entries = list(parser.parse_lines(lines))
+        self.assertEqual([pinyin_jyutping_sentence.dictionary.DictionaryEntry('一團', '一团', 'yi1 tuan2', 'jat1 tyun4', '/a group /'),
+                          pinyin_jyutping_sentence.dictionary.DictionaryEntry('行', '行', 'xing2', 'hang4', '/to walk/')], entries)
+        self.assertEqual({'entries': 2, 'malformed': 1, 'malformed_examples': ['not a dictionary line']}, parser.report())
+
+        parser = pinyin_jyutping_sentence.dictionary.DictionaryParser('cedict')
+        entry, = parser.parse_lines(["上蒼 上苍 [shang4 cang1] /heaven/the gods/\n"])
+        self.assertEqual(('上蒼', '上苍', 'shang4 cang1', None, '/heaven/the gods/'), entry)
+
+    def test_malformed_line(self):
+        rc = pinyin_jyutping_sentence.romanization_conversion
+        pinyin_word_map = {}
+        pinyin_char_map = {}
+        rc.process_cedict_line("not a dictionary line\n", pinyin_word_map, pinyin_char_map)
+        self.assertEqual({}, pinyin_word_map)
+        self.assertEqual({}, pinyin_char_map)
+
+
+class UserDictionaryTests(unittest.TestCase):
+
+    LINES = ["一個 一个 [yi1 ge5] {jat1 go3} /a; one/",
+             "人 人 [ren2] {jan4} /person/",
+             "好 好 [hao3] {hou2} /good/",
+             "好 好 [hao4] {hou3} /to like/",
+             "好人 好人 [hao3 ren2] {hou2 jan4} /good person/"]
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, 'user_data.json')
+        self.rc = self.get_conversion()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_conversion(self):
+        return make_conversion(self.LINES, 'trie', self.filename)
+
+    def test_override_word(self):
+        rc = self.rc
+        self.assertEqual('hao3 ren2', rc.process_sentence_pinyin('好人', tone_numbers=True, spaces=True))
+        self.assertEqual(1, rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /someone who likes people/"]))
+        self.assertEqual('hao4 ren2', rc.process_sentence_pinyin('好人', tone_numbers=True, spaces=True))
+        self.assertEqual('hou3 jan4', rc.process_sentence_jyutping('好人', tone_numbers=True, spaces=True))
+        # the readings of the characters are counted, a multi-character entry doesn't change the best reading
+        self.assertEqual([('hao3', 4), ('hao4', 4)], rc.character_readings_pinyin('好'))
+        self.assertEqual('hao3', rc.process_sentence_pinyin('好', tone_numbers=True))
+
+    def test_new_word_segmentation(self):
+        rc = self.rc
+        rc.segmenter.initialize()
+        data = rc.conversion_data
+        self.assertEqual(['一个', '人', '人'], rc.segmenter.segment('一个人人'))
+        rc.add_entries([pinyin_jyutping_sentence.dictionary.DictionaryEntry('人人', '人人', 'ren2 ren2', 'jan4 jan4', '/everybody/')])
+        # the trie index was extended in place rather than rebuilt
+        self.assertEqual((id(data), data.generation), rc.segmenter.data_version)
+        self.assertEqual(['一个', '人人'], rc.segmenter.segment('一个人人'))
+        self.assertEqual('yīge rénrén', rc.process_sentence_pinyin('一个人人'))
+
+    def test_override_character(self):
+        rc = self.rc
+        rc.add_entries(["好 好 [hao4] {hou3} /to like/"])
+        self.assertEqual('hao4', rc.process_sentence_pinyin('好', tone_numbers=True))
+        self.assertEqual('hou3', rc.process_sentence_jyutping('好', tone_numbers=True))
+        self.assertEqual([('hao4', 5), ('hao3', 4)], rc.character_readings_pinyin('好'))
+        # the counts agree with the best readings
+        data = rc.conversion_data
+        self.assertEqual('hao4', data.get_best_reading(data.pinyin_char_map['好']))
+
+    def test_fallback(self):
+        rc = self.rc
+        rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /x/", "好 好 [hao4] {hou3} /to like/", "貓 猫 [mao1] {maau1} /cat/"], priority='fallback')
+        # known words and characters are left alone
+        self.assertEqual('hao3 ren2', rc.process_sentence_pinyin('好人', tone_numbers=True, spaces=True))
+        self.assertEqual('hao3', rc.process_sentence_pinyin('好', tone_numbers=True))
+        self.assertEqual('mao1', rc.process_sentence_pinyin('猫', tone_numbers=True))
+        self.assertEqual('maau1', rc.process_sentence_jyutping('貓', tone_numbers=True))
+        self.assertEqual(7, len(rc.conversion_data.pinyin_char_map))
+
+    def test_cedict_line(self):
+        rc = self.rc
+        rc.add_entries(["人人 人人 [ren2 ren2] /everybody/"])
+        self.assertEqual('ren2ren2', rc.process_sentence_pinyin('人人', tone_numbers=True))
+        # no jyutping in CC-CEDICT
+        self.assertNotIn('人人', rc.conversion_data.jyutping_word_map)
+
+    def test_invalid_entries(self):
+        with self.assertRaises(ValueError):
+            self.rc.add_entries(["not a dictionary line"])
+        with self.assertRaises(ValueError):
+            self.rc.add_entries(["好 好 [hao4] {hou3} /to like/"], priority='unknown')
+
+    def test_persist(self):
+        self.rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /x/"], persist=True)
+        self.rc.add_entries(["人 人 [ren4] {jan6} /x/"])
+        self.assertTrue(os.path.isfile(self.filename))
+
+        # applied again when the data is loaded, only the persisted entries
+        rc = self.get_conversion()
+        rc.apply_user_dictionary(['pinyin', 'jyutping'])
+        self.assertEqual('hou3 jan4', rc.process_sentence_jyutping('好人', tone_numbers=True, spaces=True))
+        self.assertEqual('ren2', rc.process_sentence_pinyin('人', tone_numbers=True))
+
+        rc.clear_user_entries()
+        self.assertFalse(os.path.isfile(self.filename))
+        self.assertEqual('hou2 jan4', rc.process_sentence_jyutping('好人', tone_numbers=True, spaces=True))
+
+    def test_persist_error(self):
+        # entries which can't be saved are neither recorded nor applied
+        not_a_directory = os.path.join(self.temp_dir.name, 'file')
+        open(not_a_directory, 'w').close()
+        rc = make_conversion(self.LINES, 'trie', os.path.join(not_a_directory, 'user_data.json'))
+        with self.assertRaises(OSError):
+            rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /x/"], persist=True)
+        self.assertEqual([], rc.user_dictionary.entries)
+        self.assertEqual('hao3 ren2', rc.process_sentence_pinyin('好人', tone_numbers=True, spaces=True))
+
+    def test_build_after_user_words(self):
+        # the words added to jieba for the user entries don't end up in maps built afterwards
+        jieba_dictionary = os.path.join(self.temp_dir.name, 'jieba_dict.txt')
+        with open(jieba_dictionary, 'w', encoding='utf8') as outfile:
+            outfile.write('一仆 100 n\n一碌 100 n\n')
+        source_filename = os.path.join(self.temp_dir.name, 'dictionary.txt')
+        with open(source_filename, 'w', encoding='utf8') as outfile:
+            outfile.write('一仆一碌 一仆一碌 [yi1 pu1 yi1 lu4] {jat1 puk1 jat1 luk1} /to stumble/\n')
+        rc = make_conversion(self.LINES, 'jieba', self.filename)
+        rc.JIEBA_DICTIONARY_FILENAME = jieba_dictionary
+        rc.DICTIONARY_FILES = [(source_filename, 'cccanto')]
+        # the global jieba tokenizer keeps its dictionary
+        rc.jieba_dictionary_loaded = True
+        rc.conversion_data.get_build_cache_dir = lambda: os.path.join(self.temp_dir.name, 'build_cache')
+        rc.add_entries(['一仆一碌 一仆一碌 [yi1 pu1 yi1 lu4] {jat1 puk1 jat1 luk1} /to stumble/'])
+        self.assertEqual(['一仆一碌'], rc.segmenter.segment('一仆一碌'))
+        data = pinyin_jyutping_sentence.ConversionData()
+        # jieba writes the cache of the dictionary of the new tokenizer in the temp directory
+        with unittest.mock.patch.object(tempfile, 'tempdir', self.temp_dir.name):
+            rc.build_conversion_data(data, pinyin=False, jyutping=True, workers=1)
+        self.assertEqual(['jat1', 'puk1'], data.jyutping_word_map['一仆'])
+        self.assertNotIn('一仆一碌', data.jyutping_word_map)
+
+    def test_binary_cache(self):
+        # the memory-mapped tables stay read-only, the cache file is written without the user entries
+        data = self.rc.conversion_data
+        cache_filename = os.path.join(self.temp_dir.name, 'data.bin')
+        data.serialize_binary(cache_filename)
+        data.deserialize_binary(cache_filename)
+        self.rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /x/", "貓 猫 [mao1] {maau1} /cat/"])
+        self.assertEqual('hao4 ren2', self.rc.process_sentence_pinyin('好人', tone_numbers=True, spaces=True))
+        self.assertEqual('mao1', self.rc.process_sentence_pinyin('猫', tone_numbers=True))
+        self.assertIsInstance(data.pinyin_word_map.base, pinyin_jyutping_sentence.binary_cache.MappedTable)
+        other_filename = os.path.join(self.temp_dir.name, 'other.bin')
+        data.serialize_binary(other_filename)
+        other_data = pinyin_jyutping_sentence.ConversionData()
+        other_data.deserialize_binary(other_filename)
+        self.assertEqual(['hao3', 'ren2'], other_data.pinyin_word_map['好人'])
+        self.assertNotIn('猫', other_data.pinyin_char_map)
+        other_data.binary_cache.close()
+
+    def test_sentence_cache(self):
+        rc = self.rc
+        rc.enable_sentence_cache(max_entries=100)
+        rc.process_sentence_pinyin('一个')
+        rc.process_sentence_pinyin('好人')
+        rc.add_entries(["好人 好人 [hao4 ren2] {hou3 jan4} /x/"])
+        # only the sentences with a changed character are dropped
+        self.assertEqual(1, rc.sentence_cache_stats()['entries'])
+        self.assertEqual('hàorén', rc.process_sentence_pinyin('好人'))
+        rc.process_sentence_pinyin('一个')
+        self.assertEqual(1, rc.sentence_cache_stats()['hits'])
+
+
+class AnalyzeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["銀行 银行 [yin2 hang2] {ngan4 hong4} /bank/",
+                                   "行 行 [xing2] {hang4} /to walk/",
+                                   "行 行 [xing2] {hang4} /OK/",
+                                   "行 行 [xing2] {hang4} /to do/",
+                                   "行 行 [hang2] {hong4} /row/",
+                                   "了 了 [le5] {liu5} /particle/"], 'trie')
+
+    def test_analyze(self):
+        Token = pinyin_jyutping_sentence.analysis.Token
+        CharacterReadings = pinyin_jyutping_sentence.analysis.CharacterReadings
+        tokens = self.rc.analyze('银行行了！', tone_numbers=True)
+        self.assertEqual([
+            Token('银行', 'word', 'yin2hang2', [CharacterReadings('银', 'yin2', [('yin2', 1)]),
+                                                CharacterReadings('行', 'hang2', [('xing2', 6), ('hang2', 4)])]),
+            Token('行', 'char', 'xing2', [CharacterReadings('行', 'xing2', [('xing2', 6), ('hang2', 4)])]),
+            Token('了', 'char', 'le5', [CharacterReadings('了', 'le5', [('le5', 2)])]),
+            Token('！', 'unknown', '！', [CharacterReadings('！', None, [])]),
+        ], tokens)
+
+    def test_same_result_as_conversion(self):
+        for sentence in ['银行行了！', '行了 OK', '']:
+            for options in [(False, False, False), (True, True, False), (False, True, True)]:
+                tokens = self.rc.analyze(sentence, 'pinyin', *options)
+                self.assertEqual(self.rc.process_sentence_pinyin(sentence, *options), ' '.join(token.romanization for token in tokens))
+                tokens = self.rc.analyze(sentence, 'jyutping', *options[:2])
+                self.assertEqual(self.rc.process_sentence_jyutping(sentence, *options[:2]), ' '.join(token.romanization for token in tokens))
+
+    def test_top_n(self):
+        token, = self.rc.analyze('行', mode='jyutping', top_n=1)
+        self.assertEqual([('hàng', 6)], token.characters[0].readings)
+        with self.assertRaises(ValueError):
+            self.rc.analyze('行', mode='unknown')
+
+
+class ConvertTests(unittest.TestCase):
+
+    setUp = AnalyzeTests.setUp
+
+    def test_convert(self):
+        self.assertEqual({'pinyin': 'yínháng xíng le ！', 'jyutping_tone_numbers': 'ngan4hong4 hang4 liu5 ！', 'pinyin_superscript': 'yin²hang² xing² le⁵ ！'},
+            self.rc.convert('银行行了！', outputs=['pinyin', 'jyutping_tone_numbers', 'pinyin_superscript']))
+        self.assertEqual({'jyutping_no_tones': 'ngan hong'}, self.rc.convert('银行', outputs=['jyutping_no_tones'], spaces=True))
+        with self.assertRaises(ValueError):
+            self.rc.convert('银行', outputs=['zhuyin'])
+
+    def test_same_result_as_conversion(self):
+        outputs = [output for output, (mode, style) in self.rc.CONVERT_OUTPUTS.items() if style != 'superscript']
+        for sentence in ['银行行了！', '行了 OK', '']:
+            for spaces in [False, True]:
+                results = self.rc.convert(sentence, outputs, spaces=spaces)
+                for output in outputs:
+                    mode, style = self.rc.CONVERT_OUTPUTS[output]
+                    tone_numbers, remove_tones = pinyin_jyutping_sentence.tones.DECODE_ARGUMENTS[style]
+                    convert = self.rc.process_sentence_pinyin if mode == 'pinyin' else self.rc.process_sentence_jyutping
+                    self.assertEqual(convert(sentence, tone_numbers, spaces, remove_tones), results[output])
+
+    def test_data_changes(self):
+        self.rc.analyze('行')
+        data = self.rc.conversion_data
+        data.pinyin_char_map['行'] = {'hang2': 1}
+        data.compute_best_readings()
+        data.mark_modified()
+        token, = self.rc.analyze('行', tone_numbers=True)
+        self.assertEqual(pinyin_jyutping_sentence.analysis.CharacterReadings('行', 'hang2', [('hang2', 1)]), token.characters[0])
+
+
+class ShortInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["銀行 银行 [yin2 hang2] {ngan4 hong4} /bank/",
+                                   "行 行 [xing2] {hang4} /to walk/",
+                                   "我 我 [wo3] {ngo5} /I/",
+                                   "很 很 [hen3] {han2} /very/",
+                                   "好 好 [hao3] {hou2} /good/"])
+        data = self.rc.conversion_data
+        # jieba doesn't keep this one whole
+        data.pinyin_word_map['我很好'] = ['wo3', 'hen3', 'hao3']
+
+    def convert_full(self, sentence, *options):
+        data = self.rc.conversion_data
+        return ' '.join(self.rc.get_romanization(word, data.pinyin_word_map, data.pinyin_char_map, self.rc.decode_pinyin, *options, data.pinyin_best_reading_map)
+                        for word in self.rc.segmenter.segment(sentence))
+
+    def test_same_result(self):
+        for sentence in ['行', '银行', '銀行', '我很好', '好行', 'x', ' ', '', '，', 'ab', '行行行行行']:
+            for options in [(False, False, False), (True, True, False), (False, True, True)]:
+                self.assertEqual(self.convert_full(sentence, *options), self.rc.process_sentence_pinyin(sentence, *options))
+        self.assertEqual('wǒ hěn hǎo', self.rc.process_sentence_pinyin('我很好'))
+        self.assertEqual('ngan4 hong4', self.rc.process_sentence_jyutping('銀行', tone_numbers=True, spaces=True))
+
+    def test_no_segmentation(self):
+        segmented = []
+        segment = self.rc.segmenter.segment
+        self.rc.segmenter.segment = lambda sentence: segmented.append(sentence) or segment(sentence)
+        self.assertEqual('wǒ', self.rc.process_sentence_pinyin('我'))
+        self.assertEqual([], segmented)
+        # a word is segmented once, to check that the segmenter keeps it whole
+        for i in range(3):
+            self.assertEqual('yínháng', self.rc.process_sentence_pinyin('银行'))
+        self.assertEqual(['银行'], segmented)
+        # which is checked again after the data changes
+        self.rc.conversion_data.mark_modified()
+        self.rc.process_sentence_pinyin('银行')
+        self.assertEqual(['银行', '银行'], segmented)
+
+
+class DataArtifactTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.previous_cache_dir = os.environ.get('PINYIN_JYUTPING_SENTENCE_CACHE_DIR')
+        os.environ['PINYIN_JYUTPING_SENTENCE_CACHE_DIR'] = self.temp_dir.name
+        self.source_filename = os.path.join(self.temp_dir.name, 'dictionary.txt')
+        with open(self.source_filename, 'w', encoding='utf8') as outfile:
+            outfile.write("好 好 [hao4] {hou3} /to like/\n")
+        self.rc = self.get_conversion()
+
+    def tearDown(self):
+        if self.previous_cache_dir is None:
+            del os.environ['PINYIN_JYUTPING_SENTENCE_CACHE_DIR']
+        else:
+            os.environ['PINYIN_JYUTPING_SENTENCE_CACHE_DIR'] = self.previous_cache_dir
+        self.temp_dir.cleanup()
+
+    def get_conversion(self):
+        rc = pinyin_jyutping_sentence.RomanizationConversion(segmenter='trie')
+        rc.get_source_files = lambda: [('dictionary.txt', self.source_filename)]
+        rc.build_conversion_data = self.build_conversion_data
+        return rc
+
+    def build_conversion_data(self, data, pinyin, jyutping, workers):
+        with open(self.source_filename, encoding='utf8') as input_file:
+            for line in input_file:
+                self.rc.process_line(line, data.jyutping_word_map, data.pinyin_word_map, data.jyutping_char_map, data.pinyin_char_map)
+        data.compute_best_readings()
+
+    def test_cache_dir(self):
+        data = self.rc.conversion_data
+        self.assertEqual(os.path.join(self.temp_dir.name, 'mandarin_cantonese_data.bin'), data.get_data_artifact_path())
+        self.assertEqual(os.path.join(self.temp_dir.name, 'build_cache'), data.get_build_cache_dir())
+        self.assertEqual(self.temp_dir.name, os.path.dirname(data.get_user_dictionary_file_path()))
+
+    def test_user_dictionary_new_cache_dir(self):
+        # the data is loaded from the package, nothing created the cache directory yet
+        cache_dir = os.path.join(self.temp_dir.name, 'new', 'cache')
+        os.environ['PINYIN_JYUTPING_SENTENCE_CACHE_DIR'] = cache_dir
+        rc = make_conversion(["好 好 [hao3] {hou2} /good/"])
+        rc.add_entries(["好 好 [hao4] {hou3} /to like/"], persist=True)
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir, rc.conversion_data.USER_DICTIONARY_FILENAME)))
+        self.assertEqual('hao4', rc.process_sentence_pinyin('好', tone_numbers=True))
+
+    def test_build_data(self):
+        filename = self.rc.conversion_data.get_data_artifact_path()
+        self.assertTrue(self.rc.build_data())
+        self.assertFalse(self.rc.build_data())
+        self.assertTrue(self.rc.build_data(force=True))
+
+        # loaded before the artifact shipped in the package
+        rc = self.get_conversion()
+        self.assertEqual('hao4', rc.process_sentence_pinyin('好', tone_numbers=True))
+        metadata = rc.conversion_data.get_metadata()
+        self.assertEqual(str(rc.BUILD_CACHE_VERSION), metadata['data_version'])
+        self.assertEqual([os.path.getsize(self.source_filename), rc.get_file_digest(self.source_filename)], json.loads(metadata['sources'])['dictionary.txt'])
+
+        # a corrupt artifact gets rebuilt
+        with open(filename, 'r+b') as filehandle:
+            filehandle.seek(-1, os.SEEK_END)
+            filehandle.write(b'\xff')
+        with self.assertRaises(pinyin_jyutping_sentence.binary_cache.BinaryCacheError):
+            pinyin_jyutping_sentence.binary_cache.BinaryCache(filename, verify=True)
+        self.assertTrue(self.rc.build_data())
+        pinyin_jyutping_sentence.binary_cache.BinaryCache(filename, verify=True).close()
+
+        # so does one built from other dictionary files
+        with open(self.source_filename, 'a', encoding='utf8') as outfile:
+            outfile.write("人 人 [ren2] {jan4} /person/\n")
+        with self.assertRaises(pinyin_jyutping_sentence.binary_cache.BinaryCacheError):
+            self.get_conversion().conversion_data.deserialize_binary(filename, check=self.rc.check_data_artifact)
+        self.assertTrue(self.rc.build_data())
+
+    def test_truncated_artifact(self):
+        # falls back to building the maps, whatever is left of the file
+        filename = self.rc.conversion_data.get_data_artifact_path()
+        self.rc.build_data()
+        full_size = os.path.getsize(filename)
+        for size in [0, 10, 40, full_size // 2, full_size - 1]:
+            self.rc.build_data(force=True)
+            with open(filename, 'r+b') as filehandle:
+                filehandle.truncate(size)
+            for verify in [False, True]:
+                with self.assertRaises(pinyin_jyutping_sentence.binary_cache.BinaryCacheError):
+                    pinyin_jyutping_sentence.binary_cache.BinaryCache(filename, verify=verify)
+            rc = self.get_conversion()
+            rc.conversion_data.get_binary_cache_file_path = lambda: os.path.join(self.temp_dir.name, 'missing.bin')
+            self.assertEqual('hào', rc.process_sentence_pinyin('好'))
+
+    def test_load_files_rebuilds(self):
+        # without a valid artifact, only the requested maps are built from the dictionaries. the artifact is
+        # written for the next time once both romanizations are built
+        built = []
+        rc = self.get_conversion()
+        rc.build_conversion_data = lambda data, pinyin, jyutping, workers: built.append((pinyin, jyutping)) or self.build_conversion_data(data, pinyin, jyutping, workers)
+        rc.conversion_data.get_binary_cache_file_path = lambda: os.path.join(self.temp_dir.name, 'missing.bin')
+        self.assertEqual('hou3', rc.process_sentence_jyutping('好', tone_numbers=True))
+        self.assertEqual([(False, True)], built)
+        self.assertFalse(os.path.isfile(rc.conversion_data.get_data_artifact_path()))
+        rc.warm_up(pinyin=True)
+        self.assertEqual([(False, True), (True, False)], built)
+        self.assertTrue(os.path.isfile(rc.conversion_data.get_data_artifact_path()))
+        self.assertFalse(self.rc.build_data())
+
+
+class SharedDataTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rc = make_conversion(["銀行 银行 [yin2 hang2] {ngan4 hong4} /bank/",
+                                   "行 行 [xing2] {hang4} /to walk/",
+                                   "行 行 [xing2] {hang4} /to do/"], 'jieba', os.path.join(tempfile.gettempdir(), 'no_user_data.json'))
+
+    def test_publish_attach(self):
+        name = self.rc.publish_shared_data()
+        try:
+            # the publishing process switches to the shared tables
+            self.assertIsInstance(self.rc.conversion_data.pinyin_word_map, pinyin_jyutping_sentence.binary_cache.MappedTable)
+            self.assertEqual('yínháng', self.rc.process_sentence_pinyin('银行'))
+
+            rc = pinyin_jyutping_sentence.RomanizationConversion()
+            rc.user_dictionary = self.rc.user_dictionary
+            rc.attach_shared_data(name)
+            self.assertEqual('ngan4hong4', rc.process_sentence_jyutping('銀行', tone_numbers=True))
+            self.assertEqual({'hong4': 2, 'hang4': 4}, rc.conversion_data.jyutping_char_map['行'])
+
+            # another process, through the environment variable
+            code = 'import pinyin_jyutping_sentence; print(pinyin_jyutping_sentence.pinyin("行", tone_numbers=True))'
+            environment = dict(os.environ, **{pinyin_jyutping_sentence.RomanizationConversion.SHARED_DATA_ENVIRONMENT_VARIABLE: name})
+            output = subprocess.check_output([sys.executable, '-c', code], env=environment, cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual('xing2', output.decode('utf-8').strip())
+        finally:
+            self.rc.conversion_data.binary_cache.unlink()
+        with self.assertRaises(FileNotFoundError):
+            pinyin_jyutping_sentence.binary_cache.SharedBinaryCache(name)
+        # processes which are attached keep working
+        self.assertEqual('xíng', self.rc.process_sentence_pinyin('行'))
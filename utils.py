@@ -1,7 +1,9 @@
 import pinyin_jyutping_sentence
 
 def build_file_cache():
-    pinyin_jyutping_sentence.romanization_conversion.conversion_data.serialize()
+    # the data artifact shipped in the package, same as python -m pinyin_jyutping_sentence build-data --output ... --force
+    rc = pinyin_jyutping_sentence.romanization_conversion
+    rc.build_data(rc.conversion_data.get_binary_cache_file_path(), force=True)
 
 if __name__ == '__main__':
     build_file_cache()
\ No newline at end of file